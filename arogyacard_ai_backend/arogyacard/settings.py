@@ -10,11 +10,16 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
+from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+load_dotenv()
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -43,6 +48,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'card.middleware.ServerTimingMiddleware',  # Outermost, so it times the whole request
+    'card.middleware.ProfilingMiddleware',  # Only active with PROFILE_TOKEN or PROFILE_SAMPLE_RATE set
+    'card.middleware.CompressionMiddleware',  # Compresses the final response body (RESPONSE_COMPRESSION)
     'corsheaders.middleware.CorsMiddleware',  # Add this at the top
     'django.middleware.common.CommonMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -55,6 +63,23 @@ MIDDLEWARE = [
     
 ]
 CORS_ALLOW_ALL_ORIGINS = True
+# Browsers may send retries with an Idempotency-Key, resumable upload chunks with a Content-Range,
+# and revalidate cacheable GETs with If-None-Match
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key", "content-range", "if-none-match")
+CORS_EXPOSE_HEADERS = ["Idempotent-Replayed", "Retry-After", "ETag"]
+
+REST_FRAMEWORK = {
+    'EXCEPTION_HANDLER': 'card.views.upstream_exception_handler',
+    'DEFAULT_RENDERER_CLASSES': [
+        'card.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'card.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
 
 
 ROOT_URLCONF = 'arogyacard.urls'
@@ -81,11 +106,71 @@ WSGI_APPLICATION = 'arogyacard.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Configured from the environment: DB_ENGINE=sqlite (default) or DB_ENGINE=postgres.
+
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite').lower()
+
+if DB_ENGINE in ('postgres', 'postgresql'):
+    # Uses psycopg 3 (`psycopg[binary,pool]` in requirements.txt).
+    # DB_POOL=true uses Django's psycopg connection pool instead of persistent connections.
+    DB_POOL = os.getenv('DB_POOL', 'false').lower() in ('1', 'true', 'yes')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'arogyacard'),
+            'USER': os.getenv('DB_USER', 'postgres'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            # Pooled connections are returned to the pool, so they must not also be persistent
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.getenv('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+                    'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+                    'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+                },
+            } if DB_POOL else {},
+        }
     }
+else:
+    # WAL lets readers proceed while a chat turn is being written; busy_timeout makes
+    # writers wait for the lock instead of failing with "database is locked".
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+                # Take the write lock when the transaction starts rather than on first write
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS};'
+                ),
+            },
+        }
+    }
+
+
+# Caches
+# The last good upstream results (card/upstream.py) live in files shared by the workers on
+# a host, so a fallback remembered by one worker can be served by another and survives restarts.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'upstream_stale': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('UPSTREAM_STALE_DIR', str(BASE_DIR / 'upstream_stale')),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('UPSTREAM_STALE_MAX_ENTRIES', '20000'))},
+    },
 }
 
 
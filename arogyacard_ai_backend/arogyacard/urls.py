@@ -16,8 +16,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from card.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('card.urls')),  # Include app-level URLs
+    path('metrics', metrics_view, name='metrics'),
 ]
\ No newline at end of file
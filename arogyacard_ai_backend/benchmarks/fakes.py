@@ -0,0 +1,264 @@
+"""
+Local stand-ins for every upstream the card app talks to.
+
+HTTP upstreams (Places, YouTube, Custom Search, the IDSP site) are served by
+`FakeUpstreamServer`; SDK clients (Groq via LangChain, Gemini, GCS,
+googlemaps, Event Registry) are replaced in-process by `install_fakes`.
+Both inject latency and errors according to a shared `FaultProfile`.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from contextlib import ExitStack
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import urlparse
+from langchain_core.messages import AIMessage
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def load_fixture(name, mode="r"):
+    with open(os.path.join(FIXTURES_DIR, name), mode) as fixture:
+        return fixture.read()
+
+
+class FakeUpstreamError(RuntimeError):
+    """Raised by SDK stand-ins when a fault is injected."""
+
+
+class FaultProfile:
+    """Latency and error injection shared by the HTTP server and SDK stand-ins."""
+
+    def __init__(self, latency_ms=50, jitter_ms=20, error_rate=0.0, overrides=None, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        # service -> {"latency_ms": ..., "jitter_ms": ..., "error_rate": ...}
+        self.overrides = overrides or {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _setting(self, service, name):
+        return self.overrides.get(service, {}).get(name, getattr(self, name))
+
+    def apply(self, service):
+        """Sleep for the service's simulated latency; return True if this call should fail."""
+        with self._lock:
+            jitter = self._random.uniform(-1, 1) * self._setting(service, "jitter_ms")
+            fail = self._random.random() < self._setting(service, "error_rate")
+        time.sleep(max(0.0, self._setting(service, "latency_ms") + jitter) / 1000)
+        return fail
+
+    def check(self, service):
+        if self.apply(service):
+            raise FakeUpstreamError(f"Injected {service} failure")
+
+
+class FakeUpstreamServer:
+    """Threaded local HTTP server replaying recorded upstream responses."""
+
+    ROUTES = {
+        "/places": ("places", "places.json", "application/json"),
+        "/youtube": ("youtube", "youtube.json", "application/json"),
+        "/cse": ("cse", "cse.json", "application/json"),
+        "/idsp": ("idsp", "idsp_index.html", "text/html; charset=utf-8"),
+        "/idsp/week.pdf": ("idsp", "idsp_week.pdf", "application/pdf"),
+    }
+
+    def __init__(self, profile, host="127.0.0.1", port=0):
+        self.profile = profile
+        self.bodies = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                route = urlparse(self.path).path
+                if route not in server.ROUTES:
+                    self.send_error(404)
+                    return
+                service, fixture, content_type = server.ROUTES[route]
+                if server.profile.apply(service):
+                    self.send_error(503, "Injected failure")
+                    return
+                body = server.bodies[fixture]
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        for _, fixture, _ in self.ROUTES.values():
+            body = load_fixture(fixture, "rb")
+            self.bodies[fixture] = body.replace(b"{{BASE_URL}}", self.url.encode())
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeChatModel:
+    """Stands in for the ChatGroq model: usable in `prompt | llm` chains and via `predict`."""
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def __call__(self, prompt_value):
+        self.profile.check("groq")
+        text = prompt_value.to_string() if hasattr(prompt_value, "to_string") else str(prompt_value)
+        turns = text.count("Bot:")
+        if turns >= 3:
+            content = json.dumps({
+                "symptoms": "fever, body ache, headache",
+                "potential_cause": "Dengue fever",
+                "recommended_remedy": "Rest, fluids and paracetamol; avoid NSAIDs",
+                "consultation_advice": "See a doctor for a platelet count",
+            })
+        else:
+            content = "How many days have you had these symptoms? Is the fever accompanied by body ache or rash?"
+        return AIMessage(content=content)
+
+    def invoke(self, prompt_value, *args, **kwargs):
+        return self(prompt_value)
+
+    def predict(self, text, *args, **kwargs):
+        self.profile.check("groq")
+        return json.dumps({"disease": "Dengue fever" if "dengue" in text.lower() else "Viral fever"})
+
+
+class FakeGenaiClient:
+    """Stands in for `google.genai.Client` (file upload and streaming generation)."""
+
+    def __init__(self, profile, **kwargs):
+        self.profile = profile
+        self.files = SimpleNamespace(upload=self._upload)
+        self.models = SimpleNamespace(generate_content_stream=self._generate_content_stream)
+
+    def _upload(self, file, **kwargs):
+        self.profile.check("gemini")
+        name = os.path.basename(str(file))
+        return SimpleNamespace(uri=f"https://generativelanguage.invalid/files/{name}", mime_type="application/pdf")
+
+    def _generate_content_stream(self, model, contents, config=None):
+        self.profile.check("gemini")
+        prompt = " ".join(
+            part.text or "" for content in contents for part in content.parts
+        )
+        fixture = "gemini_outbreaks.json" if "outbreak" in prompt.lower() else "gemini_report.json"
+        text = load_fixture(fixture)
+        # Stream in a few chunks like the real API
+        size = max(1, len(text) // 4)
+        for start in range(0, len(text), size):
+            yield SimpleNamespace(text=text[start:start + size])
+
+
+class FakeStorageClient:
+    """Stands in for `google.cloud.storage.Client`."""
+
+    def __init__(self, profile, *args, **kwargs):
+        self.profile = profile
+
+    def bucket(self, name):
+        return SimpleNamespace(blob=lambda blob_name: FakeBlob(self.profile, name, blob_name))
+
+
+class FakeBlob:
+    def __init__(self, profile, bucket_name, name):
+        self.profile = profile
+        self.bucket_name = bucket_name
+        self.name = name
+        self.content_type = None
+
+    def upload_from_filename(self, filename, **kwargs):
+        self.profile.check("gcs")
+
+    def upload_from_file(self, file_obj, **kwargs):
+        self.profile.check("gcs")
+
+    def upload_from_string(self, data, **kwargs):
+        self.profile.check("gcs")
+
+    def compose(self, sources, **kwargs):
+        self.profile.check("gcs")
+
+    def delete(self, **kwargs):
+        self.profile.check("gcs")
+
+    def generate_signed_url(self, **kwargs):
+        return f"https://storage.invalid/{self.bucket_name}/{self.name}?X-Goog-Signature=bench"
+
+
+class FakeGoogleMapsClient:
+    """Stands in for `googlemaps.Client`; geocodes to stable pseudo-coordinates inside India."""
+
+    def __init__(self, profile, *args, **kwargs):
+        self.profile = profile
+
+    def geocode(self, address, **kwargs):
+        self.profile.check("geocoding")
+        digest = hashlib.sha256(address.encode()).digest()
+        lat = 8 + digest[0] / 255 * 26
+        lng = 69 + digest[1] / 255 * 28
+        return [{"geometry": {"location": {"lat": round(lat, 4), "lng": round(lng, 4)}}}]
+
+
+class FakeEventRegistry:
+    """Stands in for `eventregistry.EventRegistry`."""
+
+    def __init__(self, profile, *args, **kwargs):
+        self.profile = profile
+
+    def getLocationUri(self, location, *args, **kwargs):
+        self.profile.check("event_registry")
+        return "http://en.wikipedia.org/wiki/" + location.split(",")[0].strip().replace(" ", "_")
+
+
+class FakeQueryArticlesIter:
+    """Stands in for `eventregistry.QueryArticlesIter`."""
+
+    def __init__(self, profile, **kwargs):
+        self.profile = profile
+        self.kwargs = kwargs
+
+    def execQuery(self, er, sortBy="date", maxItems=100, **kwargs):
+        self.profile.check("event_registry")
+        articles = json.loads(load_fixture("news.json"))["articles"]
+        return iter(articles[:maxItems])
+
+
+def install_fakes(profile, server):
+    """
+    Point every upstream used by the card app at the local stand-ins.
+    Returns an ExitStack that undoes the patches when closed.
+    """
+    stack = ExitStack()
+    patches = {
+        "card.utils.llm": FakeChatModel(profile),
+        "card.utils.PLACES_TEXT_SEARCH_URL": f"{server.url}/places",
+        "card.content.YOUTUBE_SEARCH_URL": f"{server.url}/youtube",
+        "card.content.GOOGLE_CSE_URL": f"{server.url}/cse",
+        "card.clusters.IDSP_REPORTS_URL": f"{server.url}/idsp",
+        "google.genai.Client": lambda *args, **kwargs: FakeGenaiClient(profile, **kwargs),
+        "card.report.storage.Client": lambda *args, **kwargs: FakeStorageClient(profile),
+        "card.clusters.googlemaps.Client": lambda *args, **kwargs: FakeGoogleMapsClient(profile),
+        "card.news.EventRegistry": lambda *args, **kwargs: FakeEventRegistry(profile),
+        "card.news.QueryArticlesIter": lambda **kwargs: FakeQueryArticlesIter(profile, **kwargs),
+    }
+    for target, replacement in patches.items():
+        stack.enter_context(mock.patch(target, replacement))
+    return stack
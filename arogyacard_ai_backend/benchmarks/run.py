@@ -0,0 +1,312 @@
+"""
+Offline benchmark / load test for the card API.
+
+Drives every endpoint in card/urls.py through the Django request stack with
+all upstream APIs replaced by local fakes, and writes p50/p95/p99 latency,
+throughput and peak RSS to a JSON report.
+
+    cd arogyacard_ai_backend
+    python -m benchmarks.run --concurrency 8 --requests 200 --output bench.json
+    python -m benchmarks.run --baseline bench.json --output bench-new.json
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_ENV = {
+    "DJANGO_SETTINGS_MODULE": "arogyacard.settings",
+    "GROQ_API_KEY": "bench",
+    "GEMINI_API_KEY": "bench",
+    "GOOGLE_PLACES_API_KEY": "bench",
+    "YOUTUBE_API_KEY": "bench",
+    "SEARCH_ENGINE_ID": "bench",
+    "EVENT_REGISTRY_API_KEY": "bench",
+    "BUCKET_NAME": "bench",
+    # Real API quotas would throttle a load test; set QUOTA_ENABLED=true to measure the limiter itself
+    "QUOTA_ENABLED": "false",
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def is_error(status):
+    """Anything but a success or a 304 revalidation, e.g. a 429 or 409 under load, counts as an error."""
+    return not (200 <= int(status) < 300 or int(status) == 304)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+
+def build_scenarios(fixtures_dir):
+    """One request builder per URL name in card/urls.py; each takes the request index."""
+    with open(os.path.join(fixtures_dir, "idsp_week.pdf"), "rb") as pdf:
+        report_bytes = pdf.read()
+
+    def chat(client, i):
+        return client.post("/api/chat/", {"hid": f"bench-chat-{i % 50}", "query": f"I have had fever for {i % 5 + 1} days"},
+                           content_type="application/json")
+
+    def upload_report(client, i):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        document = SimpleUploadedFile(f"bench-report-{i}.pdf", report_bytes, content_type="application/pdf")
+        return client.post("/api/upload-report/", {"document": document})
+
+    def upload_init(client, i):
+        return client.post("/api/uploads/", {"filename": f"bench-report-{i}.pdf", "size": len(report_bytes)},
+                           content_type="application/json")
+
+    def send_chunks(client, upload_id):
+        from card.uploads import CHUNK_SIZE
+        for start in range(0, len(report_bytes), CHUNK_SIZE):
+            chunk = report_bytes[start:start + CHUNK_SIZE]
+            response = client.put(f"/api/uploads/{upload_id}/", chunk, content_type="application/octet-stream",
+                                  headers={"Content-Range": f"bytes {start}-{start + len(chunk) - 1}/{len(report_bytes)}"})
+        return response
+
+    def upload_chunk(client, i):
+        return send_chunks(client, upload_init(client, i).json()["upload_id"])
+
+    def upload_finalize(client, i):
+        upload_id = upload_init(client, i).json()["upload_id"]
+        send_chunks(client, upload_id)
+        return client.post(f"/api/uploads/{upload_id}/finalize/")
+
+    def get_hospitals(client, i):
+        return client.post("/api/get-hospitals/", {"hid": "bench-seeded", "location": "New Delhi"},
+                           content_type="application/json")
+
+    def get_news(client, i):
+        return client.post("/api/get-news/", {"city": ["Mumbai", "Delhi", "Pune"][i % 3], "country": "India"},
+                           content_type="application/json")
+
+    def get_news_digest(client, i):
+        cities = ["Mumbai", "Delhi", "Pune", "Chennai", "Kolkata", "Bengaluru"]
+        return client.post("/api/get-news/digest/", {"cities": cities[i % 3:i % 3 + 4], "country": "India"},
+                           content_type="application/json")
+
+    def get_outbreaks(client, i):
+        return client.post("/api/get-outbreaks/", {"year": 2025, "week": i % 10 + 1},
+                           content_type="application/json")
+
+    def get_content(client, i):
+        return client.post("/api/get-content/", {"hid": "bench-seeded"}, content_type="application/json")
+
+    def conditional_get(path, params):
+        """A repeat view: revalidate with the ETag this client got last time for the same URL."""
+        def scenario(client, i):
+            query = params(i)
+            etags = client.__dict__.setdefault("bench_etags", {})
+            key = (path, tuple(sorted(query.items())))
+            headers = {"If-None-Match": etags[key]} if key in etags else {}
+            response = client.get(path, query, headers=headers)
+            if response.get("ETag"):
+                etags[key] = response["ETag"]
+            return response
+        return scenario
+
+    def disease_stats(client, i):
+        return client.get("/api/disease-stats/", {"days": 30})
+
+    def export(client, i):
+        if not getattr(client, "bench_admin", False):
+            from django.contrib.auth import get_user_model
+            client.force_login(get_user_model().objects.get(username="bench-admin"))
+            client.bench_admin = True
+        return client.get(f"/api/export/{['conversations', 'diagnoses'][i % 2]}/")
+
+    return {
+        "chat_api": chat,
+        "upload_report_api": upload_report,
+        "upload_init_api": upload_init,
+        "upload_chunk_api": upload_chunk,
+        "upload_finalize_api": upload_finalize,
+        "get_hospitals_api": get_hospitals,
+        "get_news_api": get_news,
+        "get_news_digest_api": get_news_digest,
+        "get_outbreaks_api": get_outbreaks,
+        "get_content_api": get_content,
+        "disease_stats_api": disease_stats,
+        "export_api": export,
+        # Cacheable GET variants, run by default but not tied to a URL name of their own
+        "get_news_api:get": conditional_get("/api/get-news/", lambda i: {"city": ["Mumbai", "Delhi", "Pune"][i % 3]}),
+        "get_outbreaks_api:get": conditional_get("/api/get-outbreaks/", lambda i: {"year": 2025, "week": i % 10 + 1}),
+        "get_content_api:get": conditional_get("/api/get-content/", lambda i: {"disease": "Dengue"}),
+    }
+
+
+def seed_database():
+    from django.contrib.auth import get_user_model
+    from card.models import ChatHistory
+    get_user_model().objects.create_superuser("bench-admin", "bench@example.invalid", "bench")
+    # Enough history for the export scenario to stream more than a single chunk
+    ChatHistory.objects.bulk_create([
+        ChatHistory(hid=f"bench-history-{n}", conversation={"I have a cough": "For how long?", "A week": "Any fever?"})
+        for n in range(5000)
+    ])
+    ChatHistory.objects.update_or_create(hid="bench-seeded", defaults={"conversation": {
+        "I have fever and body ache": "How many days have you had a fever?",
+        "3 days, with headache": "Any rash or bleeding gums?",
+        "No rash": '{"symptoms": "fever, body ache", "potential_cause": "Dengue fever", '
+                   '"recommended_remedy": "Fluids and rest", "consultation_advice": "See a doctor"}',
+    }})
+
+
+def run_endpoint(name, scenario, requests, concurrency):
+    from django.test import Client
+
+    local = threading.local()
+
+    def one(i):
+        if not hasattr(local, "client"):
+            local.client = Client(HTTP_HOST="localhost", raise_request_exception=False)
+        start = time.perf_counter()
+        response = scenario(local.client, i)
+        size = sum(len(chunk) for chunk in response.streaming_content) if response.streaming else len(response.content)
+        elapsed = time.perf_counter() - start
+        return elapsed, response.status_code, size
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in results)
+    statuses = {}
+    for _, code, _ in results:
+        statuses[str(code)] = statuses.get(str(code), 0) + 1
+    errors = sum(count for code, count in statuses.items() if is_error(code))
+    return {
+        "requests": requests,
+        "errors": errors,
+        "statuses": statuses,
+        "throughput_rps": round(requests / wall, 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 2),
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "mean_response_bytes": round(sum(size for _, _, size in results) / len(results)),
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Return a list of human-readable regressions against a baseline report."""
+    regressions = []
+    for name, current in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if previous[metric] and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {previous[metric]} -> {current[metric]}")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput_rps {previous['throughput_rps']} -> {current['throughput_rps']}")
+        # Per status, so one kind of error replacing another is not hidden by an equal total
+        for status in sorted(set(current["statuses"]) | set(previous["statuses"])):
+            before, after = previous["statuses"].get(status, 0), current["statuses"].get(status, 0)
+            if is_error(status) and after * previous["requests"] > before * current["requests"]:
+                regressions.append(f"{name}: status {status} {before} -> {after}")
+    if baseline.get("peak_rss_mb") and report["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak_rss_mb {baseline['peak_rss_mb']} -> {report['peak_rss_mb']}")
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Offline benchmark for the card API")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--endpoints", nargs="*", help="Scenarios to run: URL names, or <name>:get for GET variants (default: all)")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Mean simulated upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of upstream calls that fail")
+    parser.add_argument("--service-faults", type=json.loads, default={},
+                        help='Per-service overrides, e.g. \'{"gemini": {"latency_ms": 2000}}\'')
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--baseline", help="Earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's own print output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="card-bench-")
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+    os.environ["DB_ENGINE"] = "sqlite"
+    os.environ["DB_NAME"] = os.path.join(workdir, "bench.sqlite3")
+    os.environ["QUOTA_DB"] = os.path.join(workdir, "quota.sqlite3")
+    os.environ["SINGLEFLIGHT_DB"] = os.path.join(workdir, "singleflight.sqlite3")
+    os.environ["UPSTREAM_STALE_DIR"] = os.path.join(workdir, "upstream_stale")
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.urls import get_resolver
+    from .fakes import FIXTURES_DIR, FakeUpstreamServer, FaultProfile, install_fakes
+
+    settings.MEDIA_ROOT = os.path.join(workdir, "media")
+    call_command("migrate", verbosity=0)
+    seed_database()
+
+    scenarios = build_scenarios(FIXTURES_DIR)
+    url_names = [pattern.name for pattern in get_resolver("card.urls").url_patterns if pattern.name]
+    missing = [name for name in url_names if name not in scenarios]
+    if missing:
+        raise SystemExit(f"No benchmark scenario for endpoints: {', '.join(missing)}")
+    selected = args.endpoints or list(scenarios)
+
+    profile = FaultProfile(args.latency_ms, args.jitter_ms, args.error_rate, args.service_faults, args.seed)
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "python": platform.python_version(),
+        "endpoints": {},
+    }
+    app_output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    if not args.verbose:
+        # Injected failures would otherwise log a traceback per request
+        logging.getLogger("django.request").setLevel(logging.CRITICAL)
+    with FakeUpstreamServer(profile) as server, install_fakes(profile, server), app_output:
+        for name in selected:
+            result = run_endpoint(name, scenarios[name], args.requests, args.concurrency)
+            report["endpoints"][name] = result
+            print(f"{name:22} p50={result['p50_ms']:8.1f}ms p95={result['p95_ms']:8.1f}ms "
+                  f"p99={result['p99_ms']:8.1f}ms {result['throughput_rps']:7.1f} req/s errors={result['errors']}",
+                  file=sys.stderr)
+    report["peak_rss_mb"] = peak_rss_mb()
+    print(f"peak RSS: {report['peak_rss_mb']} MB")
+
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
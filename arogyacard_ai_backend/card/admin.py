@@ -1,22 +1,73 @@
 from django.contrib import admin
-from .models import ChatHistory, DiagnosedDisease
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from .db import estimated_row_count
+from .diseases import disease_key, disease_name
+from .models import ChatHistory, DiagnosedDisease, FirstTurnResponse
+
+# Below this many rows an exact COUNT(*) is cheap enough
+EXACT_COUNT_LIMIT = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    """Uses the table size estimate instead of COUNT(*) for unfiltered changelists of large tables."""
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, "query", None)
+        if query is not None and not query.where:
+            estimate = estimated_row_count(self.object_list.model)
+            if estimate is not None and estimate > EXACT_COUNT_LIMIT:
+                self.estimated = True
+                return estimate
+        return super().count
+
+    def page(self, number):
+        page = super().page(number)
+        if getattr(self, "estimated", False) and number > 1 and not page.object_list:
+            # SQLite's highest rowid overestimates once rows were deleted; past the real end, count exactly
+            self.estimated = False
+            self.__dict__["count"] = self.object_list.count()
+            self.__dict__.pop("num_pages", None)
+            page = super().page(min(number, self.num_pages))
+        return page
 
 
 class ChatHistoryAdmin(admin.ModelAdmin):
-    list_display = ("hid", "short_conversation")  # Show hid & conversation preview
-    search_fields = ("hid",)  # Add search functionality
+    list_display = ("hid", "turn_count", "short_conversation", "updated_at")  # Show hid & conversation preview
+    search_fields = ("hid__exact",)  # Exact match, so the search uses the unique index
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # The list only shows the stored preview; the change form loads the conversation on access
+        return super().get_queryset(request).defer("conversation")
 
     def short_conversation(self, obj):
         """Display a short preview of the stored conversation in JSON format"""
-        return str(obj.conversation)[:100] + "..." if len(str(obj.conversation)) > 100 else str(obj.conversation)
+        if obj.archived_at:
+            return f"(archived {obj.archived_at:%Y-%m-%d}) {obj.preview}"
+        return obj.preview
     
     short_conversation.short_description = "Conversation Preview"
 
 
 class DiagnosedDiseaseAdmin(admin.ModelAdmin):
-    list_display = ("hid", "disease", "created_at")  # Show hid, disease, and date
-    search_fields = ("hid__hid", "disease")  # Allow search by hid or disease
+    list_display = ("hid", "disease", "name", "created_at")  # Show hid, disease id and name, and date
+    list_select_related = ("hid",)  # Join ChatHistory instead of one query per row
     list_filter = ("created_at",)  # Filter by date
+    raw_id_fields = ("hid",)  # A select of every ChatHistory would not load
+    search_fields = ("disease",)  # Searched by exact hid or canonical disease id, see get_search_results
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        """Match the exact hid or the canonical id of a disease name, both of which are indexed."""
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(Q(hid__hid=search_term) | Q(disease=disease_key(search_term))), False
 
     def hid(self, obj):
         """Display the `hid` from the related `ChatHistory` model."""
@@ -24,7 +75,21 @@ class DiagnosedDiseaseAdmin(admin.ModelAdmin):
 
     hid.short_description = "Chat History ID"
 
+    def name(self, obj):
+        return disease_name(obj.disease)
+
+    name.short_description = "Disease Name"
+
+
+class FirstTurnResponseAdmin(admin.ModelAdmin):
+    list_display = ("query", "categories", "hits", "enabled", "created_at")
+    list_editable = ("enabled",)  # Workers stop reusing disabled or deleted entries within FIRST_TURN_REFRESH_SECONDS
+    list_filter = ("enabled",)
+    search_fields = ("normalized", "query")
+    ordering = ("-hits",)
+
 
 # Register models with the admin site
 admin.site.register(ChatHistory, ChatHistoryAdmin)
 admin.site.register(DiagnosedDisease, DiagnosedDiseaseAdmin)
+admin.site.register(FirstTurnResponse, FirstTurnResponseAdmin)
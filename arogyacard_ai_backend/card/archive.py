@@ -0,0 +1,150 @@
+"""
+Cold storage for idle conversations.
+
+`archive_idle` moves conversations not updated for a while into compressed
+`ArchivedConversation` rows (zstd when the `zstandard` package is installed,
+gzip otherwise) and leaves an empty stub in the hot ChatHistory table.
+`rehydrate` moves a conversation back when its HID chats again;
+`load_conversation` reads one without moving it.
+"""
+import gzip
+import os
+from datetime import timedelta
+import orjson
+from django.db import transaction
+from django.db.models import Count, Sum, TextField
+from django.db.models.functions import Cast, Coalesce, Length
+from django.utils import timezone
+from .db import retry_on_lock
+from .metrics import increment
+from .models import ArchivedConversation, ChatHistory
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional; gzip is always available
+    zstandard = None
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("CONVERSATION_ARCHIVE_DAYS", "90"))
+ZSTD_LEVEL = int(os.getenv("CONVERSATION_ZSTD_LEVEL", "10"))
+GZIP_LEVEL = 9
+
+
+def compress(conversation):
+    """(codec, compressed bytes, raw size) for a conversation dict."""
+    raw = orjson.dumps(conversation)
+    if zstandard:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw), len(raw)
+    return "gzip", gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0), len(raw)
+
+
+def decompress(codec, data):
+    data = bytes(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Conversation was archived with zstd; install the zstandard package to read it")
+        return orjson.loads(zstandard.ZstdDecompressor().decompress(data))
+    return orjson.loads(gzip.decompress(data))
+
+
+def storage_report():
+    """Sizes of the hot conversation payloads and of the archive, in bytes."""
+    hot = ChatHistory.objects.aggregate(
+        rows=Count("id"),
+        bytes=Coalesce(Sum(Length(Cast("conversation", TextField()))), 0),
+    )
+    cold = ArchivedConversation.objects.aggregate(
+        rows=Count("id"),
+        original_bytes=Coalesce(Sum("original_bytes"), 0),
+        compressed_bytes=Coalesce(Sum("compressed_bytes"), 0),
+    )
+    return {"hot": hot, "archive": cold}
+
+
+@retry_on_lock
+def _archive_one(pk, updated_at):
+    """Archive one conversation unless it changed since it was selected. Returns the archive row or None."""
+    with transaction.atomic():
+        chat_history = ChatHistory.objects.select_for_update().filter(
+            pk=pk, updated_at=updated_at, archived_at__isnull=True
+        ).first()
+        if chat_history is None or not chat_history.conversation:
+            return None
+        codec, data, original_bytes = compress(chat_history.conversation)
+        # Replaces a copy left behind by an earlier archive of this row rather than colliding with it
+        archived, _ = ArchivedConversation.objects.update_or_create(chat_history=chat_history, defaults={
+            "codec": codec, "data": data, "original_bytes": original_bytes,
+            "compressed_bytes": len(data), "turn_count": len(chat_history.conversation),
+        })
+        # update() leaves updated_at alone, so incremental exports do not re-send the stub.
+        # A turn saved since the row was read keeps it hot, and the copy is rolled back.
+        stubbed = ChatHistory.objects.filter(pk=pk, updated_at=updated_at, archived_at__isnull=True).update(
+            conversation={}, archived_at=timezone.now(),
+        )
+        if not stubbed:
+            transaction.set_rollback(True)
+            return None
+    return archived
+
+
+def archive_idle(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=500, limit=None, dry_run=False):
+    """
+    Archive conversations idle for more than `older_than_days`, oldest first.
+    Returns counts and byte totals for what was (or, with dry_run, would be) archived.
+    """
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    candidates = (
+        ChatHistory.objects.filter(updated_at__lt=cutoff, archived_at__isnull=True)
+        .exclude(conversation={})
+        .order_by("updated_at")
+        .values_list("pk", "updated_at")
+    )
+    if limit:
+        candidates = candidates[:limit]
+
+    stats = {"archived": 0, "skipped": 0, "original_bytes": 0, "compressed_bytes": 0}
+    for pk, updated_at in candidates.iterator(chunk_size=batch_size):
+        if dry_run:
+            conversation = ChatHistory.objects.values_list("conversation", flat=True).get(pk=pk)
+            _, data, original_bytes = compress(conversation)
+            archived = ArchivedConversation(original_bytes=original_bytes, compressed_bytes=len(data))
+        else:
+            archived = _archive_one(pk, updated_at)
+        if archived is None:
+            stats["skipped"] += 1
+            continue
+        stats["archived"] += 1
+        stats["original_bytes"] += archived.original_bytes
+        stats["compressed_bytes"] += archived.compressed_bytes
+    if not dry_run:
+        increment("card_conversations_archived_total", stats["archived"])
+    return stats
+
+
+def load_conversation(chat_history):
+    """The conversation of a ChatHistory, read from the archive if it has been archived."""
+    if chat_history.archived_at is None:
+        return chat_history.conversation
+    archived = ArchivedConversation.objects.filter(chat_history=chat_history).first()
+    if archived is None:
+        # Rehydrated by another request since this row was read
+        chat_history.refresh_from_db(fields=["conversation", "archived_at"])
+        return chat_history.conversation
+    return {**decompress(archived.codec, archived.data), **chat_history.conversation}
+
+
+@retry_on_lock
+def rehydrate(chat_history):
+    """Move an archived conversation back into the hot table, updating `chat_history` in place."""
+    if chat_history.archived_at is None:
+        return chat_history
+    with transaction.atomic():
+        current = ChatHistory.objects.select_for_update().get(pk=chat_history.pk)
+        archived = ArchivedConversation.objects.filter(chat_history=current).first()
+        if archived is not None:
+            current.conversation = {**decompress(archived.codec, archived.data), **current.conversation}
+            ChatHistory.objects.filter(pk=current.pk).update(conversation=current.conversation, archived_at=None)
+            archived.delete()
+            increment("card_conversations_rehydrated_total")
+    chat_history.conversation = current.conversation
+    chat_history.archived_at = None
+    return chat_history
@@ -1,23 +1,39 @@
-import requests
 from bs4 import BeautifulSoup
 import urllib3
 import os
 import tempfile
 import json
+from datetime import date, timedelta
 from PyPDF2 import PdfReader, PdfWriter
 from google import genai
 from google.genai import types
 import googlemaps
 from dotenv import load_dotenv
+from .diseases import canonicalize_disease, disease_key, UNKNOWN_DISEASE
+from . import quota, singleflight, upstream
 
 load_dotenv()
 
-# Disable SSL warnings
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# TLS verification for the IDSP site: "true" (default), "false", or the path of a CA bundle
+IDSP_VERIFY_SSL = {"true": True, "false": False}.get(
+    os.getenv("IDSP_VERIFY_SSL", "true").lower(), os.getenv("IDSP_VERIFY_SSL")
+)
+if IDSP_VERIFY_SSL is False:
+    # Disable SSL warnings
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# IDSP page listing the weekly outbreak reports
+IDSP_REPORTS_URL = "https://idsp.mohfw.gov.in/index4.php?lang=1&level=0&linkid=406&lid=3689"
+
+# A week's report is treated as final (no longer revised) once the week ended this long ago
+OUTBREAK_FINAL_AFTER_DAYS = int(os.getenv("OUTBREAK_FINAL_AFTER_DAYS", "28"))
 
 def download_pdf(pdf_url):
     # Download the PDF from the given URL
-    pdf_response = requests.get(pdf_url, verify=False)
+    try:
+        pdf_response = upstream.get("idsp", pdf_url, verify=IDSP_VERIFY_SSL, operation="pdf")
+    except upstream.UpstreamError as e:
+        return None, f"Failed to download PDF: {e}"
     if pdf_response.status_code != 200:
         return None, f"Failed to download PDF: {pdf_response.status_code}"
     
@@ -27,10 +43,68 @@ def download_pdf(pdf_url):
         temp_pdf_path = temp_pdf.name
     return temp_pdf_path, None
 
+def is_final_week(year, week_number):
+    """True if the IDSP week ended long enough ago that its data will not change."""
+    try:
+        week_end = date.fromisocalendar(year, week_number, 7)
+    except ValueError:
+        return False
+    return week_end + timedelta(days=OUTBREAK_FINAL_AFTER_DAYS) < date.today()
+
+def is_outbreak_error(result):
+    """Errors are plain messages or {"error": ...}; map data is {"outbreaks": [...]}."""
+    return not (isinstance(result, dict) and "outbreaks" in result)
+
+
 def get_outbreak_data(year, week_number):
+    """
+    Map-ready outbreak data for an IDSP week. Concurrent requests for the same
+    week share one computation, and good results are reused (see singleflight.py).
+    """
+    return singleflight.run(
+        "outbreaks", f"{year}-{week_number}",
+        lambda: _fetch_outbreak_data(year, week_number),
+        cacheable=lambda result: not is_outbreak_error(result),
+    )
+
+
+def stored_outbreak_data(year, week_number):
+    """
+    (result, fresh) as stored by get_outbreak_data, or None. Only complete,
+    freshly built results are stored, never stale fallbacks or partial ones.
+    """
+    return singleflight.peek("outbreaks", f"{year}-{week_number}")
+
+
+def _fetch_outbreak_data(year, week_number):
+    """
+    Build the outbreak data for an IDSP week. While IDSP or Gemini are failing,
+    the last good result for the same week is served. The Gemini extraction and
+    geocoding fan-out run at batch quota priority so they never starve chat.
+    """
+    stale_key = f"{year}-{week_number}"
+    try:
+        with quota.priority("batch"):
+            result = _build_outbreak_data(year, week_number)
+    except Exception as e:
+        print(f"Error building outbreak data for {stale_key}: {e}")
+        result = {"error": str(e)}
+
+    if is_outbreak_error(result):
+        stale = upstream.stale("idsp", stale_key)
+        return stale if stale is not None else result
+
+    upstream.remember("idsp", stale_key, result)
+    return result
+
+
+def _build_outbreak_data(year, week_number):
     # Fetch the webpage content
-    url = "https://idsp.mohfw.gov.in/index4.php?lang=1&level=0&linkid=406&lid=3689"
-    response = requests.get(url, verify=False)
+    url = IDSP_REPORTS_URL
+    try:
+        response = upstream.get("idsp", url, verify=IDSP_VERIFY_SSL, operation="index_page")
+    except upstream.UpstreamError as e:
+        return f"Failed to fetch the page: {e}"
     
     if response.status_code != 200:
         return f"Failed to fetch the page: {response.status_code}"
@@ -110,7 +184,12 @@ def remove_first_pages(pdf_path, num_pages_to_remove):
 def convert_to_map_format(outbreak_data):
     """Convert the Gemini response to the required map format with geocoding"""
     # Initialize Google Maps client
-    gmaps = googlemaps.Client(key=os.getenv("GOOGLE_PLACES_API_KEY"))
+    geocoding = upstream.service_settings("geocoding")
+    gmaps = googlemaps.Client(
+        key=os.getenv("GOOGLE_PLACES_API_KEY"),
+        timeout=geocoding["read_timeout"],
+        retry_timeout=geocoding["deadline"],
+    )
     
     map_outbreaks = []
     
@@ -121,7 +200,15 @@ def convert_to_map_format(outbreak_data):
         
         # Get coordinates from Google Maps Geocoding API
         try:
-            geocode_result = gmaps.geocode(f"{district}, India")
+            address = f"{district}, India"
+            try:
+                geocode_result = upstream.call("geocoding", gmaps.geocode, address, operation="geocode")
+                upstream.remember("geocoding", address, geocode_result)
+            except Exception:
+                # District coordinates do not change, so any earlier answer is as good as a fresh one
+                geocode_result = upstream.stale("geocoding", address, degraded=False)
+                if geocode_result is None:
+                    raise
             if geocode_result and len(geocode_result) > 0:
                 location = geocode_result[0]["geometry"]["location"]
                 lat = location["lat"]
@@ -134,15 +221,15 @@ def convert_to_map_format(outbreak_data):
                     "center": [lat, lng],
                     "radius": radius,
                     "name": f"{disease} Outbreak",
+                    "disease": outbreak.get("disease_id"),
                     "cases": cases
                 })
         except Exception as e:
             print(f"Error geocoding {district}: {e}")
+            upstream.mark_degraded("geocoding")  # Missing from the map this time, so do not keep the result
     
-    # Format the final output
-    output = {"outbreaks": map_outbreaks}
-    out = json.dumps(output, indent=2)
-    return out
+    # Format the final output; rendering to JSON is left to the response renderer
+    return {"outbreaks": map_outbreaks}
 
 
 def analyze_pdf_with_gemini(file_path):
@@ -150,10 +237,11 @@ def analyze_pdf_with_gemini(file_path):
     # Initialize Google Gemini API client
     client = genai.Client(
         api_key=os.environ.get("GEMINI_API_KEY"),
+        http_options=types.HttpOptions(timeout=int(upstream.timeout("gemini") * 1000)),
     )
     
     # Upload file to Google Gemini
-    files = [client.files.upload(file=file_path)]
+    files = [upstream.call("gemini", client.files.upload, file=file_path, operation="upload")]
     model = "gemini-2.0-flash"
     
     # Create prompt for extracting disease outbreaks by district
@@ -206,13 +294,18 @@ def analyze_pdf_with_gemini(file_path):
     )
     
     # Get response from Gemini
-    response_text = ""
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    ):
-        response_text += chunk.text
+    response_text = upstream.call(
+        "gemini",
+        lambda: "".join(
+            chunk.text
+            for chunk in client.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=generate_content_config,
+            )
+        ),
+        operation="generate",
+    )
 
     # Parse the complete response into JSON
     try:
@@ -220,6 +313,11 @@ def analyze_pdf_with_gemini(file_path):
     except json.JSONDecodeError:
         print("Failed to parse Gemini response as JSON")
         return {"error": "Failed to parse Gemini response as JSON"}
+
+    # Use canonical disease ids and names so outbreaks line up with diagnosed diseases
+    for outbreak in outbreak_data.get("outbreaks", []):
+        outbreak["disease_id"] = disease_key(outbreak.get("disease")) or UNKNOWN_DISEASE
+        outbreak["disease"] = canonicalize_disease(outbreak.get("disease"))
     
     # Convert to map format
     try:
@@ -1,5 +1,7 @@
 import requests
 from .models import ChatHistory, DiagnosedDisease
+from . import singleflight, upstream
+from .diseases import disease_name
 from dotenv import load_dotenv
 import os
 load_dotenv()
@@ -10,6 +12,9 @@ YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
 # Google Custom Search Engine ID
 SEARCH_ENGINE_ID = os.getenv("SEARCH_ENGINE_ID")
 
+YOUTUBE_SEARCH_URL = "https://www.googleapis.com/youtube/v3/search"
+GOOGLE_CSE_URL = "https://www.googleapis.com/customsearch/v1"
+
 def get_disease_by_hid(hid):
     """
     Fetch the most recently diagnosed disease for the given ChatHistory ID (hid).
@@ -18,7 +23,7 @@ def get_disease_by_hid(hid):
         chat_history = ChatHistory.objects.get(hid=hid)
         # Retrieve the latest diagnosed disease for the chat history
         disease_entry = DiagnosedDisease.objects.filter(hid=chat_history).order_by("-created_at").first()
-        return disease_entry.disease if disease_entry else None
+        return disease_name(disease_entry.disease) if disease_entry else None
     except ChatHistory.DoesNotExist:
         return None
 
@@ -27,7 +32,7 @@ def fetch_youtube_videos(disease, max_results=5):
     """
     Fetch YouTube videos for the given disease using the YouTube Data API.
     """
-    youtube_search_url = "https://www.googleapis.com/youtube/v3/search"
+    youtube_search_url = YOUTUBE_SEARCH_URL
     params = {
         "part": "snippet",
         "q": f"{disease} tips OR treatment OR motivation",  # Improved query structure
@@ -37,8 +42,12 @@ def fetch_youtube_videos(disease, max_results=5):
         "key": YOUTUBE_API_KEY,
     }
 
-    # Send the GET request to YouTube API
-    response = requests.get(youtube_search_url, params=params)
+    # Send the GET request to YouTube API, falling back to the last good results if it is unreachable
+    try:
+        response = upstream.get("youtube", youtube_search_url, params=params, operation="search")
+    except upstream.UpstreamError as e:
+        print(f"Error fetching YouTube videos: {e}")
+        return upstream.stale("youtube", disease) or {"error": "YouTube API is currently unavailable."}
 
     # Debugging logs for the API request and response
     print(f"API URL: {response.url}")
@@ -68,6 +77,7 @@ def fetch_youtube_videos(disease, max_results=5):
     if not recommendations:
         return {"error": f"No videos found for the disease: {disease}"}
 
+    upstream.remember("youtube", disease, recommendations)
     return recommendations
 
 
@@ -75,7 +85,7 @@ def fetch_google_articles(disease, max_results=5):
     """
     Fetch personalized articles for the given disease using Google Custom Search JSON API.
     """
-    google_cse_url = "https://www.googleapis.com/customsearch/v1"
+    google_cse_url = GOOGLE_CSE_URL
     params = {
         "key": YOUTUBE_API_KEY,  # Use the same API key as YouTube
         "cx": SEARCH_ENGINE_ID,
@@ -86,7 +96,7 @@ def fetch_google_articles(disease, max_results=5):
 
     try:
         # Make the API request
-        response = requests.get(google_cse_url, params=params)
+        response = upstream.get("cse", google_cse_url, params=params, operation="search")
         response.raise_for_status()  # Raise an error for unsuccessful status codes
 
         # Parse the response JSON
@@ -102,10 +112,23 @@ def fetch_google_articles(disease, max_results=5):
                 "source": item.get("displayLink"),
             })
 
+        upstream.remember("cse", disease, articles)
         return articles
 
-    except requests.exceptions.RequestException as e:
-        return {"error": str(e)}
+    except (requests.exceptions.RequestException, upstream.UpstreamError) as e:
+        return upstream.stale("cse", disease) or {"error": str(e)}
+
+
+def get_disease_content(disease):
+    """
+    YouTube videos and Google articles for a disease. Concurrent requests for the
+    same disease share one pair of searches, and complete results are reused.
+    """
+    return singleflight.run(
+        "content", disease,
+        lambda: {"videos": fetch_youtube_videos(disease), "articles": fetch_google_articles(disease)},
+        cacheable=lambda content: all(isinstance(items, list) for items in content.values()),
+    )
 
 
 def fetch_content(hid):
@@ -119,11 +142,10 @@ def fetch_content(hid):
         return {"error": f"No disease found for HID '{hid}'."}
 
     # Fetch YouTube videos and Google articles
-    youtube_videos = fetch_youtube_videos(disease)
-    google_articles = fetch_google_articles(disease)
+    content = get_disease_content(disease)
 
     return {
         "disease": disease,
-        "youtube_videos": youtube_videos,
-        "google_articles": google_articles,
+        "youtube_videos": content["videos"],
+        "google_articles": content["articles"],
     }
@@ -0,0 +1,63 @@
+import os
+import random
+import time
+from functools import wraps
+from django.db import OperationalError, connection
+
+# Write paths wrapped in retry_on_lock retry this many times on lock contention
+DB_WRITE_RETRIES = int(os.getenv("DB_WRITE_RETRIES", "3"))
+
+# SQLite lock errors, and Postgres serialization failures / deadlocks (SQLSTATE 40001, 40P01)
+LOCK_MESSAGES = ("database is locked", "database table is locked")
+RETRYABLE_SQLSTATES = ("40001", "40P01")
+
+
+def is_lock_contention(error):
+    """True if `error` means another writer held the lock and the write can simply be retried."""
+    if any(message in str(error).lower() for message in LOCK_MESSAGES):
+        return True
+    sqlstate = getattr(error.__cause__, "sqlstate", None) or getattr(error.__cause__, "pgcode", None)
+    return sqlstate in RETRYABLE_SQLSTATES
+
+
+def retry_on_lock(func):
+    """
+    Retry a database write on lock contention with jittered exponential backoff.
+    Calls made inside an outer transaction are not retried, since the outer
+    transaction is already broken and must be retried as a whole.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        attempts = DB_WRITE_RETRIES + 1
+        for attempt in range(attempts):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if (
+                    attempt == attempts - 1
+                    or connection.in_atomic_block
+                    or not is_lock_contention(e)
+                ):
+                    raise
+                delay = 0.05 * (2 ** attempt)
+                print(f"Database busy in {func.__name__}, retrying within {delay:.2f}s: {e}")
+                time.sleep(random.uniform(0, delay))
+    return wrapper
+
+
+def estimated_row_count(model):
+    """
+    A cheap row count estimate for a whole table, or None if there is none:
+    the planner statistics on Postgres, the highest primary key on SQLite.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+        elif connection.vendor == "sqlite":
+            cursor.execute(f'SELECT MAX(rowid) FROM "{table}"')
+        else:
+            return None
+        row = cursor.fetchone()
+    # reltuples is -1 until the table is first analyzed
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
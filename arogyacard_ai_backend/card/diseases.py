@@ -0,0 +1,208 @@
+import json
+import os
+import re
+from collections import defaultdict, namedtuple
+from functools import lru_cache
+
+# Canonical disease vocabulary bundled with the app
+VOCABULARY_PATH = os.path.join(os.path.dirname(__file__), "data", "diseases.json")
+
+# Words the LLMs add around a disease name that do not change which disease it is
+QUALIFIERS = {
+    "possible", "probable", "probably", "likely", "suspected", "suspect", "suspicion",
+    "presumed", "mild", "moderate", "severe", "case", "cases", "outbreak", "of",
+}
+
+# Synonyms shorter than this are abbreviations ("tb", "je", "add") and only match exactly
+MIN_PHRASE_LENGTH = 4
+
+# Fuzzy matching bounds: trigram Dice pre-filter, then bounded edit distance
+MIN_TRIGRAM_SIMILARITY = 0.4
+MAX_EDIT_RATIO = 0.25
+
+# Normalized words that turn a name into its negation: "not dengue", "dengue ruled out"
+NEGATION_PREFIXES = [("no",), ("not",), ("negative", "for"), ("rule", "out"), ("ruled", "out")]
+NEGATION_SUFFIXES = [("negative",), ("excluded",), ("unlikely",), ("ruled", "out")]
+
+# Stored in place of a disease that could not be identified
+UNKNOWN_DISEASE = "unknown"
+
+Disease = namedtuple("Disease", ["id", "name"])
+
+
+def normalize_text(text):
+    """Lowercase, drop parenthetical remarks, punctuation and qualifier words."""
+    text = re.sub(r"\(.*?\)|\[.*?\]", " ", str(text).lower())
+    text = text.replace("&", " and ")
+    tokens = re.sub(r"[^a-z0-9]+", " ", text).split()
+    return " ".join(token for token in tokens if token not in QUALIFIERS)
+
+
+def is_negated(tokens):
+    """Whether normalized `tokens` say the disease is absent or excluded."""
+    return any(tuple(tokens[:len(words)]) == words for words in NEGATION_PREFIXES) or any(
+        tuple(tokens[-len(words):]) == words for words in NEGATION_SUFFIXES
+    )
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _bounded_edit_distance(a, b, max_distance):
+    """Levenshtein distance, abandoning as soon as it must exceed `max_distance`."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class DiseaseIndex:
+    """Exact, token-trie and trigram indexes over the canonical disease vocabulary."""
+
+    def __init__(self, entries):
+        self.diseases = {}
+        self.exact = {}
+        self.trie = {}
+        self.trigrams = defaultdict(set)
+
+        for entry in entries:
+            disease = Disease(entry["id"], entry["name"])
+            self.diseases[disease.id] = disease
+            for term in [entry["name"], *entry.get("synonyms", [])]:
+                self._add_term(term, disease.id, phrase=True)
+            # Generic words ("fever", "cold") only count when they are the whole name
+            for term in entry.get("exact_synonyms", []):
+                self._add_term(term, disease.id, phrase=False)
+
+    def _add_term(self, term, disease_id, phrase):
+        key = normalize_text(term)
+        if not key or key in self.exact:
+            return
+        self.exact[key] = disease_id
+        for gram in _trigrams(key):
+            self.trigrams[gram].add(key)
+        if phrase and len(key) >= MIN_PHRASE_LENGTH:
+            self._add_phrase(key.split(), disease_id)
+
+    def _add_phrase(self, tokens, disease_id):
+        node = self.trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node[None] = disease_id
+
+    def _longest_phrase(self, tokens):
+        """Longest vocabulary phrase contained anywhere in `tokens`."""
+        best_id, best_length = None, 0
+        for start in range(len(tokens)):
+            node = self.trie
+            for end in range(start, len(tokens)):
+                node = node.get(tokens[end])
+                if node is None:
+                    break
+                if None in node and end - start + 1 > best_length:
+                    best_id, best_length = node[None], end - start + 1
+        return best_id
+
+    def _fuzzy(self, key):
+        grams = _trigrams(key)
+        overlap = defaultdict(int)
+        for gram in grams:
+            for candidate in self.trigrams.get(gram, ()):
+                overlap[candidate] += 1
+
+        max_distance = max(1, round(len(key) * MAX_EDIT_RATIO))
+        best_key, best_distance = None, max_distance + 1
+        for candidate, shared in sorted(overlap.items(), key=lambda item: -item[1]):
+            dice = 2 * shared / (len(grams) + len(_trigrams(candidate)))
+            if dice < MIN_TRIGRAM_SIMILARITY:
+                continue
+            distance = _bounded_edit_distance(key, candidate, min(max_distance, best_distance - 1))
+            if distance < best_distance:
+                best_key, best_distance = candidate, distance
+        return self.exact[best_key] if best_key else None
+
+    def lookup(self, text):
+        key = normalize_text(text)
+        if not key:
+            return None
+        disease_id = self.exact.get(key)
+        if not disease_id and is_negated(key.split()):
+            return None
+        disease_id = disease_id or self._longest_phrase(key.split())
+        if not disease_id and len(key) >= MIN_PHRASE_LENGTH:
+            disease_id = self._fuzzy(key)
+        return self.diseases.get(disease_id)
+
+
+@lru_cache(maxsize=1)
+def get_index():
+    """Load the bundled vocabulary once per process."""
+    with open(VOCABULARY_PATH, encoding="utf-8") as vocabulary:
+        return DiseaseIndex(json.load(vocabulary)["diseases"])
+
+
+@lru_cache(maxsize=4096)
+def lookup_disease(text):
+    """Return the canonical `Disease` for free-text `text`, or None if it is not in the vocabulary."""
+    if not text or not isinstance(text, str):
+        return None
+    return get_index().lookup(text)
+
+
+def canonical_disease_id(text):
+    """Return the canonical disease id for `text`, or None."""
+    disease = lookup_disease(text)
+    return disease.id if disease else None
+
+
+def disease_key(text):
+    """
+    The value stored for a diagnosis of `text`: its canonical id, a slug of the
+    normalized name for diseases outside the vocabulary, or None when `text` is
+    empty, 'Unknown' or a negation such as "not dengue".
+    """
+    if not isinstance(text, str):
+        return None
+    disease_id = canonical_disease_id(text)
+    if disease_id:
+        return disease_id
+    tokens = normalize_text(text).split()
+    if not tokens or tokens == [UNKNOWN_DISEASE] or is_negated(tokens):
+        return None
+    return "_".join(tokens)
+
+
+def disease_name(key):
+    """Display name for a stored disease key."""
+    disease = get_index().diseases.get(key)
+    if disease:
+        return disease.name
+    return key.replace("_", " ").capitalize() if key else "Unknown"
+
+
+def canonicalize_disease(text):
+    """
+    Map a free-text disease name onto its canonical display name.
+    Names outside the vocabulary are returned trimmed; empty, non-text and negated
+    input ("not dengue") becomes 'Unknown'.
+    """
+    text = text.strip() if isinstance(text, str) else ""
+    if not text or text.lower() == "unknown":
+        return "Unknown"
+    disease = lookup_disease(text)
+    if disease:
+        return disease.name
+    return text if disease_key(text) else "Unknown"
@@ -0,0 +1,123 @@
+"""
+Streaming NDJSON export of conversations and diagnoses for analytics.
+
+Rows are read in chunks with `.iterator()` and encoded one line at a time, so
+memory stays flat however large the tables are. Each dataset is ordered by a
+timestamp column that serves as the high-water mark for incremental exports:
+an export covers rows with `since < timestamp <= until`, and the next export
+passes the returned `until` as its `since`.
+
+`updated_at` is set when a row is saved, not when its transaction commits, so
+`until` trails the clock by EXPORT_SAFETY_LAG_SECONDS: a row whose transaction
+is still open when the export starts gets a timestamp after `until` and is
+picked up by the next export. The lag must exceed the longest write transaction.
+"""
+import os
+from datetime import timedelta
+import orjson
+from django.utils import timezone
+from .archive import decompress
+from .models import ArchivedConversation, ChatHistory, DiagnosedDisease
+
+# dataset -> (model, high-water mark column, {exported field: model lookup})
+DATASETS = {
+    "conversations": (ChatHistory, "updated_at", {
+        "id": "id",
+        "hid": "hid",
+        "conversation": "conversation",
+        "updated_at": "updated_at",
+    }),
+    "diagnoses": (DiagnosedDisease, "created_at", {
+        "id": "id",
+        "hid": "hid__hid",
+        "disease": "disease",
+        "diagnosed_on": "diagnosed_on",
+        "created_at": "created_at",
+    }),
+}
+
+DEFAULT_CHUNK_SIZE = 2000
+EXPORT_SAFETY_LAG = timedelta(seconds=int(os.getenv("EXPORT_SAFETY_LAG_SECONDS", "60")))
+# Lines are grouped into writes of about this many bytes
+BUFFER_BYTES = 64 * 1024
+
+
+class ExportError(ValueError):
+    """Unknown dataset or field in an export request."""
+
+
+def resolve_fields(dataset, fields=None):
+    """Validate a dataset name and field selection; all fields when none are given."""
+    if dataset not in DATASETS:
+        raise ExportError(f"Unknown dataset '{dataset}'. Choose from: {', '.join(DATASETS)}")
+    available = DATASETS[dataset][2]
+    if not fields:
+        return list(available)
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise ExportError(f"Unknown field(s) for {dataset}: {', '.join(unknown)}. Available: {', '.join(available)}")
+    return list(dict.fromkeys(fields))
+
+
+def high_water_mark():
+    """Upper bound for an export starting now; hand it back as `since` next time."""
+    return timezone.now() - EXPORT_SAFETY_LAG
+
+
+def iter_records(dataset, fields=None, since=None, until=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the dataset's rows as dicts of the selected fields, oldest first."""
+    fields = resolve_fields(dataset, fields)
+    model, mark, lookups = DATASETS[dataset]
+    queryset = model.objects.all()
+    if since is not None:
+        queryset = queryset.filter(**{f"{mark}__gt": since})
+    if until is not None:
+        queryset = queryset.filter(**{f"{mark}__lte": until})
+    columns = [lookups[field] for field in fields]
+    if dataset == "conversations" and "conversation" in fields:
+        # Archived rows only hold a stub; their conversation is read back from the archive
+        rows = queryset.order_by(mark, "id").values_list("id", "archived_at", *columns).iterator(chunk_size=chunk_size)
+        yield from _with_archived_conversations(rows, fields, chunk_size)
+        return
+    rows = queryset.order_by(mark, "id").values_list(*columns).iterator(chunk_size=chunk_size)
+    for row in rows:
+        yield dict(zip(fields, row))
+
+
+def _with_archived_conversations(rows, fields, chunk_size):
+    """Records from (id, archived_at, *fields) rows, fetching the archives of each chunk in one query."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield from _merge_archives(chunk, fields)
+            chunk = []
+    yield from _merge_archives(chunk, fields)
+
+
+def _merge_archives(chunk, fields):
+    archived_ids = [row[0] for row in chunk if row[1] is not None]
+    archives = {
+        chat_history_id: (codec, data)
+        for chat_history_id, codec, data in ArchivedConversation.objects.filter(
+            chat_history_id__in=archived_ids
+        ).values_list("chat_history_id", "codec", "data")
+    } if archived_ids else {}
+    for chat_history_id, _, *values in chunk:
+        record = dict(zip(fields, values))
+        if chat_history_id in archives:
+            record["conversation"] = {**decompress(*archives[chat_history_id]), **record["conversation"]}
+        yield record
+
+
+def iter_ndjson(records):
+    """Encode records as NDJSON, yielding buffered byte chunks."""
+    buffer = bytearray()
+    for record in records:
+        buffer += orjson.dumps(record)
+        buffer += b"\n"
+        if len(buffer) >= BUFFER_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
@@ -0,0 +1,207 @@
+"""
+Approximate-match reuse of first follow-up questions.
+
+Opening chat messages repeat heavily with small variations ("i have fever",
+"I've had a fever since 2 days"). The first follow-up the LLM gave to an opening
+is stored in `FirstTurnResponse`; later openings are normalized into symptom
+words, with negated words marked ("no fever" -> "not_fever") and durations
+dropped, and looked up through a MinHash/LSH index over those words. A stored
+follow-up is reused when the word Jaccard similarity reaches FIRST_TURN_SIMILARITY,
+both messages name the same side or part of the body ("left" and "right" never
+match) and both got the same triage categories.
+
+Each worker keeps its own index and every FIRST_TURN_REFRESH_SECONDS picks up rows
+stored by other workers and drops rows disabled or deleted in the admin.
+"""
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from django.db.models import F
+from .db import retry_on_lock
+from .metrics import increment, record_cache, set_gauge
+from .models import FirstTurnResponse
+
+FIRST_TURN_ENABLED = os.getenv("FIRST_TURN_ENABLED", "true").lower() not in ("0", "false", "no")
+SIMILARITY_THRESHOLD = float(os.getenv("FIRST_TURN_SIMILARITY", "0.75"))
+MAX_ENTRIES = int(os.getenv("FIRST_TURN_MAX_ENTRIES", "5000"))
+REFRESH_SECONDS = float(os.getenv("FIRST_TURN_REFRESH_SECONDS", "30"))
+
+# 64 hash functions in 32 bands of 2 rows: pairs at Jaccard 0.6 collide in some band
+# with probability ~1 - (1 - 0.6 ** 2) ** 32, and every candidate is verified exactly.
+NUM_HASHES = 64
+BANDS = 32
+ROWS = NUM_HASHES // BANDS
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_HASH_PARAMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_HASHES)]
+
+# Words that do not change which follow-up question fits an opening message
+FILLER_WORDS = {
+    "i", "im", "ive", "id", "me", "my", "am", "is", "are", "was", "have", "has", "had", "having", "been", "a", "an",
+    "the", "and", "since", "from", "for", "got", "getting", "feel", "feeling", "some", "little", "bit", "very",
+    "hi", "hello", "hey", "doctor", "dr", "please", "help", "today", "also", "just", "really",
+}
+
+# A word after one of these is marked as denied: "no fever" and "fever" must never match
+NEGATIONS = {"no", "not", "without", "never", "dont", "didnt", "doesnt", "havent", "hasnt", "isnt", "arent"}
+
+# Words that locate a symptom; two openings that differ in one of them need different follow-ups
+LOCATION_WORDS = {
+    "left", "right", "both", "upper", "lower", "top", "bottom", "front", "middle", "center", "centre", "inner",
+    "outer", "side",
+}
+
+# How long something has lasted does not change the first follow-up question
+DURATION = re.compile(
+    r"\b(\d+|a|an|one|two|three|four|five|few|couple of|several) (days?|weeks?|months?|hours?|nights?)( ago)?\b"
+    r"|\b(yesterday|last night|this morning|tonight)\b"
+)
+
+
+def _stem(word):
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def normalize_query(text):
+    """Lowercase symptom words without punctuation, filler words or durations; denied words get a not_ prefix."""
+    text = DURATION.sub(" ", str(text or "").lower().replace("'", "").replace("’", ""))
+    words = []
+    negated = False
+    for word in re.sub(r"[^a-z0-9]+", " ", text).split():
+        if word in NEGATIONS:
+            negated = True
+        elif word not in FILLER_WORDS:
+            words.append(f"not_{_stem(word)}" if negated else _stem(word))
+            negated = False
+    return " ".join(words)
+
+
+def shingles(normalized):
+    return set(normalized.split())
+
+
+def _locations(shingle_set):
+    return {word.removeprefix("not_") for word in shingle_set} & LOCATION_WORDS
+
+
+def minhash(shingle_set):
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big") for s in shingle_set]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _HASH_PARAMS]
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class FirstTurnIndex:
+    """In-process LSH index over stored first-turn responses."""
+
+    def __init__(self):
+        self.entries = {}                # id -> (shingles, categories, response)
+        self.signatures = {}             # id -> (normalized, minhash signature), to unindex it
+        self.bands = defaultdict(set)    # (band number, band hashes) -> ids
+        self.by_normalized = {}
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, entry_id, normalized, categories, response):
+        if entry_id in self.entries:
+            return
+        shingle_set = shingles(normalized)
+        signature = minhash(shingle_set)
+        with self.lock:
+            self.entries[entry_id] = (shingle_set, tuple(categories), response)
+            self.signatures[entry_id] = (normalized, signature)
+            self.by_normalized[normalized] = entry_id
+            for band in range(BANDS):
+                self.bands[(band, tuple(signature[band * ROWS:(band + 1) * ROWS]))].add(entry_id)
+            set_gauge("card_first_turn_entries", len(self.entries))
+
+    def remove(self, entry_id):
+        with self.lock:
+            if self.entries.pop(entry_id, None) is None:
+                return
+            normalized, signature = self.signatures.pop(entry_id)
+            if self.by_normalized.get(normalized) == entry_id:
+                del self.by_normalized[normalized]
+            for band in range(BANDS):
+                key = (band, tuple(signature[band * ROWS:(band + 1) * ROWS]))
+                self.bands[key].discard(entry_id)
+                if not self.bands[key]:
+                    del self.bands[key]
+            set_gauge("card_first_turn_entries", len(self.entries))
+
+    def refresh(self):
+        """Load rows enabled since the last refresh by any worker, and drop rows disabled or deleted since."""
+        if time.monotonic() - self.loaded_at < REFRESH_SECONDS:
+            return
+        self.loaded_at = time.monotonic()
+        enabled = set(FirstTurnResponse.objects.filter(enabled=True).values_list("id", flat=True))
+        for entry_id in set(self.entries) - enabled:
+            self.remove(entry_id)
+        rows = (FirstTurnResponse.objects.filter(id__in=enabled - set(self.entries), enabled=True)
+                .values_list("id", "query", "categories", "response"))
+        for entry_id, query, categories, response in rows.iterator():
+            # Normalized again from the query, so rows stored by older versions match the same way
+            self.add(entry_id, normalize_query(query), categories, response)
+
+    def best_match(self, normalized, categories):
+        """(entry id, similarity, response) of the most similar entry with the same categories, or None."""
+        shingle_set = shingles(normalized)
+        signature = minhash(shingle_set)
+        with self.lock:
+            candidates = set()
+            for band in range(BANDS):
+                candidates |= self.bands.get((band, tuple(signature[band * ROWS:(band + 1) * ROWS])), set())
+            best = None
+            for entry_id in candidates:
+                entry_shingles, entry_categories, response = self.entries[entry_id]
+                if entry_categories != tuple(categories) or _locations(shingle_set) != _locations(entry_shingles):
+                    continue
+                similarity = jaccard(shingle_set, entry_shingles)
+                if best is None or similarity > best[1]:
+                    best = (entry_id, similarity, response)
+        return best
+
+
+_index = FirstTurnIndex()
+set_gauge("card_first_turn_similarity_threshold", SIMILARITY_THRESHOLD)
+
+
+def find_response(query, categories):
+    """A stored first follow-up for an opening message similar enough to `query`, or None."""
+    normalized = normalize_query(query)
+    if not FIRST_TURN_ENABLED or not normalized:
+        return None
+    _index.refresh()
+    match = _index.best_match(normalized, categories)
+    if match:
+        # Similarity of the closest candidate, in tenths, to help tune the threshold
+        increment("card_first_turn_similarity_total", bucket=f"{int(match[1] * 10) / 10:.1f}")
+    hit = match is not None and match[1] >= SIMILARITY_THRESHOLD
+    record_cache("first_turn", hit)
+    increment("card_first_turn_total", outcome="hit" if hit else "miss")
+    if not hit:
+        return None
+    retry_on_lock(FirstTurnResponse.objects.filter(pk=match[0]).update)(hits=F("hits") + 1)
+    return match[2]
+
+
+def remember_response(query, categories, response):
+    """Store the LLM's first follow-up for an opening message that had no close match."""
+    normalized = normalize_query(query)
+    if not FIRST_TURN_ENABLED or not normalized or len(normalized) > 500:
+        return
+    if normalized in _index.by_normalized or len(_index.entries) >= MAX_ENTRIES:
+        return
+    entry, created = retry_on_lock(FirstTurnResponse.objects.get_or_create)(
+        normalized=normalized, defaults={"query": query, "categories": list(categories), "response": response},
+    )
+    if created:
+        increment("card_first_turn_total", outcome="stored")
+    if entry.enabled:
+        _index.add(entry.id, entry.normalized, entry.categories, entry.response)
@@ -0,0 +1,81 @@
+"""
+HTTP validators and cache headers for the GET variants of cacheable endpoints.
+
+The ETag is a hash of the result as served from the single-flight store, so it
+is the same on every worker until the stored result changes. Cache-Control
+follows the namespace's single-flight TTLs: fresh for the TTL, then usable
+while revalidating until the stale TTL runs out.
+"""
+import hashlib
+import orjson
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from .metrics import increment
+from .singleflight import ttls
+
+# For results that will not change again, e.g. outbreak data of a long-past week
+FINAL_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def _representation(data):
+    return orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+
+
+def _etag(body):
+    return '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+def etag_for(data):
+    """Strong ETag of a JSON-serializable result."""
+    return _etag(_representation(data))
+
+
+def cache_control(namespace, final=False):
+    if final:
+        return f"public, max-age={FINAL_MAX_AGE}, immutable"
+    ttl, stale_ttl = ttls(namespace)
+    return f"public, max-age={ttl}, stale-while-revalidate={max(0, stale_ttl - ttl)}"
+
+
+def _matches(request, etag):
+    """If-None-Match comparison, which is weak: W/ tags added by response compression still match."""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    tags = parse_etags(header)
+    return "*" in tags or etag in {tag.removeprefix("W/") for tag in tags}
+
+
+def _with_validators(response, etag, namespace, final):
+    response["ETag"] = etag
+    response["Cache-Control"] = cache_control(namespace, final)
+    return response
+
+
+def _not_modified(body, etag, namespace, final):
+    increment("card_conditional_requests_total", namespace=namespace, outcome="not_modified")
+    response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    # Size of the 200 body, so compression weakens the ETag only where it would have compressed that body
+    response.representation_length = len(body)
+    return _with_validators(response, etag, namespace, final)
+
+
+def not_modified(request, data, namespace, final=False):
+    """
+    The 304 for `data` if the client already has it, else None. Lets a view
+    answer from a stored result before computing a fresh one.
+    """
+    body = _representation(data)
+    etag = _etag(body)
+    return _not_modified(body, etag, namespace, final) if _matches(request, etag) else None
+
+
+def conditional_response(request, data, namespace, final=False):
+    """200 with ETag and Cache-Control for `data`, or 304 if the client already has it."""
+    body = _representation(data)
+    etag = _etag(body)
+    if _matches(request, etag):
+        return _not_modified(body, etag, namespace, final)
+    increment("card_conditional_requests_total", namespace=namespace, outcome="full")
+    return _with_validators(Response(data, status=status.HTTP_200_OK), etag, namespace, final)
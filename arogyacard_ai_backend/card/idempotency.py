@@ -0,0 +1,191 @@
+"""
+Idempotency-Key support for expensive POST endpoints.
+
+A request sent with an `Idempotency-Key` header claims an `IdempotencyKey` row
+for its endpoint before the view runs. A retry with the same key and body gets
+the stored response replayed (marked `Idempotent-Replayed: true`); a retry
+arriving while the original is still running waits for it. Reusing a key with a
+different body is refused with 422. Server errors are not stored, so the client
+can retry them. Keys expire after IDEMPOTENCY_TTL_HOURS.
+
+While the handler runs, a heartbeat thread keeps extending the row's
+`locked_until`, so only a crashed worker's key is taken over. `locked_until`
+doubles as a fencing token: the worker stores or releases the key only if the
+value it last wrote is still there, so a worker whose key was taken over cannot
+overwrite the new owner's outcome.
+"""
+import hashlib
+import os
+import threading
+import time
+from datetime import timedelta
+from functools import wraps
+import orjson
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from .db import retry_on_lock
+from .metrics import increment
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_TTL = timedelta(hours=int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")))
+# How long a retry waits for the original request before answering 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "60"))
+# After this, a key still marked processing is assumed abandoned by a crashed worker
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "300"))
+POLL_INTERVAL = 0.25
+CLAIM_ATTEMPTS = 3
+
+
+def fingerprint(request):
+    """SHA-256 over the method, path and parsed body, including uploaded file contents."""
+    hasher = hashlib.sha256(f"{request.method} {request.path}".encode())
+    data = request.data
+    items = data.lists() if hasattr(data, "lists") else data.items() if isinstance(data, dict) else [("", data)]
+    for name, value in sorted(items, key=lambda item: item[0]):
+        hasher.update(b"\0" + name.encode())
+        for part in value if isinstance(value, list) else [value]:
+            if hasattr(part, "chunks"):
+                hasher.update(getattr(part, "name", "").encode())
+                for chunk in part.chunks():
+                    hasher.update(chunk)
+                part.seek(0)
+            else:
+                hasher.update(orjson.dumps(part, default=str, option=orjson.OPT_SORT_KEYS))
+    return hasher.hexdigest()
+
+
+def _lease():
+    return timezone.now() + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+
+
+def _create(**fields):
+    # A savepoint, so a duplicate key leaves any outer transaction usable
+    with transaction.atomic():
+        return IdempotencyKey.objects.create(**fields)
+
+
+def _claim(endpoint, key, digest):
+    """Create the processing row, or return the existing one for this key."""
+    for _ in range(CLAIM_ATTEMPTS):
+        try:
+            return retry_on_lock(_create)(
+                endpoint=endpoint, key=key, fingerprint=digest, locked_until=_lease(),
+                expires_at=timezone.now() + IDEMPOTENCY_TTL,
+            ), True
+        except IntegrityError:
+            existing = IdempotencyKey.objects.filter(endpoint=endpoint, key=key).first()
+            if existing is not None:
+                return existing, False
+            # Expired and purged in between; try creating it again
+    raise IntegrityError(f"Could not claim {IDEMPOTENCY_HEADER} {key!r} for {endpoint}.")
+
+
+def _owned(record):
+    """The key, as long as this worker still holds the lease it last wrote."""
+    return IdempotencyKey.objects.filter(pk=record.pk, locked_until=record.locked_until)
+
+
+def _take_over(record):
+    """Claim an expired key, or a processing key whose worker stopped renewing it."""
+    locked_until = _lease()
+    taken = retry_on_lock(_owned(record).update)(
+        fingerprint=record.fingerprint, status="processing", status_code=None, response=None,
+        locked_until=locked_until, expires_at=timezone.now() + IDEMPOTENCY_TTL,
+    ) == 1
+    if taken:
+        record.locked_until = locked_until
+    return taken
+
+
+def _heartbeat(record, stop):
+    """Extend the lease every third of IDEMPOTENCY_LOCK_SECONDS until `stop` is set or the key is lost."""
+    try:
+        while not stop.wait(IDEMPOTENCY_LOCK_SECONDS / 3):
+            locked_until = _lease()
+            if not retry_on_lock(_owned(record).update)(locked_until=locked_until):
+                print(f"Idempotency key {record.key} was taken over while its request was running")
+                return
+            record.locked_until = locked_until
+    finally:
+        connections.close_all()
+
+
+def _replay(record):
+    increment("card_idempotency_total", outcome="replayed")
+    response = Response(record.response, status=record.status_code)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def purge_expired(limit=100):
+    """Delete a batch of expired keys; called as new keys are claimed."""
+    expired = list(IdempotencyKey.objects.filter(expires_at__lt=timezone.now()).values_list("pk", flat=True)[:limit])
+    if expired:
+        retry_on_lock(IdempotencyKey.objects.filter(pk__in=expired).delete)()
+
+
+def idempotent(handler):
+    """Decorate an APIView handler so requests with an Idempotency-Key run at most once."""
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({"error": f"{IDEMPOTENCY_HEADER} must be at most 255 characters."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        endpoint = request.resolver_match.url_name
+        digest = fingerprint(request)
+        record, claimed = _claim(endpoint, key, digest)
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while not claimed:
+            if record.fingerprint != digest and record.expires_at > timezone.now():
+                increment("card_idempotency_total", outcome="mismatch")
+                return Response({"error": f"{IDEMPOTENCY_HEADER} was already used for a different request."},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if record.expires_at <= timezone.now() or (
+                record.status == "processing" and record.locked_until <= timezone.now()
+            ):
+                record.fingerprint = digest
+                claimed = _take_over(record)
+            elif record.status == "complete":
+                return _replay(record)
+            elif time.monotonic() >= deadline:
+                increment("card_idempotency_total", outcome="busy")
+                response = Response({"error": "The original request is still being processed, retry shortly."},
+                                    status=status.HTTP_409_CONFLICT)
+                response["Retry-After"] = "1"
+                return response
+            if not claimed:
+                time.sleep(POLL_INTERVAL)
+                record = IdempotencyKey.objects.filter(pk=record.pk).first()
+                if record is None:  # The original failed and released the key
+                    record, claimed = _claim(endpoint, key, digest)
+        purge_expired()
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat, args=(record, stop), daemon=True)
+        heartbeat.start()
+        try:
+            try:
+                response = handler(self, request, *args, **kwargs)
+            finally:
+                stop.set()
+                heartbeat.join()
+        except BaseException:
+            retry_on_lock(_owned(record).filter(status="processing").delete)()
+            raise
+        if response.status_code >= 500 or not isinstance(response, Response):
+            # Not stored: the client may retry a failure with the same key
+            retry_on_lock(_owned(record).filter(status="processing").delete)()
+            return response
+        stored = retry_on_lock(_owned(record).update)(
+            status="complete", status_code=response.status_code, response=response.data,
+        )
+        increment("card_idempotency_total", outcome="stored" if stored else "lost")
+        return response
+    return wrapper
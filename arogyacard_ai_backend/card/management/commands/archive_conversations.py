@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from card.archive import ARCHIVE_AFTER_DAYS, archive_idle, storage_report
+
+
+def _size(num_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024 or unit == "GB":
+            return f"{num_bytes:.1f} {unit}" if unit != "B" else f"{num_bytes} B"
+        num_bytes /= 1024
+
+
+class Command(BaseCommand):
+    help = "Move conversations idle past a given age into compressed cold storage and report sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS,
+                            help=f"Archive conversations not updated for this many days (default {ARCHIVE_AFTER_DAYS})")
+        parser.add_argument("--batch-size", type=int, default=500, help="Rows read per query")
+        parser.add_argument("--limit", type=int, help="Archive at most this many conversations")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be archived")
+
+    def report(self, label, report):
+        hot, archive = report["hot"], report["archive"]
+        self.stdout.write(
+            f"{label}: hot table {hot['rows']} conversation(s), {_size(hot['bytes'])} of conversation data; "
+            f"archive {archive['rows']} conversation(s), {_size(archive['compressed_bytes'])} "
+            f"({_size(archive['original_bytes'])} uncompressed)"
+        )
+
+    def handle(self, *args, **options):
+        self.report("Before", storage_report())
+        stats = archive_idle(
+            older_than_days=options["older_than_days"], batch_size=options["batch_size"],
+            limit=options["limit"], dry_run=options["dry_run"],
+        )
+        ratio = stats["compressed_bytes"] / stats["original_bytes"] if stats["original_bytes"] else 0
+        verb = "Would archive" if options["dry_run"] else "Archived"
+        self.stdout.write(
+            f"{verb} {stats['archived']} conversation(s): {_size(stats['original_bytes'])} -> "
+            f"{_size(stats['compressed_bytes'])} ({ratio:.0%}); skipped {stats['skipped']} changed since selection"
+        )
+        if not options["dry_run"]:
+            self.report("After", storage_report())
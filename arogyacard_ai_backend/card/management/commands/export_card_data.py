@@ -0,0 +1,66 @@
+import gzip
+import json
+import os
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from card.export import DATASETS, DEFAULT_CHUNK_SIZE, ExportError, high_water_mark, iter_ndjson, iter_records, resolve_fields
+
+
+class Command(BaseCommand):
+    help = "Stream conversations or diagnoses as NDJSON, optionally gzipped and incremental."
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset", choices=list(DATASETS))
+        parser.add_argument("--output", default="-", help="File to write; '-' for stdout. A .gz name implies --gzip.")
+        parser.add_argument("--gzip", action="store_true", help="Gzip the output")
+        parser.add_argument("--fields", help="Comma-separated fields to export (default: all)")
+        parser.add_argument("--since", help="Only rows changed after this ISO-8601 timestamp")
+        parser.add_argument("--state-file", help="JSON file holding the high-water mark per dataset; "
+                                                 "read as --since and updated after a successful export")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows fetched per query")
+
+    def handle(self, *args, **options):
+        dataset = options["dataset"]
+        fields = [field.strip() for field in options["fields"].split(",")] if options["fields"] else None
+        try:
+            fields = resolve_fields(dataset, fields)
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        state = {}
+        if options["state_file"] and os.path.exists(options["state_file"]):
+            with open(options["state_file"]) as state_file:
+                state = json.load(state_file)
+        since_text = options["since"] or state.get(dataset)
+        since = parse_datetime(since_text) if since_text else None
+        if since_text and since is None:
+            raise CommandError(f"Invalid --since timestamp: {since_text}")
+
+        until = high_water_mark()
+        records = iter_records(dataset, fields, since=since, until=until, chunk_size=options["chunk_size"])
+
+        compress = options["gzip"] or options["output"].endswith(".gz")
+        if options["output"] == "-":
+            raw = sys.stdout.buffer
+        else:
+            raw = open(options["output"], "wb")
+        output = gzip.GzipFile(fileobj=raw, mode="wb") if compress else raw
+        try:
+            written = 0
+            for chunk in iter_ndjson(records):
+                output.write(chunk)
+                written += chunk.count(b"\n")
+        finally:
+            if compress:
+                output.close()
+            if raw is not sys.stdout.buffer:
+                raw.close()
+            else:
+                raw.flush()
+
+        if options["state_file"]:
+            state[dataset] = until.isoformat()
+            with open(options["state_file"], "w") as state_file:
+                json.dump(state, state_file, indent=2)
+        self.stderr.write(f"Exported {written} {dataset} row(s); high-water mark {until.isoformat()}")
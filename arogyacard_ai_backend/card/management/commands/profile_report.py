@@ -0,0 +1,50 @@
+import os
+import pstats
+import re
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from card.profiling import PROFILE_DIR, parse_profile_name
+
+SORT_COLUMNS = {"cumulative": 3, "tottime": 2, "calls": 1}
+
+
+def _location(filename, line, function):
+    """Shorten paths to the project or to site-packages so tables stay readable."""
+    filename = re.sub(rf"^({re.escape(str(settings.BASE_DIR))}|.*/site-packages|.*/lib/python[\d.]+)/", "", filename)
+    return f"{filename}:{line}({function})" if line else function
+
+
+class Command(BaseCommand):
+    help = "Aggregate saved request profiles into the top functions per endpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", default=PROFILE_DIR, help=f"Profile directory (default {PROFILE_DIR})")
+        parser.add_argument("--endpoint", help="Only endpoints whose name contains this text, e.g. get_news")
+        parser.add_argument("--sort", choices=sorted(SORT_COLUMNS), default="cumulative",
+                            help="Rank functions by cumulative time (default), own time or call count")
+        parser.add_argument("--limit", type=int, default=20, help="Functions to show per endpoint")
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options["dir"]):
+            raise CommandError(f"No profiles in {options['dir']}; set PROFILE_TOKEN or PROFILE_SAMPLE_RATE first.")
+        groups = defaultdict(list)
+        for filename in sorted(os.listdir(options["dir"])):
+            endpoint = parse_profile_name(filename)
+            if endpoint and (not options["endpoint"] or options["endpoint"] in endpoint):
+                groups[endpoint].append(os.path.join(options["dir"], filename))
+        if not groups:
+            raise CommandError("No matching profiles.")
+
+        column = SORT_COLUMNS[options["sort"]]
+        for endpoint, paths in sorted(groups.items()):
+            stats = pstats.Stats(*paths)
+            count = len(paths)
+            self.stdout.write(f"\n{endpoint}: {count} request(s), {stats.total_tt / count * 1000:.1f} ms per request")
+            self.stdout.write(f"{'calls/req':>10} {'own ms/req':>11} {'cum ms/req':>11}  function")
+            rows = sorted(stats.stats.items(), key=lambda item: item[1][column], reverse=True)
+            for (filename, line, function), (_, calls, own, cumulative, _) in rows[:options["limit"]]:
+                self.stdout.write(
+                    f"{calls / count:>10.1f} {own / count * 1000:>11.2f} {cumulative / count * 1000:>11.2f}"
+                    f"  {_location(filename, line, function)}"
+                )
@@ -0,0 +1,334 @@
+import atexit
+import fcntl
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import orjson
+
+# Histogram buckets in seconds, shared by every latency series
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Timings collected for the request currently being handled, keyed by span name
+_request_timings = ContextVar("request_timings", default=None)
+
+_lock = threading.Lock()
+_histograms = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))  # (metric, labels) -> bucket counts
+_sums = defaultdict(float)
+_counters = defaultdict(int)
+_gauges = {}
+
+# Directory shared by the worker processes of one server. When set, each worker writes
+# its metrics there every METRICS_FLUSH_SECONDS and a scrape of any worker reports all.
+# Counters and histograms of workers that exited are kept in RETIRED_SNAPSHOT.
+METRICS_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+RETIRED_SNAPSHOT = "metrics-retired.json"
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+_flusher_pid = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    """Record one latency observation in histogram `name`."""
+    key = _key(name, labels)
+    if METRICS_DIR and _flusher_pid != os.getpid():
+        _start_flusher()
+    with _lock:
+        _histograms[key][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        _sums[key] += seconds
+
+
+def increment(name, amount=1, **labels):
+    if METRICS_DIR and _flusher_pid != os.getpid():
+        _start_flusher()
+    with _lock:
+        _counters[_key(name, labels)] += amount
+
+
+def set_gauge(name, value, **labels):
+    if METRICS_DIR and _flusher_pid != os.getpid():
+        _start_flusher()
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def record_cache(cache, hit):
+    """Count a cache lookup; hit ratios are derived from these counters."""
+    increment("card_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def start_request():
+    """Start collecting span timings for the current request."""
+    return _request_timings.set(defaultdict(lambda: [0.0, 0]))
+
+
+def finish_request(token):
+    """Stop collecting and return {span: (total seconds, call count)} for the request."""
+    timings = _request_timings.get()
+    _request_timings.reset(token)
+    return {name: tuple(value) for name, value in (timings or {}).items()}
+
+
+def add_request_timing(name, seconds):
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name][0] += seconds
+        timings[name][1] += 1
+
+
+@contextmanager
+def timed(service, operation="call"):
+    """
+    Time one upstream call. The duration goes into the per-request Server-Timing
+    breakdown and the process-wide latency histogram; failures are counted.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        increment("card_upstream_errors_total", service=service, operation=operation)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("card_upstream_latency_seconds", elapsed, service=service, operation=operation)
+        add_request_timing(service, elapsed)
+
+
+def query_timer(execute, sql, params, many, context):
+    """`connection.execute_wrapper` hook timing every DB query of the request."""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("card_db_query_seconds", elapsed)
+        add_request_timing("db", elapsed)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _snapshot():
+    with _lock:
+        return (
+            {key: list(counts) for key, counts in _histograms.items()},
+            dict(_sums), dict(_counters), dict(_gauges),
+        )
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f"metrics-{pid}.json")
+
+
+def _dump(histograms, sums, counters, gauges):
+    return {
+        "histograms": [[name, labels, counts, sums[(name, labels)]] for (name, labels), counts in histograms.items()],
+        "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+        "gauges": [[name, labels, value] for (name, labels), value in gauges.items()],
+    }
+
+
+def _write(path, data):
+    with open(f"{path}.tmp", "wb") as snapshot:
+        snapshot.write(orjson.dumps(data))
+    os.replace(f"{path}.tmp", path)
+
+
+def _read(path):
+    try:
+        with open(path, "rb") as snapshot:
+            return orjson.loads(snapshot.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None  # Being replaced, or removed
+
+
+def _merge(data, histograms, sums, counters, gauges=None, pid=None):
+    """Add a snapshot's counters and histograms; its gauges too, labelled with `pid`, when `gauges` is given."""
+    for name, labels, counts, total in data["histograms"]:
+        key = (name, tuple(map(tuple, labels)))
+        merged = histograms.setdefault(key, [0] * len(counts))
+        histograms[key] = [a + b for a, b in zip(merged, counts)]
+        sums[key] = sums.get(key, 0.0) + total
+    for name, labels, value in data["counters"]:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    if gauges is not None:
+        for name, labels, value in data["gauges"]:
+            gauges[(name, tuple(map(tuple, labels)) + (("pid", str(pid)),))] = value
+
+
+@contextmanager
+def _directory_lock():
+    """Serializes retiring snapshots across the processes sharing METRICS_DIR."""
+    with open(os.path.join(METRICS_DIR, "metrics.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def flush_metrics():
+    """Write this process's metrics to METRICS_DIR, replacing its previous snapshot."""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write(_snapshot_path(os.getpid()), _dump(*_snapshot()))
+
+
+def retire_worker(pid):
+    """
+    Fold the snapshot of worker `pid`, which has exited, into RETIRED_SNAPSHOT and
+    remove it: its counters keep adding up, its gauges are dropped, and a later
+    process given the same pid starts from zero.
+    """
+    path = _snapshot_path(pid)
+    if not METRICS_DIR or not os.path.exists(path):
+        return
+    with _directory_lock():
+        data = _read(path)
+        if data is None:
+            return
+        retired = _read(os.path.join(METRICS_DIR, RETIRED_SNAPSHOT)) or {"histograms": [], "counters": []}
+        histograms, sums, counters = {}, {}, {}
+        _merge(retired, histograms, sums, counters)
+        _merge(data, histograms, sums, counters)
+        _write(os.path.join(METRICS_DIR, RETIRED_SNAPSHOT), _dump(histograms, sums, counters, {}))
+        os.remove(path)
+
+
+def clear_metrics_dir():
+    """Remove every snapshot from METRICS_DIR; run when the server starts, before any worker."""
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+    for entry in os.listdir(METRICS_DIR):
+        if re.fullmatch(r"metrics-(\d+|retired)\.json(\.tmp)?", entry):
+            os.remove(os.path.join(METRICS_DIR, entry))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Exists, but belongs to another user
+    return True
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            flush_metrics()
+        except OSError as e:
+            print(f"Could not write metrics to {METRICS_DIR}: {e}")
+
+
+def _start_flusher():
+    """Start the snapshot thread once per process; a forked worker starts its own."""
+    global _flusher_pid
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    try:
+        # A snapshot already under this pid was left by an exited process that had it before
+        retire_worker(_flusher_pid)
+    except OSError as e:
+        print(f"Could not retire old metrics in {METRICS_DIR}: {e}")
+    threading.Thread(target=_flush_periodically, name="metrics-flush", daemon=True).start()
+    atexit.register(flush_metrics)
+
+
+def _collect():
+    """
+    Metrics of this process, plus those written by the other workers when METRICS_DIR
+    is set. Counters and histograms are summed, including those of exited workers;
+    gauges get a `pid` label per live worker.
+    """
+    histograms, sums, counters, gauges = _snapshot()
+    if not METRICS_DIR:
+        return histograms, sums, counters, gauges
+
+    own_pid = os.getpid()
+    gauges = {(name, labels + (("pid", str(own_pid)),)): value for (name, labels), value in gauges.items()}
+    try:
+        entries = os.listdir(METRICS_DIR)
+    except FileNotFoundError:
+        entries = []
+    pids = [int(match.group(1)) for entry in entries if (match := re.fullmatch(r"metrics-(\d+)\.json", entry))]
+    for pid in pids:
+        if pid == own_pid:
+            continue
+        if not _alive(pid):
+            try:
+                retire_worker(pid)
+            except OSError as e:
+                print(f"Could not retire metrics of worker {pid}: {e}")
+            continue
+        data = _read(_snapshot_path(pid))
+        if data is not None:
+            _merge(data, histograms, sums, counters, gauges, pid)
+    retired = _read(os.path.join(METRICS_DIR, RETIRED_SNAPSHOT))
+    if retired is not None:
+        _merge(retired, histograms, sums, counters)
+    return histograms, sums, counters, gauges
+
+
+def render_prometheus():
+    """Render all metrics in the Prometheus text exposition format; see `_collect` for multi-worker servers."""
+    lines = []
+    histograms, sums, counters, gauges = _collect()
+
+    seen = set()
+    for (name, labels), counts in sorted(histograms.items()):
+        if name not in seen:
+            lines.append(f"# TYPE {name} histogram")
+            seen.add(name)
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {sums[(name, labels)]:.6f}")
+        lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+    for kind, series in (("counter", counters), ("gauge", gauges)):
+        for (name, labels), value in sorted(series.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {name} {kind}")
+                seen.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    # Cache hit ratios, derived from the cache request counters
+    lookups = defaultdict(lambda: [0, 0])
+    for (name, labels), value in counters.items():
+        if name == "card_cache_requests_total":
+            labels = dict(labels)
+            lookups[labels["cache"]][labels["result"] == "hit"] += value
+    if lookups:
+        lines.append("# TYPE card_cache_hit_ratio gauge")
+        for cache, (misses, hits) in sorted(lookups.items()):
+            lines.append(f'card_cache_hit_ratio{{cache="{_escape(cache)}"}} {hits / (hits + misses):.4f}')
+
+    return "\n".join(lines) + "\n"
+
+
+def server_timing_header(timings, total):
+    """Format per-request span timings as a Server-Timing header value."""
+    entries = [
+        f'{re.sub(r"[^A-Za-z0-9_-]", "_", name)};dur={seconds * 1000:.1f};desc="{count} call(s)"'
+        for name, (seconds, count) in sorted(timings.items())
+    ]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
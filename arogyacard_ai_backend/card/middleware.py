@@ -0,0 +1,164 @@
+import cProfile
+import gzip
+import os
+import time
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from . import metrics, profiling
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Encodings to offer, in order of preference, e.g. "br,gzip"; empty disables compression
+RESPONSE_COMPRESSION = [
+    encoding.strip() for encoding in os.getenv("RESPONSE_COMPRESSION", "br,gzip").split(",")
+    if encoding.strip() and (encoding.strip() != "br" or brotli)
+]
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "5"))
+
+# Only API data is compressed. HTML pages (admin, browsable API) carry CSRF tokens, and
+# compressing a secret next to text an attacker can influence leaks it (BREACH).
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson")
+
+
+class ServerTimingMiddleware:
+    """
+    Times every DB query and instrumented upstream call made while handling a
+    request, reports them in a Server-Timing header and feeds the /metrics histograms.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(metrics.query_timer):
+                response = self.get_response(request)
+        finally:
+            total = time.perf_counter() - start
+            timings = metrics.finish_request(token)
+
+        match = getattr(request, "resolver_match", None)
+        endpoint = match.route if match else "unmatched"
+        metrics.observe("card_request_latency_seconds", total, endpoint=endpoint, method=request.method)
+        metrics.increment(
+            "card_requests_total", endpoint=endpoint, method=request.method,
+            status=f"{response.status_code // 100}xx",
+        )
+        response["Server-Timing"] = metrics.server_timing_header(timings, total)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles sampled or explicitly requested requests with cProfile (see
+    card/profiling.py) and names the saved profile in an X-Profile-Id header.
+    """
+
+    def __init__(self, get_response):
+        if not profiling.profiling_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profiling.should_profile(request):
+            return self.get_response(request)
+        with profiling.profiling_slot() as acquired:
+            if not acquired:
+                return self.get_response(request)
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+
+        match = getattr(request, "resolver_match", None)
+        response["X-Profile-Id"] = profiling.save_profile(profiler, request.method, match.route if match else "unmatched")
+        return response
+
+
+def _accepted_encodings(header):
+    """Encodings named in an Accept-Encoding header with a non-zero q-value."""
+    accepted = set()
+    for item in header.split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name and quality > 0:
+            accepted.add(name.lower())
+    return accepted
+
+
+def _weaken_etag(response):
+    # The compressed body is a different representation, so a strong validator must be weakened
+    etag = response.get("ETag")
+    if etag and etag.startswith('"'):
+        response["ETag"] = "W/" + etag
+
+
+class CompressionMiddleware:
+    """
+    Brotli/gzip compression of JSON and NDJSON responses, negotiated from
+    Accept-Encoding in the order configured by RESPONSE_COMPRESSION. Small
+    bodies and other content types are sent as-is.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not RESPONSE_COMPRESSION or response.has_header("Content-Encoding"):
+            return response
+        accepted = _accepted_encodings(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        encoding = next((name for name in RESPONSE_COMPRESSION if name in accepted), None)
+
+        length = getattr(response, "representation_length", None)
+        if response.status_code == 304 and length is not None:
+            # A 304 from httpcache has no Content-Type; answer with the validator its 200 carried,
+            # which is weak only if that body was large enough to be compressed
+            patch_vary_headers(response, ("Accept-Encoding",))
+            if encoding is not None and length >= RESPONSE_COMPRESSION_MIN_BYTES:
+                _weaken_etag(response)
+            return response
+        if response.get("Content-Type", "").split(";")[0].strip().lower() not in COMPRESSIBLE_TYPES:
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if encoding != "gzip" or getattr(response, "is_async", False):
+                return response
+            response.streaming_content = compress_sequence(response.streaming_content)
+            response.headers.pop("Content-Length", None)
+        else:
+            if len(response.content) < RESPONSE_COMPRESSION_MIN_BYTES:
+                return response
+            if encoding == "br":
+                compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+            else:
+                compressed = gzip.compress(response.content, compresslevel=GZIP_LEVEL, mtime=0)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response["Content-Length"] = str(len(compressed))
+
+        _weaken_etag(response)
+        response["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,178 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:04
+
+import re
+
+import django.utils.timezone
+from django.db import migrations, models
+
+# The disease vocabulary as of this migration: canonical id -> normalized names.
+# Frozen here so later vocabulary changes cannot change what this migration does.
+VOCABULARY = {
+    'acute_diarrheal_disease': [
+        'acute diarrheal disease', 'acute diarrhoeal disease', 'add', 'acute diarrhea', 'acute diarrhoea', 'diarrhea',
+        'diarrhoea', 'loose motions',
+    ],
+    'acute_encephalitis_syndrome': ['acute encephalitis syndrome', 'aes', 'encephalitis'],
+    'acute_respiratory_infection': [
+        'acute respiratory infection', 'ari', 'respiratory infection', 'upper respiratory tract infection', 'urti',
+    ],
+    'allergic_rhinitis': ['allergic rhinitis', 'hay fever', 'nasal allergy'],
+    'angina': ['angina', 'angina pectoris', 'cardiac chest pain'],
+    'anthrax': ['anthrax', 'cutaneous anthrax'],
+    'asthma': ['asthma', 'bronchial asthma', 'asthma attack'],
+    'bronchitis': ['bronchitis', 'acute bronchitis', 'chest infection'],
+    'chickenpox': ['chickenpox', 'chicken pox', 'varicella'],
+    'chikungunya': ['chikungunya', 'chikungunya fever', 'chikungunya virus infection'],
+    'cholera': ['cholera', 'vibrio cholerae infection'],
+    'common_cold': ['common cold', 'viral rhinitis', 'coryza', 'cold'],
+    'conjunctivitis': ['conjunctivitis', 'pink eye', 'eye flu'],
+    'covid_19': ['covid 19', 'covid', 'coronavirus', 'sars cov 2', 'sars cov 2 infection'],
+    'dengue': [
+        'dengue', 'dengue fever', 'dengue hemorrhagic fever', 'dengue haemorrhagic fever', 'dhf', 'breakbone fever',
+    ],
+    'diabetes': ['diabetes', 'diabetes mellitus', 'type 2 diabetes', 'type 1 diabetes', 'high blood sugar'],
+    'diphtheria': ['diphtheria'],
+    'dysentery': ['dysentery', 'bacillary dysentery', 'shigellosis', 'amoebic dysentery', 'amoebiasis'],
+    'food_poisoning': ['food poisoning', 'foodborne illness', 'food borne illness'],
+    'gastritis': ['gastritis', 'acidity', 'acid reflux', 'gerd', 'hyperacidity', 'indigestion', 'dyspepsia'],
+    'gastroenteritis': ['gastroenteritis', 'stomach flu', 'acute gastroenteritis', 'age', 'viral gastroenteritis'],
+    'hand_foot_mouth_disease': ['hand foot and mouth disease', 'hfmd', 'hand foot mouth disease'],
+    'heart_attack': ['heart attack', 'myocardial infarction', 'mi', 'acute coronary syndrome', 'cardiac arrest'],
+    'hepatitis_a': ['hepatitis a', 'hepatitis a virus', 'hep a', 'hav infection', 'hav'],
+    'hepatitis_b': ['hepatitis b', 'hepatitis b virus', 'hep b', 'hbv infection', 'hbv'],
+    'hepatitis_c': ['hepatitis c', 'hepatitis c virus', 'hep c', 'hcv infection', 'hcv'],
+    'hepatitis_e': ['hepatitis e', 'hepatitis e virus', 'hep e', 'hev infection', 'hev'],
+    'human_rabies': ['human rabies', 'rabies'],
+    'hypertension': ['hypertension', 'high blood pressure', 'high bp'],
+    'influenza': ['influenza', 'seasonal influenza', 'influenza a', 'h1n1', 'swine flu', 'h3n2', 'flu'],
+    'jaundice': ['jaundice', 'icterus', 'yellow jaundice', 'obstructive jaundice'],
+    'japanese_encephalitis': ['japanese encephalitis', 'je'],
+    'kyasanur_forest_disease': ['kyasanur forest disease', 'kfd', 'monkey fever'],
+    'leptospirosis': ['leptospirosis', 'weil s disease', 'weils disease'],
+    'malaria': [
+        'malaria', 'plasmodium falciparum malaria', 'falciparum malaria', 'vivax malaria', 'pf malaria', 'pv malaria',
+    ],
+    'measles': ['measles', 'rubeola'],
+    'migraine': ['migraine', 'migraine headache', 'migraine with aura', 'migraine without aura'],
+    'mumps': ['mumps', 'parotitis'],
+    'nipah_virus_infection': ['nipah virus infection', 'nipah', 'nipah virus'],
+    'pertussis': ['pertussis', 'whooping cough'],
+    'pneumonia': ['pneumonia', 'lung infection', 'community acquired pneumonia'],
+    'rubella': ['rubella', 'german measles'],
+    'scrub_typhus': ['scrub typhus', 'tsutsugamushi disease'],
+    'sinusitis': ['sinusitis', 'sinus infection', 'rhinosinusitis'],
+    'tension_headache': ['tension headache', 'tension type headache', 'stress headache'],
+    'tuberculosis': ['tuberculosis', 'tb', 'pulmonary tuberculosis', 'pulmonary tb'],
+    'typhoid': ['typhoid', 'typhoid fever', 'enteric fever', 'paratyphoid'],
+    'urinary_tract_infection': ['urinary tract infection', 'uti', 'bladder infection', 'cystitis'],
+    'viral_fever': ['viral fever', 'viral infection', 'febrile illness', 'fever', 'pyrexia'],
+    'viral_hepatitis': ['viral hepatitis', 'hepatitis', 'infectious hepatitis', 'acute viral hepatitis'],
+    'zika_virus_disease': ['zika virus disease', 'zika', 'zika fever', 'zika virus'],
+}
+
+QUALIFIERS = {
+    "possible", "probable", "probably", "likely", "suspected", "suspect", "suspicion",
+    "presumed", "mild", "moderate", "severe", "case", "cases", "outbreak", "of",
+}
+
+# Generic words and abbreviations that only count when they are the whole name
+EXACT_ONLY = {"cold", "fever", "flu", "pyrexia", "hav", "hbv", "hcv", "hev"}
+
+# Words that turn a name into its negation: "not dengue", "dengue ruled out"
+NEGATION_PREFIXES = [("no",), ("not",), ("negative", "for"), ("rule", "out"), ("ruled", "out")]
+NEGATION_SUFFIXES = [("negative",), ("excluded",), ("unlikely",), ("ruled", "out")]
+
+TERMS = {term: disease for disease, terms in VOCABULARY.items() for term in terms}
+
+
+def disease_id(text):
+    """
+    Canonical id for an exact or contained vocabulary name. Anything else, including
+    negations such as "dengue ruled out", becomes 'unknown' rather than an id made up
+    from free text.
+    """
+    normalized = re.sub(r"\(.*?\)|\[.*?\]", " ", (text or "").lower()).replace("&", " and ")
+    tokens = [token for token in re.sub(r"[^a-z0-9]+", " ", normalized).split() if token not in QUALIFIERS]
+    key = " ".join(tokens)
+    if key in TERMS:
+        return TERMS[key]
+    negated = any(tuple(tokens[:len(words)]) == words for words in NEGATION_PREFIXES) or any(
+        tuple(tokens[-len(words):]) == words for words in NEGATION_SUFFIXES
+    )
+    if not tokens or negated:
+        return "unknown"
+    padded = f" {key} "
+    contained = [term for term in TERMS if len(term) >= 4 and term not in EXACT_ONLY and f" {term} " in padded]
+    return TERMS[max(contained, key=len)] if contained else "unknown"
+
+
+def backfill_diagnosed_on(apps, schema_editor):
+    """Store existing diagnoses by disease id and date them, dropping same-day duplicates."""
+    DiagnosedDisease = apps.get_model('card', 'DiagnosedDisease')
+    seen = set()
+    duplicates = []
+    for diagnosis in DiagnosedDisease.objects.order_by('created_at').iterator():
+        diagnosis.disease = disease_id(diagnosis.disease)
+        diagnosis.diagnosed_on = django.utils.timezone.localdate(diagnosis.created_at)
+        key = (diagnosis.hid_id, diagnosis.disease, diagnosis.diagnosed_on)
+        if key in seen:
+            duplicates.append(diagnosis.pk)
+            continue
+        seen.add(key)
+        diagnosis.save(update_fields=['disease', 'diagnosed_on'])
+    DiagnosedDisease.objects.filter(pk__in=duplicates).delete()
+
+
+def backfill_daily_counts(apps, schema_editor):
+    DiagnosedDisease = apps.get_model('card', 'DiagnosedDisease')
+    DiseaseDailyCount = apps.get_model('card', 'DiseaseDailyCount')
+    rows = (
+        DiagnosedDisease.objects.values('disease', 'diagnosed_on')
+        .annotate(total=models.Count('id'))
+    )
+    DiseaseDailyCount.objects.bulk_create([
+        DiseaseDailyCount(disease=row['disease'], day=row['diagnosed_on'], count=row['total'])
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('card', '0002_diagnoseddisease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiseaseDailyCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('disease', models.CharField(max_length=255)),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='diagnoseddisease',
+            name='diagnosed_on',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.RunPython(backfill_diagnosed_on, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='diagnoseddisease',
+            index=models.Index(fields=['disease', 'created_at'], name='diagnosis_disease_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='diagnoseddisease',
+            constraint=models.UniqueConstraint(fields=('hid', 'disease', 'diagnosed_on'), name='unique_daily_diagnosis'),
+        ),
+        migrations.AddIndex(
+            model_name='diseasedailycount',
+            index=models.Index(fields=['day', 'disease'], name='disease_count_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='diseasedailycount',
+            constraint=models.UniqueConstraint(fields=('disease', 'day'), name='unique_disease_day'),
+        ),
+        migrations.RunPython(backfill_daily_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('card', '0005_first_turn_response'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chathistory',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedConversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codec', models.CharField(max_length=10)),
+                ('data', models.BinaryField()),
+                ('original_bytes', models.PositiveIntegerField()),
+                ('compressed_bytes', models.PositiveIntegerField()),
+                ('turn_count', models.PositiveIntegerField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('chat_history', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archive', to='card.chathistory')),
+            ],
+        ),
+    ]
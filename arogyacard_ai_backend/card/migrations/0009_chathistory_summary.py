@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:40
+
+import gzip
+
+import orjson
+from django.db import migrations, models
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PREVIEW_LENGTH = 100
+
+
+# card.archive.decompress as of this migration, frozen here so later archive changes cannot break it
+def decompress(codec, data):
+    data = bytes(data)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('Conversation was archived with zstd; install the zstandard package to read it')
+        return orjson.loads(zstandard.ZstdDecompressor().decompress(data))
+    return orjson.loads(gzip.decompress(data))
+
+
+def backfill_summaries(apps, schema_editor):
+    """Fill preview and turn_count from each conversation, or from its archived copy."""
+    ChatHistory = apps.get_model('card', 'ChatHistory')
+    ArchivedConversation = apps.get_model('card', 'ArchivedConversation')
+    batch = []
+    for chat_history in ChatHistory.objects.only('id', 'conversation', 'archived_at').iterator(chunk_size=500):
+        conversation = chat_history.conversation
+        if chat_history.archived_at is not None:
+            archived = ArchivedConversation.objects.filter(chat_history_id=chat_history.pk).first()
+            if archived is not None:
+                conversation = decompress(archived.codec, archived.data)
+        text = str(conversation)
+        chat_history.preview = text[:PREVIEW_LENGTH] + '...' if len(text) > PREVIEW_LENGTH else text
+        chat_history.turn_count = len(conversation)
+        batch.append(chat_history)
+        if len(batch) == 500:
+            ChatHistory.objects.bulk_update(batch, ['preview', 'turn_count'])
+            batch = []
+    ChatHistory.objects.bulk_update(batch, ['preview', 'turn_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('card', '0008_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chathistory',
+            name='preview',
+            field=models.CharField(blank=True, max_length=103),
+        ),
+        migrations.AddField(
+            model_name='chathistory',
+            name='turn_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,141 @@
+import uuid
 from django.db import models
+from django.utils import timezone
+
+PREVIEW_LENGTH = 100
+
+
+def conversation_preview(conversation):
+    """str(conversation) cut to PREVIEW_LENGTH, built from the first turns only."""
+    text = "{"
+    for index, (question, answer) in enumerate(conversation.items()):
+        text += (", " if index else "") + f"{question!r}: {answer!r}"
+        if len(text) > PREVIEW_LENGTH:
+            return text[:PREVIEW_LENGTH] + "..."
+    return text + "}"
 
 class ChatHistory(models.Model):
     hid = models.CharField(max_length=255, unique=True)
     conversation = models.JSONField(default=dict)  # Stores chat history
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # High-water mark for incremental exports
+    archived_at = models.DateTimeField(null=True, blank=True)  # Set while the conversation lives in ArchivedConversation
+    # Kept in step with `conversation` by save(), so list views never load the conversation itself
+    preview = models.CharField(max_length=PREVIEW_LENGTH + 3, blank=True)
+    turn_count = models.PositiveIntegerField(default=0)
+
+    def refresh_summary(self):
+        """Recompute `preview` and `turn_count` from the conversation."""
+        self.preview = conversation_preview(self.conversation)
+        self.turn_count = len(self.conversation)
+
+    def save(self, *args, **kwargs):
+        # An archived row only holds a stub, so it keeps the summary of its archived conversation
+        if self.archived_at is None and "conversation" not in self.get_deferred_fields():
+            self.refresh_summary()
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None and "conversation" in update_fields:
+                kwargs["update_fields"] = {*update_fields, "preview", "turn_count"}
+        super().save(*args, **kwargs)
+
+class ArchivedConversation(models.Model):
+    """Compressed cold copy of an idle conversation; the ChatHistory row keeps an empty stub."""
+    chat_history = models.OneToOneField(ChatHistory, on_delete=models.CASCADE, related_name="archive")
+    codec = models.CharField(max_length=10)  # "zstd" or "gzip"
+    data = models.BinaryField()
+    original_bytes = models.PositiveIntegerField()
+    compressed_bytes = models.PositiveIntegerField()
+    turn_count = models.PositiveIntegerField()
+    archived_at = models.DateTimeField(auto_now_add=True)
 
 class DiagnosedDisease(models.Model):
     hid = models.ForeignKey(ChatHistory, on_delete=models.CASCADE, related_name="diseases")
     disease = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)  # To track when the disease was diagnosed
+    diagnosed_on = models.DateField(default=timezone.localdate)  # Day used to deduplicate repeat diagnoses
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["hid", "disease", "diagnosed_on"], name="unique_daily_diagnosis"),
+        ]
+        indexes = [
+            models.Index(fields=["disease", "created_at"], name="diagnosis_disease_created_idx"),
+        ]
+
+class DiseaseDailyCount(models.Model):
+    """Per-day diagnosis counts, maintained incrementally whenever a new diagnosis is recorded."""
+    disease = models.CharField(max_length=255)
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["disease", "day"], name="unique_disease_day"),
+        ]
+        indexes = [
+            models.Index(fields=["day", "disease"], name="disease_count_day_idx"),
+        ]
+
+class FirstTurnResponse(models.Model):
+    """A first follow-up the LLM gave to an opening message, reused for near-identical openings."""
+    normalized = models.CharField(max_length=500, unique=True)
+    query = models.TextField()
+    categories = models.JSONField(default=list)  # Triage categories the reuse must agree with
+    response = models.TextField()
+    hits = models.PositiveIntegerField(default=0)
+    enabled = models.BooleanField(default=True)  # Untick in the admin to stop reusing a response
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class ReportUpload(models.Model):
+    """A resumable, chunked upload of a medical report."""
+    STATUS_CHOICES = [
+        ("pending", "Receiving chunks"),
+        ("finalizing", "Finalizing"),
+        ("complete", "Complete"),
+        ("failed", "Failed"),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, default="application/pdf")
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)  # Bytes received so far; chunks must arrive in order
+    expected_sha256 = models.CharField(max_length=64, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    blob_name = models.CharField(max_length=512, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+class UploadPart(models.Model):
+    """One chunk of a ReportUpload, forwarded to storage as its own object until finalize composes them."""
+    upload = models.ForeignKey(ReportUpload, on_delete=models.CASCADE, related_name="parts")
+    index = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    stored = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["upload", "index"], name="unique_upload_part"),
+        ]
+
+class IdempotencyKey(models.Model):
+    """The outcome of a POST sent with an Idempotency-Key header, replayed to retries of the same request."""
+    STATUS_CHOICES = [
+        ("processing", "Processing"),
+        ("complete", "Complete"),
+    ]
+    endpoint = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)  # SHA-256 of the request, so a reused key with a new body is refused
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="processing")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True)
+    locked_until = models.DateTimeField()  # A processing key past this is taken over, its worker presumed dead
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["endpoint", "key"], name="unique_idempotency_key"),
+        ]
@@ -1,5 +1,18 @@
 from eventregistry import *
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from django.db import connections
+from . import singleflight, upstream
+
+NEWS_KEYWORDS = ["disease", "epidemic", "outbreak", "virus", "infection",
+                 "pollution", "air quality", "water contamination",
+                 "environmental hazard"]
+MAX_DIGEST_CITIES = int(os.getenv("NEWS_DIGEST_MAX_CITIES", "25"))
+MAX_DIGEST_ITEMS = int(os.getenv("NEWS_DIGEST_MAX_ITEMS", "5000"))
+# Articles fetched per slot in the digest; syndicated copies and weaker mentions are dropped when assigning
+DIGEST_OVERFETCH = 2
 
 def get_news(city, country=None, max_items=500):
     """
@@ -13,33 +26,188 @@ def get_news(city, country=None, max_items=500):
     
     Returns:
     list: List of article objects
+
+    If Event Registry fails, the last articles fetched for the same city are returned.
+    Concurrent requests for the same city share one query.
     """
+    location_query = city
+    if country:
+        location_query += ", " + country
+    return singleflight.run(
+        "news", f"{location_query}|{max_items}",
+        lambda: _fetch_news(location_query, max_items),
+        cacheable=lambda articles: bool(articles),
+    )
+
+
+def _client():
     # Get API key from environment variables
     api_key = os.environ.get("EVENT_REGISTRY_API_KEY")
     if not api_key:
         raise ValueError("EVENT_REGISTRY_API_KEY environment variable not set")
         
-    er = EventRegistry(apiKey=api_key)
-    
-    # Get location URI for the city
-    location_query = city
-    if country:
-        location_query += ", " + country
-    city_uri = er.getLocationUri(location_query)
+    return EventRegistry(
+        apiKey=api_key,
+        repeatFailedRequestCount=upstream.service_settings("event_registry")["retries"],
+    )
+
+
+def _with_stale_fallback(stale_key, fetch):
+    """Run `fetch`; if Event Registry fails, return what it returned last time for the same key."""
+    try:
+        articles = fetch()
+    except Exception as e:
+        print(f"Error fetching news for {stale_key}: {e}")
+        articles = upstream.stale("event_registry", stale_key)
+        if articles is None:
+            raise
+        return articles
+
+    upstream.remember("event_registry", stale_key, articles)
+    return articles
+
+
+def _fetch_news(location_query, max_items):
+    er = _client()
+    return _with_stale_fallback(
+        f"{location_query}|{max_items}", lambda: _query_city_news(er, location_query, max_items),
+    )
+
+
+def _query_city_news(er, location_query, max_items):
+    city_uri = upstream.call("event_registry", er.getLocationUri, location_query, operation="location_uri")
     
     # Query for disease and pollution news related to the city
     query = QueryArticlesIter(
-        keywords=QueryItems.OR(["disease", "epidemic", "outbreak", "virus", "infection", 
-                               "pollution", "air quality", "water contamination", 
-                               "environmental hazard"]),
+        keywords=QueryItems.OR(NEWS_KEYWORDS),
         locationUri=city_uri,  # Articles mentioning this location
         dataType=["news"]
     )
     
     # Collect articles in a list
-    articles = []
-    for art in query.execQuery(er, sortBy="date", maxItems=max_items):
-        articles.append(art)
-    
-    return articles
+    return upstream.call(
+        "event_registry",
+        lambda: list(query.execQuery(er, sortBy="date", maxItems=max_items)),
+        operation="articles",
+    )
+
+
 
+def _location_query(city, country=None):
+    return f"{city}, {country}" if country else city
+
+
+def resolve_locations(location_queries):
+    """Event Registry location URIs for several places, looked up concurrently and cached for weeks."""
+    def resolve(location_query):
+        try:
+            return singleflight.run(
+                "news_locations", location_query,
+                lambda: upstream.call("event_registry", _client().getLocationUri, location_query, operation="location_uri"),
+                cacheable=lambda uri: bool(uri),
+            )
+        finally:
+            connections.close_all()  # Pool threads are dropped with the pool; do not leave connections behind
+
+    unique = list(dict.fromkeys(location_queries))
+    with ThreadPoolExecutor(max_workers=min(8, len(unique) or 1)) as pool:
+        # Each lookup runs in a copy of this request's context, so its upstream time shows in Server-Timing
+        futures = [pool.submit(copy_context().run, resolve, location_query) for location_query in unique]
+        return {location_query: future.result() for location_query, future in zip(unique, futures)}
+
+
+def _query_digest_news(er, location_uris, max_items):
+    query = QueryArticlesIter(
+        keywords=QueryItems.OR(NEWS_KEYWORDS),
+        locationUri=QueryItems.OR(location_uris),  # Articles mentioning any of the cities
+        dataType=["news"],
+    )
+    # Concept and dateline locations let articles be assigned to cities without another query
+    return_info = ReturnInfo(articleInfo=ArticleInfoFlags(concepts=True, location=True))
+    return upstream.call(
+        "event_registry",
+        lambda: list(query.execQuery(er, sortBy="date", maxItems=max_items, returnInfo=return_info)),
+        operation="articles",
+    )
+
+
+def _article_uris(article):
+    uris = {concept.get("uri") for concept in article.get("concepts") or [] if concept.get("type") == "loc"}
+    location = article.get("location") or {}
+    return (uris | {location.get("uri")}) - {None}
+
+
+def _mention_score(article, city, uri, uris):
+    """How strongly an article is about a city: tagged location, named in the title, named in the body."""
+    pattern = re.compile(rf"\b{re.escape(city)}\b", re.IGNORECASE)
+    return (
+        3 * (uri in uris)
+        + 2 * bool(pattern.search(article.get("title") or ""))
+        + bool(pattern.search(article.get("body") or ""))
+    )
+
+
+def build_digest(cities, city_uris, articles, per_city=20):
+    """
+    Assign each article to the requested city it is most about, so an article
+    mentioning several cities is listed once (with `also_mentions`), and rank
+    each city's articles by that score, then by recency.
+    """
+    assigned = {city: [] for city in cities}
+    seen = set()
+    for article in articles:
+        title_key = re.sub(r"\W+", " ", (article.get("title") or "").lower()).strip()
+        if article.get("uri") in seen or title_key in seen:  # Syndicated copies of the same story
+            continue
+        seen.update({article.get("uri"), title_key} - {None, ""})
+
+        uris = _article_uris(article)
+        scores = [(_mention_score(article, city, city_uris.get(city), uris), city) for city in cities]
+        mentioned = [(score, city) for score, city in scores if score]
+        if not mentioned:
+            continue
+        best_score = max(score for score, _ in mentioned)
+        best_city = next(city for score, city in mentioned if score == best_score)
+        entry = {key: value for key, value in article.items() if key != "concepts"}
+        entry["also_mentions"] = [city for _, city in mentioned if city != best_city]
+        assigned[best_city].append((best_score, article.get("dateTime") or "", entry))
+
+    return [
+        {
+            "city": city,
+            "resolved": bool(city_uris.get(city)),
+            "news": [entry for _, _, entry in sorted(assigned[city], key=lambda item: item[:2], reverse=True)[:per_city]],
+        }
+        for city in cities
+    ]
+
+
+def digest_size(city_count, per_city):
+    """Articles to fetch for a digest, enough to fill every city's list up to NEWS_DIGEST_MAX_ITEMS."""
+    return min(MAX_DIGEST_ITEMS, max(500, DIGEST_OVERFETCH * per_city * city_count))
+
+
+def get_news_digest(cities, country=None, max_items=None, per_city=20):
+    """
+    News for several cities from one Event Registry query over all their
+    locations, assigned to cities locally. Location lookups are cached, and the
+    combined query shares the `news` single-flight cache and stale fallback.
+    By default the query fetches digest_size() articles.
+
+    Returns a list of {"city", "resolved", "news"} in the order of `cities`.
+    """
+    cities = list(dict.fromkeys(city.strip() for city in cities if city and city.strip()))
+    resolved = resolve_locations([_location_query(city, country) for city in cities])
+    city_uris = {city: resolved[_location_query(city, country)] for city in cities}
+    location_uris = sorted({uri for uri in city_uris.values() if uri})
+
+    articles = []
+    if location_uris:
+        max_items = max_items or digest_size(len(location_uris), per_city)
+        key = f"digest|{'|'.join(location_uris)}|{max_items}"
+        articles = singleflight.run(
+            "news", key,
+            lambda: _with_stale_fallback(key, lambda: _query_digest_news(_client(), location_uris, max_items)),
+            cacheable=lambda articles: bool(articles),
+        )
+    return build_digest(cities, city_uris, articles, per_city)
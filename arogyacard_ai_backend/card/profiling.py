@@ -0,0 +1,78 @@
+"""
+On-demand cProfile profiles of individual requests.
+
+A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>` or is picked
+by PROFILE_SAMPLE_RATE. Each profile is written to PROFILE_DIR as a pstats file
+named after its endpoint; only the newest PROFILE_MAX_FILES are kept.
+`manage.py profile_report` aggregates them into the top functions per endpoint.
+
+With no token and a zero sample rate the middleware removes itself at startup,
+so profiling costs nothing when it is off.
+"""
+import hmac
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from .metrics import increment
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", str(settings.BASE_DIR / "profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+PROFILE_HEADER = "X-Profile"
+
+# cProfile hooks one thread; profile one request at a time so concurrent requests don't interfere
+_busy = threading.Lock()
+
+
+def profiling_enabled():
+    return bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+
+@contextmanager
+def profiling_slot():
+    """Yields whether the caller may profile now: False while another request of this process is profiled."""
+    acquired = _busy.acquire(blocking=False)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            _busy.release()
+
+
+def should_profile(request):
+    """Whether to profile this request: an authorized header, or the sample rate."""
+    token = request.headers.get(PROFILE_HEADER)
+    if token is not None and PROFILE_TOKEN:
+        return hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def endpoint_slug(method, endpoint):
+    return f"{method}_{re.sub(r'[^A-Za-z0-9]+', '_', endpoint).strip('_') or 'root'}"
+
+
+def parse_profile_name(filename):
+    """Endpoint slug of a file written by save_profile, or None for other files."""
+    match = re.fullmatch(r"\d+-\d+-(.+)\.prof", filename)
+    return match.group(1) if match else None
+
+
+def save_profile(profiler, method, endpoint):
+    """Write the profile to PROFILE_DIR, drop the oldest files beyond PROFILE_MAX_FILES. Returns the file name."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{time.time_ns() // 1000}-{os.getpid()}-{endpoint_slug(method, endpoint)}.prof"
+    profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+    increment("card_profiles_total", endpoint=endpoint)
+
+    profiles = sorted(entry for entry in os.listdir(PROFILE_DIR) if parse_profile_name(entry))
+    for old in profiles[:max(0, len(profiles) - PROFILE_MAX_FILES)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, old))
+        except FileNotFoundError:  # Pruned by another worker
+            pass
+    return name
@@ -0,0 +1,209 @@
+"""
+Token-bucket rate limiting for paid upstream API keys, shared by every worker.
+
+Buckets live in a small SQLite file (QUOTA_DB) that all worker processes on a
+host update inside `BEGIN IMMEDIATE` transactions, so together they stay under
+each API's request rate and daily budget instead of bouncing off 429s.
+Every API has its own bucket, even where several share an API key, because
+Google enforces quota per API rather than per key.
+
+Work runs at "interactive" priority unless wrapped in `with priority("batch")`.
+Batch callers may not dip into the reserve kept for interactive requests, and
+stop early on the daily budget.
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from .metrics import increment, observe, set_gauge
+
+QUOTA_ENABLED = os.getenv("QUOTA_ENABLED", "true").lower() not in ("0", "false", "no")
+QUOTA_DB = os.getenv("QUOTA_DB", str(settings.BASE_DIR / "quota.sqlite3"))
+
+# Upstream service -> bucket, one per API whose quota the provider enforces
+SERVICE_BUCKETS = {
+    "groq": "groq",                     # GROQ_API_KEY
+    "gemini": "gemini",                 # GEMINI_API_KEY
+    "places": "google_places",          # GOOGLE_PLACES_API_KEY
+    "geocoding": "google_geocoding",    # Same key, separate Geocoding API quota
+    "youtube": "google_youtube",        # YOUTUBE_API_KEY
+    "cse": "google_cse",                # Same key, separate Custom Search API quota
+    "event_registry": "event_registry",  # EVENT_REGISTRY_API_KEY
+}
+
+# Per-bucket defaults; each value can be overridden with QUOTA_<BUCKET>_<SETTING>,
+# e.g. QUOTA_GROQ_PER_MINUTE=60 or QUOTA_GOOGLE_YOUTUBE_DAILY_BUDGET=0 (no daily limit).
+BUCKET_DEFAULTS = {
+    "groq": {"per_minute": 30, "burst": 10, "daily_budget": 14400},
+    "gemini": {"per_minute": 15, "burst": 5, "daily_budget": 1500},
+    "google_places": {"per_minute": 600, "burst": 50, "daily_budget": 0},
+    "google_geocoding": {"per_minute": 3000, "burst": 50, "daily_budget": 0},
+    "google_youtube": {"per_minute": 60, "burst": 10, "daily_budget": 100},  # 10,000 units at 100 per search
+    "google_cse": {"per_minute": 60, "burst": 10, "daily_budget": 100},
+    "event_registry": {"per_minute": 60, "burst": 10, "daily_budget": 0},
+}
+DEFAULT_SETTINGS = {
+    "per_minute": 60,
+    "burst": 10,
+    "daily_budget": 0,          # calls per UTC day; 0 means unlimited
+    "batch_reserve": 0.2,       # share of the burst and daily budget batch work may not use
+    "interactive_wait": 2.0,    # longest an interactive call waits for a token, in seconds
+    "batch_wait": 20.0,
+}
+
+PRIORITIES = ("interactive", "batch")
+_priority = ContextVar("quota_priority", default="interactive")
+_local = threading.local()
+
+
+class QuotaExceeded(Exception):
+    """No token could be taken for the service's API key within the allowed wait."""
+
+    def __init__(self, service, message, retry_after=None):
+        super().__init__(f"{service}: {message}")
+        self.service = service
+        self.retry_after = retry_after
+
+
+def bucket_settings(bucket):
+    values = {**DEFAULT_SETTINGS, **BUCKET_DEFAULTS.get(bucket, {})}
+    for name, default in values.items():
+        value = os.getenv(f"QUOTA_{bucket.upper()}_{name.upper()}")
+        if value is not None:
+            values[name] = type(default)(value)
+    return values
+
+
+@contextmanager
+def priority(name):
+    """Run the enclosed upstream calls at the given priority ("interactive" or "batch")."""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown quota priority: {name}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def _connection():
+    """Per-thread connection to the shared bucket store."""
+    if getattr(_local, "path", None) != QUOTA_DB:
+        conn = sqlite3.connect(QUOTA_DB, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL,"
+            " day TEXT NOT NULL, used INTEGER NOT NULL)"
+        )
+        _local.conn, _local.path = conn, QUOTA_DB
+    return _local.conn
+
+
+def _take(bucket, config, level):
+    """
+    Try to take one token. Returns 0 when granted, the seconds to wait before a
+    token can be available, or None when the daily budget is spent.
+    """
+    rate = config["per_minute"] / 60
+    burst = config["burst"]
+    floor = burst * config["batch_reserve"] if level == "batch" else 0
+    budget = config["daily_budget"]
+    if budget and level == "batch":
+        budget = int(budget * (1 - config["batch_reserve"]))
+
+    now = time.time()
+    today = time.strftime("%Y-%m-%d", time.gmtime(now))
+    conn = _connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT tokens, updated, day, used FROM buckets WHERE name = ?", (bucket,)).fetchone()
+        tokens, updated, day, used = row or (burst, now, today, 0)
+        tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+        if day != today:
+            day, used = today, 0
+
+        if budget and used >= budget:
+            wait = None
+        elif tokens - 1 >= floor:
+            tokens -= 1
+            used += 1
+            wait = 0
+        else:
+            wait = (floor + 1 - tokens) / rate if rate > 0 else None
+
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (name, tokens, updated, day, used) VALUES (?, ?, ?, ?, ?)",
+            (bucket, tokens, now, day, used),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    set_gauge("card_quota_daily_used", used, bucket=bucket)
+    return wait
+
+
+def acquire(service):
+    """
+    Take one token from the service's bucket, waiting up to the priority's limit.
+    Raises QuotaExceeded if none is available in time or the daily budget is spent.
+    Services without a bucket, and any failure of the store itself, let the call through.
+    """
+    bucket = SERVICE_BUCKETS.get(service)
+    if not QUOTA_ENABLED or bucket is None:
+        return
+    config = bucket_settings(bucket)
+    level = current_priority()
+    started = time.monotonic()
+    deadline = started + config[f"{level}_wait"]
+
+    while True:
+        try:
+            wait = _take(bucket, config, level)
+        except sqlite3.Error as e:
+            print(f"Quota store unavailable, not limiting {service}: {e}")
+            return
+        if wait == 0:
+            increment("card_quota_granted_total", bucket=bucket, priority=level)
+            observe("card_quota_wait_seconds", time.monotonic() - started, bucket=bucket, priority=level)
+            return
+        if wait is None:
+            increment("card_quota_rejected_total", bucket=bucket, priority=level, reason="daily_budget")
+            raise QuotaExceeded(service, f"daily budget for {bucket} spent", retry_after=86400 - time.time() % 86400)
+        if time.monotonic() + wait > deadline:
+            increment("card_quota_rejected_total", bucket=bucket, priority=level, reason="rate")
+            raise QuotaExceeded(service, f"rate limit for {bucket} reached", retry_after=wait)
+        # Jitter so waiting workers do not all retry the store at the same instant
+        time.sleep(wait + random.uniform(0, 0.05))
+
+
+def penalize(service, retry_after=None):
+    """
+    The upstream answered 429: empty the bucket for every worker, and keep it
+    empty for `retry_after` seconds when the upstream said how long to back off.
+    """
+    bucket = SERVICE_BUCKETS.get(service)
+    if not QUOTA_ENABLED or bucket is None:
+        return
+    rate = bucket_settings(bucket)["per_minute"] / 60
+    debt = -rate * retry_after if retry_after else 0.0
+    now = time.time()
+    try:
+        # The first call of the day may be the one that got the 429, before any row exists
+        _connection().execute(
+            "INSERT INTO buckets (name, tokens, updated, day, used) VALUES (?, ?, ?, ?, 0)"
+            " ON CONFLICT (name) DO UPDATE SET tokens = MIN(tokens, excluded.tokens), updated = excluded.updated",
+            (bucket, debt, now, time.strftime("%Y-%m-%d", time.gmtime(now))),
+        )
+    except sqlite3.Error as e:
+        print(f"Quota store unavailable, could not record 429 for {service}: {e}")
+    increment("card_quota_throttled_total", bucket=bucket)
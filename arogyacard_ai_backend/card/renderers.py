@@ -0,0 +1,35 @@
+import orjson
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Handles the few types orjson does not serialize natively (Decimal, lazy strings, querysets)
+_fallback_encoder = JSONEncoder()
+
+
+class ORJSONRenderer(JSONRenderer):
+    """DRF JSON renderer backed by orjson; compact unless the client asks for `; indent=N`."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        option = orjson.OPT_NON_STR_KEYS
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_fallback_encoder.default, option=option)
+
+
+class ORJSONParser(BaseParser):
+    """DRF JSON parser backed by orjson. Every endpoint takes a JSON object, so other bodies are a 400."""
+
+    media_type = "application/json"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            data = orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
+        if not isinstance(data, dict):
+            raise ParseError("JSON body must be an object.")
+        return data
@@ -3,7 +3,9 @@ from google.genai import types
 from google.cloud import storage
 import os
 from datetime import timedelta
+from functools import lru_cache
 from dotenv import load_dotenv
+from . import upstream
 load_dotenv()
 
 # Set the path to the service account key JSON
@@ -12,33 +14,115 @@ os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.join(os.path.dirname(__fi
 # Set your bucket name directly in the script
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 
+# GCS compose accepts at most this many source objects per call
+MAX_COMPOSE_SOURCES = 32
+
+
+@lru_cache(maxsize=1)
+def get_bucket():
+    """Storage client and bucket, created once per process and shared by upload threads."""
+    return storage.Client().bucket(BUCKET_NAME)
+
+
+def signed_url(blob):
+    """Signed URL for a stored object, valid for 7 days."""
+    return upstream.call(
+        "gcs", blob.generate_signed_url,
+        expiration=timedelta(days=7),
+        version="v4",
+        operation="sign_url",
+    )
+
+
 def upload_to_gcs(file_path):
     """Uploads a file to Google Cloud Storage and returns a signed URL."""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(BUCKET_NAME)
     blob_name = os.path.basename(file_path)  # Use the file name as the object name
-    blob = bucket.blob(blob_name)
+    blob = get_bucket().blob(blob_name)
 
     # Upload the file
-    blob.upload_from_filename(file_path)
+    upstream.call(
+        "gcs", blob.upload_from_filename, file_path,
+        timeout=upstream.timeout("gcs"), operation="upload",
+    )
 
-    # Generate a signed URL valid for 7 days
-    url = blob.generate_signed_url(
-        expiration=timedelta(days=7),
-        version="v4",
+    return signed_url(blob)
+
+
+def upload_part(blob_name, data):
+    """Store one chunk of a resumable upload as its own object."""
+    blob = get_bucket().blob(blob_name)
+    upstream.call(
+        "gcs", blob.upload_from_string, data, content_type="application/octet-stream",
+        timeout=upstream.timeout("gcs"), operation="upload_part",
+    )
+
+
+def compose_parts(part_names, blob_name, content_type=None):
+    """
+    Concatenate uploaded parts into `blob_name`, composing in rounds of at most
+    MAX_COMPOSE_SOURCES objects. Returns the composed blob and any intermediate objects created.
+    """
+    bucket = get_bucket()
+    intermediates = []
+    names = list(part_names)
+    round_number = 0
+    while len(names) > MAX_COMPOSE_SOURCES:
+        grouped = []
+        for start in range(0, len(names), MAX_COMPOSE_SOURCES):
+            target = f"{blob_name}.compose-{round_number}-{start // MAX_COMPOSE_SOURCES}"
+            upstream.call(
+                "gcs", bucket.blob(target).compose,
+                [bucket.blob(name) for name in names[start:start + MAX_COMPOSE_SOURCES]],
+                timeout=upstream.timeout("gcs"), operation="compose",
+            )
+            grouped.append(target)
+        intermediates += grouped
+        names = grouped
+        round_number += 1
+
+    blob = bucket.blob(blob_name)
+    if content_type:
+        blob.content_type = content_type
+    upstream.call(
+        "gcs", blob.compose, [bucket.blob(name) for name in names],
+        timeout=upstream.timeout("gcs"), operation="compose",
     )
+    return blob, intermediates
+
+
+def delete_objects(blob_names):
+    """Best-effort removal of temporary objects."""
+    bucket = get_bucket()
+    for name in blob_names:
+        try:
+            upstream.call("gcs", bucket.blob(name).delete, timeout=upstream.timeout("gcs"), operation="delete")
+        except Exception as e:
+            print(f"Could not delete temporary object {name}: {e}")
 
-    return url
 
 def process_medical_report(file_path):
     """Function to process the medical report using Google Gemini API and store the file in GCS."""
+    response_text = summarize_report(file_path)
+
+    # Upload the file to GCS and get the public URL
+    file_url = upload_to_gcs(file_path)
+
+    return {
+        "summary": response_text,
+        "file_url": file_url,
+    }
+
+
+def summarize_report(file_path):
+    """Extract and summarize the key medical information of a report with Gemini."""
     # Initialize Google Gemini API client
     client = genai.Client(
         api_key=os.environ.get("GEMINI_API_KEY"),
+        http_options=types.HttpOptions(timeout=int(upstream.timeout("gemini") * 1000)),
     )
 
     # Upload file to Google Gemini
-    files = [client.files.upload(file=file_path)]
+    files = [upstream.call("gemini", client.files.upload, file=file_path, operation="upload")]
     model = "gemini-2.0-flash"
     contents = [
         types.Content(
@@ -63,18 +147,16 @@ def process_medical_report(file_path):
         ],
     )
 
-    response_text = ""
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    ):
-        response_text += chunk.text
-
-    # Upload the file to GCS and get the public URL
-    file_url = upload_to_gcs(file_path)
-
-    return {
-        "summary": response_text,
-        "file_url": file_url,
-    }
+    response_text = upstream.call(
+        "gemini",
+        lambda: "".join(
+            chunk.text
+            for chunk in client.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=generate_content_config,
+            )
+        ),
+        operation="generate",
+    )
+    return response_text
@@ -0,0 +1,264 @@
+"""
+Single-flight coalescing with stale-while-revalidate for expensive, shareable results.
+
+Concurrent callers asking for the same key wait for one leader instead of each
+running the computation: threads of a worker wait on an in-process flight, and
+worker processes on the host coordinate through a lease in a small SQLite file
+(SINGLEFLIGHT_DB) that also holds the results. Fresh results are served
+directly; results past their TTL but within the stale window are served at once
+while one background refresh runs at batch quota priority. Results built from an
+upstream's remembered fallback (`upstream.stale`) or left incomplete by a failing
+upstream (`upstream.mark_degraded`) are returned but never stored.
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+import orjson
+from django.conf import settings
+from django.db import connections
+from . import quota, upstream
+from .metrics import increment, record_cache
+
+SINGLEFLIGHT_DB = os.getenv("SINGLEFLIGHT_DB", str(settings.BASE_DIR / "singleflight.sqlite3"))
+
+# Per-namespace (ttl, stale_ttl) in seconds; override with SINGLEFLIGHT_<NAMESPACE>_TTL / _STALE_TTL
+NAMESPACE_DEFAULTS = {
+    "outbreaks": (6 * 60 * 60, 7 * 24 * 60 * 60),   # a published IDSP week rarely changes
+    "content": (24 * 60 * 60, 7 * 24 * 60 * 60),
+    "news": (15 * 60, 6 * 60 * 60),
+    "news_locations": (30 * 24 * 60 * 60, 90 * 24 * 60 * 60),   # city -> Event Registry URI
+}
+DEFAULT_TTLS = (5 * 60, 60 * 60)
+
+# How long followers wait for a leader before computing themselves, and how long a
+# lease survives a leader that died without releasing it
+WAIT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_WAIT_TIMEOUT", "120"))
+LEASE_TTL = float(os.getenv("SINGLEFLIGHT_LEASE_TTL", "180"))
+POLL_INTERVAL = 0.05
+# Background refreshes running at once per process; stale hits beyond this skip the refresh
+MAX_REFRESHES = int(os.getenv("SINGLEFLIGHT_MAX_REFRESHES", "4"))
+
+_local = threading.local()
+_flights = {}
+_flights_lock = threading.Lock()
+_refresh_slots = threading.BoundedSemaphore(MAX_REFRESHES)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def ttls(namespace):
+    ttl, stale_ttl = NAMESPACE_DEFAULTS.get(namespace, DEFAULT_TTLS)
+    prefix = f"SINGLEFLIGHT_{namespace.upper()}"
+    return int(os.getenv(f"{prefix}_TTL", ttl)), int(os.getenv(f"{prefix}_STALE_TTL", stale_ttl))
+
+
+def _connection():
+    """Per-thread connection to the shared lease/result store."""
+    if getattr(_local, "path", None) != SINGLEFLIGHT_DB:
+        conn = sqlite3.connect(SINGLEFLIGHT_DB, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, created REAL NOT NULL, expires REAL NOT NULL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)")
+        _local.conn, _local.path = conn, SINGLEFLIGHT_DB
+    return _local.conn
+
+
+def _load(key):
+    """(value, created) for a stored result that has not fully expired, or None."""
+    row = _connection().execute(
+        "SELECT value, created FROM results WHERE key = ? AND expires > ?", (key, time.time())
+    ).fetchone()
+    return (orjson.loads(row[0]), row[1]) if row else None
+
+
+def _store(key, value, ttl, stale_ttl):
+    now = time.time()
+    conn = _connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO results (key, value, created, expires) VALUES (?, ?, ?, ?)",
+        (key, orjson.dumps(value), now, now + ttl + stale_ttl),
+    )
+    if random.random() < 0.01:
+        conn.execute("DELETE FROM results WHERE expires <= ?", (now,))
+
+
+def _try_lease(key, owner):
+    now = time.time()
+    conn = _connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM leases WHERE key = ? AND expires <= ?", (key, now))
+        taken = conn.execute(
+            "INSERT OR IGNORE INTO leases (key, owner, expires) VALUES (?, ?, ?)", (key, owner, now + LEASE_TTL)
+        ).rowcount == 1
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return taken
+
+
+def _release(key, owner):
+    _connection().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+
+def _lead(namespace, key, compute, cacheable, ttl, stale_ttl, wait=True):
+    """
+    Compute under the host-wide lease for `key`, or adopt the result of the process
+    holding it. With wait=False, returns None at once if another process holds the lease.
+    """
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    leased = False
+    try:
+        while not (leased := _try_lease(key, owner)):
+            if not wait:
+                return None
+            time.sleep(POLL_INTERVAL)
+            entry = _load(key)
+            if entry and time.time() - entry[1] < ttl:
+                increment("card_singleflight_total", namespace=namespace, outcome="coalesced_host")
+                return entry[0]
+            if time.monotonic() >= deadline:
+                print(f"Timed out waiting for another worker to compute {key}, computing it here")
+                break
+        # The previous lease holder may have stored a result just before we took over
+        entry = _load(key)
+        if entry and time.time() - entry[1] < ttl:
+            return entry[0]
+    except sqlite3.Error as e:
+        print(f"Single-flight store unavailable, computing {key} without coordination: {e}")
+
+    try:
+        with upstream.tracking_fallbacks() as fallbacks:
+            value = compute()
+        if fallbacks:
+            # Served from an upstream's last good result: fine to return, not to cache as fresh
+            increment("card_singleflight_total", namespace=namespace, outcome="degraded")
+        else:
+            increment("card_singleflight_total", namespace=namespace, outcome="computed")
+        if cacheable(value) and not fallbacks:
+            try:
+                _store(key, value, ttl, stale_ttl)
+            except sqlite3.Error as e:
+                print(f"Could not store single-flight result for {key}: {e}")
+        return value
+    finally:
+        if leased:
+            try:
+                _release(key, owner)
+            except sqlite3.Error as e:
+                print(f"Could not release single-flight lease for {key}: {e}")
+
+
+def _start_refresh(namespace, key, compute, cacheable, ttl, stale_ttl):
+    """Start a background refresh of `key` unless one is running or all MAX_REFRESHES slots are busy."""
+    with _flights_lock:
+        if key in _flights:
+            return
+        if not _refresh_slots.acquire(blocking=False):
+            increment("card_singleflight_total", namespace=namespace, outcome="refresh_skipped")
+            return
+        flight = _flights[key] = _Flight()
+    try:
+        threading.Thread(
+            target=_refresh, args=(flight, namespace, key, compute, cacheable, ttl, stale_ttl), daemon=True
+        ).start()
+    except RuntimeError as e:
+        print(f"Could not start background refresh of {key}: {e}")
+        with _flights_lock:
+            _flights.pop(key, None)
+        _refresh_slots.release()
+
+
+def _refresh(flight, namespace, key, compute, cacheable, ttl, stale_ttl):
+    """Background revalidation of a stale entry, run once per host at batch priority."""
+    try:
+        with quota.priority("batch"):
+            flight.result = _lead(namespace, key, compute, cacheable, ttl, stale_ttl, wait=False)
+    except Exception as e:
+        flight.error = e
+        print(f"Background refresh of {key} failed: {e}")
+    finally:
+        flight.done.set()
+        with _flights_lock:
+            _flights.pop(key, None)
+        _refresh_slots.release()
+        connections.close_all()
+
+
+def peek(namespace, key):
+    """(stored value, fresh) for `namespace`/`key` without computing or refreshing it, or None."""
+    try:
+        entry = _load(f"{namespace}:{key}")
+    except sqlite3.Error as e:
+        print(f"Single-flight store unavailable for {namespace}:{key}: {e}")
+        return None
+    if entry is None:
+        return None
+    value, created = entry
+    return value, time.time() - created < ttls(namespace)[0]
+
+
+def run(namespace, key, compute, cacheable=lambda value: True):
+    """
+    Return the result of `compute()` for `namespace`/`key`, computing it at most once
+    at a time per host. Only results for which `cacheable(value)` is true are stored
+    and shared with later callers; concurrent callers in the same process share
+    whatever the leader got, errors included.
+    """
+    full_key = f"{namespace}:{key}"
+    ttl, stale_ttl = ttls(namespace)
+
+    try:
+        entry = _load(full_key)
+    except sqlite3.Error as e:
+        print(f"Single-flight store unavailable for {full_key}: {e}")
+        entry = None
+    if entry:
+        value, created = entry
+        record_cache(f"singleflight_{namespace}", True)
+        if time.time() - created < ttl:
+            increment("card_singleflight_total", namespace=namespace, outcome="fresh")
+        else:
+            increment("card_singleflight_total", namespace=namespace, outcome="stale")
+            _start_refresh(namespace, full_key, compute, cacheable, ttl, stale_ttl)
+        return value
+    record_cache(f"singleflight_{namespace}", False)
+
+    with _flights_lock:
+        flight = _flights.get(full_key)
+        leader = flight is None
+        if leader:
+            flight = _flights[full_key] = _Flight()
+
+    if not leader:
+        if flight.done.wait(WAIT_TIMEOUT):
+            increment("card_singleflight_total", namespace=namespace, outcome="coalesced_process")
+            if flight.error is not None:
+                raise flight.error
+            if flight.result is not None:
+                return flight.result
+        return _lead(namespace, full_key, compute, cacheable, ttl, stale_ttl)
+
+    try:
+        flight.result = _lead(namespace, full_key, compute, cacheable, ttl, stale_ttl)
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        flight.done.set()
+        with _flights_lock:
+            _flights.pop(full_key, None)
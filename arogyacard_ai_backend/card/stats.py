@@ -0,0 +1,60 @@
+import os
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import DiagnosedDisease, DiseaseDailyCount
+from .db import retry_on_lock
+from .diseases import disease_key, disease_name
+
+# Longest window a stats request may cover
+MAX_WINDOW_DAYS = int(os.getenv("STATS_MAX_WINDOW_DAYS", "366"))
+
+
+@retry_on_lock
+def record_diagnosis(chat_history, disease):
+    """
+    Store a diagnosis at most once per (chat history, disease, day) and keep
+    the daily rollup in step. Diseases are stored by canonical id (see
+    `disease_key`). Returns True if a new diagnosis was recorded.
+    """
+    disease = disease_key(disease)
+    if not disease:
+        return False
+    today = timezone.localdate()
+    with transaction.atomic():
+        _, created = DiagnosedDisease.objects.get_or_create(
+            hid=chat_history, disease=disease, diagnosed_on=today
+        )
+        if created:
+            rollup, _ = DiseaseDailyCount.objects.get_or_create(disease=disease, day=today)
+            DiseaseDailyCount.objects.filter(pk=rollup.pk).update(count=F("count") + 1)
+    return created
+
+
+def get_disease_counts(start, end, disease=None, by_day=False):
+    """
+    Diagnosis counts between `start` and `end` (inclusive dates) from the daily rollup,
+    optionally restricted to one disease id and/or broken down per day.
+    """
+    rows = DiseaseDailyCount.objects.filter(day__gte=start, day__lte=end)
+    if disease:
+        rows = rows.filter(disease=disease)
+
+    if by_day:
+        return [
+            {"disease": row.disease, "name": disease_name(row.disease), "day": row.day.isoformat(), "count": row.count}
+            for row in rows.order_by("day", "disease")
+        ]
+
+    totals = rows.values("disease").annotate(count=Sum("count")).order_by("-count", "disease")
+    return [
+        {"disease": row["disease"], "name": disease_name(row["disease"]), "count": row["count"]}
+        for row in totals
+    ]
+
+
+def default_window(days=7):
+    """Return the (start, end) dates covering the last `days` days including today."""
+    end = timezone.localdate()
+    return end - timedelta(days=days - 1), end
@@ -0,0 +1,27 @@
+from unittest import mock
+from django.test import SimpleTestCase, TestCase
+from card import admin
+from card.admin import EstimatedCountPaginator
+from card.models import PREVIEW_LENGTH, ChatHistory, conversation_preview
+
+
+class PreviewTests(SimpleTestCase):
+    def test_preview_matches_the_whole_conversation_text(self):
+        short = {"fever": "How many days?"}
+        long = {f"question {index}": "answer " * 10 for index in range(50)}
+        self.assertEqual(conversation_preview({}), "{}")
+        self.assertEqual(conversation_preview(short), str(short))
+        self.assertEqual(conversation_preview(long), str(long)[:PREVIEW_LENGTH] + "...")
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def test_page_past_the_real_end_is_clamped(self):
+        rows = [ChatHistory.objects.create(hid=f"h{index}") for index in range(10)]
+        ChatHistory.objects.filter(pk__in=[row.pk for row in rows[2:8]]).delete()
+
+        with mock.patch.object(admin, "EXACT_COUNT_LIMIT", 1):
+            paginator = EstimatedCountPaginator(ChatHistory.objects.order_by("pk"), 2)
+            self.assertEqual(paginator.num_pages, 5)
+            page = paginator.page(5)
+        self.assertEqual((page.number, paginator.count, paginator.num_pages), (2, 4, 2))
+        self.assertEqual([row.hid for row in page.object_list], ["h8", "h9"])
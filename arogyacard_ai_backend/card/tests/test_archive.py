@@ -0,0 +1,51 @@
+from datetime import timedelta
+from django.test import TestCase
+from django.utils import timezone
+from card.archive import _archive_one, archive_idle, compress, load_conversation, rehydrate
+from card.export import iter_records
+from card.models import ArchivedConversation, ChatHistory
+
+CONVERSATION = {"I have fever": "How many days have you had a fever?", "3 days": "Any other symptoms?"}
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.chat_history = ChatHistory.objects.create(hid="h1", conversation=CONVERSATION)
+        ChatHistory.objects.filter(pk=self.chat_history.pk).update(updated_at=timezone.now() - timedelta(days=200))
+
+    def test_archive_and_rehydrate(self):
+        self.assertEqual(archive_idle(older_than_days=90)["archived"], 1)
+        stub = ChatHistory.objects.get(pk=self.chat_history.pk)
+        self.assertEqual(stub.conversation, {})
+        self.assertEqual(load_conversation(stub), CONVERSATION)
+        rehydrate(stub)
+        self.assertEqual(ChatHistory.objects.get(pk=self.chat_history.pk).conversation, CONVERSATION)
+        self.assertFalse(ArchivedConversation.objects.exists())
+
+    def test_export_reads_archived_conversations(self):
+        ChatHistory.objects.create(hid="h2", conversation={"hello": "hi"})
+        archive_idle(older_than_days=90)
+        records = {record["hid"]: record for record in iter_records("conversations", chunk_size=1)}
+        self.assertEqual(records["h1"]["conversation"], CONVERSATION)
+        self.assertEqual(records["h2"]["conversation"], {"hello": "hi"})
+        self.assertEqual(list(iter_records("conversations", fields=["hid"])), [{"hid": "h1"}, {"hid": "h2"}])
+
+    def test_row_saved_after_selection_stays_hot(self):
+        selected_at = ChatHistory.objects.get(pk=self.chat_history.pk).updated_at
+        chat_history = ChatHistory.objects.get(pk=self.chat_history.pk)
+        chat_history.conversation["new question"] = "new answer"
+        chat_history.save()
+
+        self.assertIsNone(_archive_one(chat_history.pk, selected_at))
+        self.assertFalse(ArchivedConversation.objects.exists())
+        self.assertIn("new question", ChatHistory.objects.get(pk=chat_history.pk).conversation)
+
+    def test_leftover_archive_copy_is_replaced(self):
+        codec, data, size = compress({"old": "copy"})
+        ArchivedConversation.objects.create(
+            chat_history=self.chat_history, codec=codec, data=data, original_bytes=size,
+            compressed_bytes=len(data), turn_count=1,
+        )
+        self.assertEqual(archive_idle(older_than_days=90)["archived"], 1)
+        stub = ChatHistory.objects.get(pk=self.chat_history.pk)
+        self.assertEqual(load_conversation(stub), CONVERSATION)
@@ -0,0 +1,41 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from django.conf import settings
+from django.test import SimpleTestCase
+from benchmarks.run import compare
+
+
+def endpoint(statuses, p50=10.0):
+    return {"requests": sum(statuses.values()), "errors": 0, "statuses": statuses, "throughput_rps": 100.0,
+            "p50_ms": p50, "p95_ms": p50, "p99_ms": p50}
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_compare_flags_every_kind_of_error(self):
+        baseline = {"endpoints": {"chat_api": endpoint({"200": 9, "503": 1})}}
+        self.assertEqual(compare({"endpoints": {"chat_api": endpoint({"200": 9, "503": 1})}, "peak_rss_mb": 100},
+                                 baseline, 0.1), [])
+        # Same number of failures, but clients are now throttled
+        regressions = compare({"endpoints": {"chat_api": endpoint({"200": 9, "429": 1})}, "peak_rss_mb": 100},
+                              baseline, 0.1)
+        self.assertEqual(regressions, ["chat_api: status 429 0 -> 1"])
+        self.assertEqual(compare({"endpoints": {"chat_api": endpoint({"200": 10}, p50=20.0)}, "peak_rss_mb": 100},
+                                 baseline, 0.1), ["chat_api: p50_ms 10.0 -> 20.0", "chat_api: p95_ms 10.0 -> 20.0",
+                                                  "chat_api: p99_ms 10.0 -> 20.0"])
+
+    def test_smoke_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "bench.json")
+            result = subprocess.run(
+                [sys.executable, "-m", "benchmarks.run", "--requests", "2", "--latency-ms", "0", "--jitter-ms", "0",
+                 "--output", output],
+                cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=300,
+            )
+            self.assertEqual(result.returncode, 0, result.stderr)
+            with open(output) as report:
+                endpoints = json.load(report)["endpoints"]
+        self.assertIn("chat_api", endpoints)
+        self.assertEqual({name: data["errors"] for name, data in endpoints.items() if data["errors"]}, {})
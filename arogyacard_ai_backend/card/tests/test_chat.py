@@ -0,0 +1,18 @@
+from django.test import TestCase
+from card.models import ChatHistory
+from card.utils import save_chat_turn
+
+
+class SaveChatTurnTests(TestCase):
+    def test_turns_saved_from_stale_copies_are_kept(self):
+        ChatHistory.objects.create(hid="h1", conversation={"hello": "Hi, how can I help?"})
+        first = ChatHistory.objects.get(hid="h1")
+        second = ChatHistory.objects.get(hid="h1")
+
+        save_chat_turn(first, "I have a fever", "Since when?")
+        save_chat_turn(second, "and a cough", "Is it dry?")
+
+        stored = ChatHistory.objects.get(hid="h1")
+        self.assertEqual(list(stored.conversation), ["hello", "I have a fever", "and a cough"])
+        self.assertEqual(stored.turn_count, 3)
+        self.assertEqual(second.conversation, stored.conversation)
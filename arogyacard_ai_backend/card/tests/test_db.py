@@ -0,0 +1,52 @@
+from unittest import mock
+from django.db import OperationalError
+from django.test import SimpleTestCase
+from card import db
+from card.db import is_lock_contention, retry_on_lock
+
+
+class SerializationFailure(Exception):
+    sqlstate = "40001"
+
+
+def failing(*errors):
+    """A write that raises `errors` in turn, then succeeds."""
+    return mock.Mock(side_effect=[*errors, "written"], __name__="write")
+
+
+class RetryOnLockTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(db.time, "sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lock_contention_is_retried(self):
+        write = failing(OperationalError("database is locked"), OperationalError("database is locked"))
+        self.assertEqual(retry_on_lock(write)(), "written")
+        self.assertEqual(write.call_count, 3)
+        self.assertEqual(self.sleep.call_count, 2)
+
+    def test_gives_up_after_the_configured_retries(self):
+        write = failing(*[OperationalError("database is locked")] * 2)
+        with mock.patch.object(db, "DB_WRITE_RETRIES", 1), self.assertRaises(OperationalError):
+            retry_on_lock(write)()
+        self.assertEqual(write.call_count, 2)
+
+    def test_other_errors_are_not_retried(self):
+        write = failing(OperationalError("no such table: card_chathistory"))
+        with self.assertRaises(OperationalError):
+            retry_on_lock(write)()
+        self.assertEqual(write.call_count, 1)
+
+    def test_not_retried_inside_an_outer_transaction(self):
+        write = failing(OperationalError("database is locked"))
+        with mock.patch.object(db.connection, "in_atomic_block", True), self.assertRaises(OperationalError):
+            retry_on_lock(write)()
+        self.assertEqual(write.call_count, 1)
+        self.sleep.assert_not_called()
+
+    def test_postgres_serialization_failures_are_contention(self):
+        error = OperationalError("could not serialize access")
+        error.__cause__ = SerializationFailure()
+        self.assertTrue(is_lock_contention(error))
+        self.assertFalse(is_lock_contention(OperationalError("connection refused")))
@@ -0,0 +1,37 @@
+from django.test import SimpleTestCase
+from card.diseases import canonicalize_disease, disease_key, disease_name
+
+
+class CanonicalizeDiseaseTests(SimpleTestCase):
+    def test_synonyms_and_qualifiers(self):
+        self.assertEqual(canonicalize_disease("Suspected dengue fever"), "Dengue")
+        self.assertEqual(disease_key("loose motions"), "acute_diarrheal_disease")
+        self.assertEqual(disease_key("Migraine without aura"), "migraine")
+
+    def test_hepatitis_types_are_distinct(self):
+        self.assertEqual(disease_key("Hepatitis A"), "hepatitis_a")
+        self.assertEqual(disease_key("hepatitis b"), "hepatitis_b")
+        self.assertEqual(disease_key("HCV"), "hepatitis_c")
+        self.assertEqual(disease_key("Hep E"), "hepatitis_e")
+        self.assertEqual(disease_key("Jaundice"), "jaundice")
+        self.assertEqual(disease_key("hepatitis"), "viral_hepatitis")
+
+    def test_negated_names_are_not_diagnoses(self):
+        for text in ["Not dengue", "No malaria", "probably not typhoid", "Dengue ruled out",
+                     "negative for malaria", "typhoid unlikely"]:
+            with self.subTest(text=text):
+                self.assertIsNone(disease_key(text))
+                self.assertEqual(canonicalize_disease(text), "Unknown")
+
+    def test_non_text_input(self):
+        for value in [None, 42, ["Dengue"], {"name": "Dengue"}, "", "  ", "unknown"]:
+            with self.subTest(value=value):
+                self.assertIsNone(disease_key(value))
+                self.assertEqual(canonicalize_disease(value), "Unknown")
+
+    def test_names_outside_the_vocabulary(self):
+        self.assertEqual(disease_key("Kala-azar (visceral)"), "kala_azar")
+        self.assertEqual(canonicalize_disease("Kala-azar"), "Kala-azar")
+        self.assertEqual(disease_name("kala_azar"), "Kala azar")
+        self.assertEqual(disease_name("dengue"), "Dengue")
+
@@ -0,0 +1,66 @@
+from unittest import mock
+from django.test import SimpleTestCase, TestCase
+from card import firstturn
+from card.models import FirstTurnResponse
+
+
+def similarity(a, b):
+    return firstturn.jaccard(
+        firstturn.shingles(firstturn.normalize_query(a)), firstturn.shingles(firstturn.normalize_query(b))
+    )
+
+
+class SimilarityTests(SimpleTestCase):
+    def test_different_body_parts_do_not_match(self):
+        self.assertLess(similarity("back pain", "neck pain"), firstturn.SIMILARITY_THRESHOLD)
+
+    def test_different_sides_do_not_match(self):
+        self.assertLess(similarity("pain in lower left abdomen", "pain in lower right abdomen"),
+                        firstturn.SIMILARITY_THRESHOLD)
+
+    def test_negated_symptoms_do_not_match(self):
+        self.assertEqual(similarity("I have fever", "I have no fever"), 0.0)
+
+    def test_rephrasings_match(self):
+        self.assertGreaterEqual(similarity("i have fever", "I've had a fever since 2 days"), firstturn.SIMILARITY_THRESHOLD)
+        self.assertGreaterEqual(similarity("headaches since yesterday", "I have a headache"), firstturn.SIMILARITY_THRESHOLD)
+
+
+class ReuseTests(TestCase):
+    def setUp(self):
+        for patcher in [
+            mock.patch.object(firstturn, "_index", firstturn.FirstTurnIndex()),
+            mock.patch.object(firstturn, "REFRESH_SECONDS", 0),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        firstturn.remember_response("i have fever", ["fever"], "How many days have you had a fever?")
+
+    def test_similar_openings_reuse_the_follow_up(self):
+        self.assertEqual(
+            firstturn.find_response("I've had a fever since 2 days", ["fever"]), "How many days have you had a fever?"
+        )
+        self.assertEqual(FirstTurnResponse.objects.get().hits, 1)
+        self.assertIsNone(firstturn.find_response("I have no fever", ["fever"]))
+        self.assertIsNone(firstturn.find_response("I've had a fever since 2 days", ["respiratory"]))
+
+    def test_openings_on_different_sides_do_not_share_a_follow_up(self):
+        firstturn.remember_response("severe pain in lower left abdomen with fever and vomiting", ["abdominal"],
+                                    "Does the pain move to your back?")
+        with mock.patch.object(firstturn, "SIMILARITY_THRESHOLD", 0.5):
+            self.assertIsNone(firstturn.find_response("severe pain in lower right abdomen with fever and vomiting",
+                                                      ["abdominal"]))
+            self.assertIsNotNone(firstturn.find_response("severe pain in my lower left abdomen with fever",
+                                                         ["abdominal"]))
+
+    def test_disabled_entries_are_dropped_on_refresh(self):
+        FirstTurnResponse.objects.update(enabled=False)
+        self.assertIsNone(firstturn.find_response("i have fever", ["fever"]))
+        FirstTurnResponse.objects.update(enabled=True)
+        self.assertIsNotNone(firstturn.find_response("i have fever", ["fever"]))
+
+    def test_deleted_entries_are_dropped_on_refresh(self):
+        FirstTurnResponse.objects.all().delete()
+        self.assertIsNone(firstturn.find_response("i have fever", ["fever"]))
+        self.assertEqual(firstturn._index.entries, {})
+        self.assertFalse(any(firstturn._index.bands.values()))
@@ -0,0 +1,71 @@
+import os
+import tempfile
+from unittest import mock
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from card import clusters, singleflight, upstream
+from .test_upstream import LOCAL_CACHES
+
+SMALL = {"outbreaks": [{"center": [17.1, 83.4], "radius": 75, "name": "Cholera Outbreak", "cases": 15}]}
+LARGE = {"outbreaks": SMALL["outbreaks"] * 40}
+
+
+class OutbreakCachingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(singleflight, "SINGLEFLIGHT_DB", os.path.join(directory.name, "singleflight.sqlite3"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        stale_cache = override_settings(CACHES=LOCAL_CACHES)
+        stale_cache.enable()
+        self.addCleanup(stale_cache.disable)
+        self.builds = 0
+
+    def serve(self, result, degraded=False):
+        def fetch(year, week_number):
+            self.builds += 1
+            if degraded:
+                upstream.mark_degraded("geocoding")
+            return result
+        patcher = mock.patch.object(clusters, "_fetch_outbreak_data", fetch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, etag=None, **headers):
+        if etag:
+            headers["HTTP_IF_NONE_MATCH"] = etag
+        return self.client.get("/api/get-outbreaks/", {"year": 2020, "week": 5}, **headers)
+
+    def test_revalidation_is_answered_from_the_stored_result(self):
+        self.serve(SMALL)
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("immutable", first["Cache-Control"])
+
+        with mock.patch.object(clusters.singleflight, "run") as run:
+            second = self.get(first["ETag"])
+        run.assert_not_called()
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(self.builds, 1)
+
+    def test_partial_result_is_neither_stored_nor_immutable(self):
+        self.serve(SMALL, degraded=True)
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("immutable", response["Cache-Control"])
+        self.assertEqual(self.get(response["ETag"]).status_code, 304)
+        self.assertEqual(self.builds, 2)
+
+    def test_not_modified_etag_matches_the_full_response(self):
+        for result, weak in [(SMALL, False), (LARGE, True)]:
+            caches[upstream.STALE_CACHE].clear()
+            singleflight._connection().execute("DELETE FROM results")
+            self.serve(result)
+            full = self.get(HTTP_ACCEPT_ENCODING="gzip")
+            self.assertEqual(full["ETag"].startswith("W/"), weak)
+            self.assertEqual(full.has_header("Content-Encoding"), weak)
+            revalidated = self.get(full["ETag"], HTTP_ACCEPT_ENCODING="gzip")
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertEqual(revalidated["ETag"], full["ETag"])
@@ -0,0 +1,89 @@
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+from card import idempotency
+from card.idempotency import _heartbeat, fingerprint, idempotent
+from card.models import IdempotencyKey
+
+
+class EchoView(APIView):
+    action = None
+
+    @idempotent
+    def post(self, request):
+        return self.action(request)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.calls = 0
+
+    def echo(self, request):
+        self.calls += 1
+        return Response({"echo": request.data, "call": self.calls})
+
+    def request(self, body, key="key-1"):
+        request = self.factory.post("/api/echo/", body, format="json", HTTP_IDEMPOTENCY_KEY=key)
+        request.resolver_match = mock.Mock(url_name="echo_api")
+        return request
+
+    def call(self, body, key="key-1", action=None):
+        return EchoView.as_view(action=action or self.echo)(self.request(body, key))
+
+    def test_retry_is_replayed(self):
+        first = self.call({"q": "fever"})
+        second = self.call({"q": "fever"})
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(self.call({"q": "cough"}).status_code, 422)
+
+    def test_server_errors_are_not_stored(self):
+        self.assertEqual(self.call({"q": "fever"}, action=lambda request: Response(status=503)).status_code, 503)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.call({"q": "fever"}).data["call"], 1)
+
+    def test_abandoned_key_is_taken_over(self):
+        request = EchoView().initialize_request(self.request({"q": "fever"}))
+        IdempotencyKey.objects.create(
+            endpoint="echo_api", key="key-1", fingerprint=fingerprint(request),
+            locked_until=timezone.now() - timedelta(seconds=1), expires_at=timezone.now() + timedelta(hours=1),
+        )
+        response = self.call({"q": "fever"})
+        self.assertEqual(response.data["call"], 1)
+        self.assertEqual(IdempotencyKey.objects.get().status, "complete")
+
+    def test_worker_whose_key_was_taken_over_does_not_store(self):
+        def slow(request):
+            # Meanwhile another worker decides this one is dead and takes the key over
+            IdempotencyKey.objects.update(locked_until=timezone.now() + timedelta(hours=1))
+            return self.echo(request)
+
+        self.assertEqual(self.call({"q": "fever"}, action=slow).status_code, 200)
+        record = IdempotencyKey.objects.get()
+        self.assertEqual((record.status, record.response), ("processing", None))
+
+    def test_heartbeat_extends_the_lease_until_lost(self):
+        record = IdempotencyKey.objects.create(
+            endpoint="echo_api", key="key-1", fingerprint="f", locked_until=timezone.now() + timedelta(seconds=5),
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        leased = record.locked_until
+        stop = mock.Mock(**{"wait.side_effect": [False, True]})
+        with mock.patch.object(idempotency.connections, "close_all"):
+            _heartbeat(record, stop)
+        self.assertGreater(record.locked_until, leased)
+        self.assertEqual(IdempotencyKey.objects.get().locked_until, record.locked_until)
+
+        IdempotencyKey.objects.update(locked_until=leased)
+        renewed = record.locked_until
+        stop = mock.Mock(**{"wait.side_effect": [False, False, True]})
+        with mock.patch.object(idempotency.connections, "close_all"):
+            _heartbeat(record, stop)
+        self.assertEqual(stop.wait.call_count, 1)
+        self.assertEqual(record.locked_until, renewed)
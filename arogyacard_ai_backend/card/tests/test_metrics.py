@@ -0,0 +1,87 @@
+import os
+import tempfile
+from unittest import mock
+import orjson
+from django.test import SimpleTestCase, TestCase
+from card import metrics, news, views
+
+
+def write_snapshot(directory, pid, requests, gauge):
+    with open(os.path.join(directory, f"metrics-{pid}.json"), "wb") as snapshot:
+        snapshot.write(orjson.dumps({
+            "histograms": [],
+            "counters": [["card_test_requests_total", [["endpoint", "chat"]], requests]],
+            "gauges": [["card_test_gauge", [], gauge]],
+        }))
+
+
+class MultiprocessMetricsTests(SimpleTestCase):
+    def test_scrape_sums_other_workers(self):
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(metrics, "METRICS_DIR", directory), \
+                mock.patch.object(metrics, "_alive", lambda pid: True):
+            write_snapshot(directory, 999999, 5, 2)
+            with mock.patch.object(metrics, "_start_flusher"):
+                metrics.increment("card_test_requests_total", 2, endpoint="chat")
+                metrics.set_gauge("card_test_gauge", 1)
+            own = metrics._counters[metrics._key("card_test_requests_total", {"endpoint": "chat"})]
+
+            output = metrics.render_prometheus()
+            self.assertIn(f'card_test_requests_total{{endpoint="chat"}} {own + 5}', output)
+            self.assertIn('card_test_gauge{pid="999999"} 2', output)
+            self.assertIn(f'card_test_gauge{{pid="{os.getpid()}"}} 1', output)
+
+            metrics.flush_metrics()
+            self.assertTrue(os.path.exists(os.path.join(directory, f"metrics-{os.getpid()}.json")))
+
+    def test_exited_workers_keep_their_counters_but_not_their_gauges(self):
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(metrics, "METRICS_DIR", directory), \
+                mock.patch.object(metrics, "_alive", lambda pid: pid != 999998):
+            write_snapshot(directory, 999998, 5, 2)
+            write_snapshot(directory, 999999, 1, 3)
+            own = metrics._counters.get(metrics._key("card_test_requests_total", {"endpoint": "chat"}), 0)
+
+            for _ in range(2):
+                output = metrics.render_prometheus()
+                self.assertIn(f'card_test_requests_total{{endpoint="chat"}} {own + 6}', output)
+                self.assertNotIn('pid="999998"', output)
+                self.assertIn('card_test_gauge{pid="999999"} 3', output)
+            self.assertFalse(os.path.exists(os.path.join(directory, "metrics-999998.json")))
+
+            metrics.clear_metrics_dir()
+            self.assertEqual(os.listdir(directory), ["metrics.lock"])
+
+    def test_new_process_does_not_overwrite_a_reused_pid(self):
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(metrics, "METRICS_DIR", directory), \
+                mock.patch.object(metrics, "_flusher_pid", None), mock.patch.object(metrics.threading, "Thread"), \
+                mock.patch.object(metrics.atexit, "register"):
+            write_snapshot(directory, os.getpid(), 5, 2)
+            metrics._start_flusher()
+            self.assertFalse(os.path.exists(os.path.join(directory, f"metrics-{os.getpid()}.json")))
+            with open(os.path.join(directory, metrics.RETIRED_SNAPSHOT), "rb") as retired:
+                self.assertEqual(orjson.loads(retired.read())["counters"],
+                                 [["card_test_requests_total", [["endpoint", "chat"]], 5]])
+
+    def test_pool_threads_add_to_the_request_timings(self):
+        def run(namespace, key, compute, **kwargs):
+            metrics.add_request_timing("event_registry", 0.01)
+            return f"uri:{key}"
+
+        token = metrics.start_request()
+        with mock.patch.object(news.singleflight, "run", run):
+            uris = news.resolve_locations(["Pune", "Delhi", "Pune"])
+        timings = metrics.finish_request(token)
+        self.assertEqual(uris, {"Pune": "uri:Pune", "Delhi": "uri:Delhi"})
+        self.assertEqual(timings["event_registry"][1], 2)
+
+
+class MetricsAccessTests(TestCase):
+    def test_local_scrapers_without_a_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 200)
+        self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="10.1.2.3").status_code, 403)
+
+    def test_token(self):
+        with mock.patch.object(views, "METRICS_TOKEN", "secret"):
+            self.assertEqual(self.client.get("/metrics").status_code, 403)
+            self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+            response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret", REMOTE_ADDR="10.1.2.3")
+            self.assertEqual(response.status_code, 200)
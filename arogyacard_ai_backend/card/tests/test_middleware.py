@@ -0,0 +1,106 @@
+import gzip
+import io
+import os
+import tempfile
+from unittest import mock
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from card import profiling
+from card.middleware import CompressionMiddleware, ProfilingMiddleware
+
+BODY = b'{"items": [' + b",".join(b'"item %d"' % i for i in range(500)) + b"]}"
+
+
+def respond(content_type, body=BODY, **headers):
+    def get_response(request):
+        response = HttpResponse(body, content_type=content_type)
+        for name, value in headers.items():
+            response[name] = value
+        return response
+    return CompressionMiddleware(get_response)
+
+
+class CompressionMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        self.request = RequestFactory().get("/api/get-news/", HTTP_ACCEPT_ENCODING="gzip")
+
+    def test_json_is_compressed(self):
+        response = respond("application/json", ETag='"abc"')(self.request)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), BODY)
+        self.assertEqual(response["ETag"], 'W/"abc"')
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_html_is_never_compressed(self):
+        html = b"<input name='csrfmiddlewaretoken' value='secret'>" * 100
+        response = respond("text/html; charset=utf-8", html)(self.request)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, html)
+
+    def test_small_bodies_are_sent_as_is(self):
+        response = respond("application/json", b'{"ok": true}')(self.request)
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+
+class ProfilingMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.settings = {"PROFILE_TOKEN": "secret", "PROFILE_SAMPLE_RATE": 0, "PROFILE_DIR": self.directory}
+
+    def run_request(self, get_response=None, **headers):
+        with mock.patch.multiple(profiling, **self.settings):
+            middleware = ProfilingMiddleware(get_response or (lambda request: HttpResponse(b"{}")))
+            request = RequestFactory().get("/api/get-news/", **headers)
+            request.resolver_match = mock.Mock(route="api/get-news/")
+            return middleware(request)
+
+    def test_not_loaded_when_off(self):
+        self.settings.update(PROFILE_TOKEN="")
+        with self.assertRaises(MiddlewareNotUsed):
+            self.run_request()
+
+    def test_only_the_token_or_the_sample_rate_profiles(self):
+        self.assertFalse(self.run_request().has_header("X-Profile-Id"))
+        self.assertFalse(self.run_request(HTTP_X_PROFILE="wrong").has_header("X-Profile-Id"))
+        profile_id = self.run_request(HTTP_X_PROFILE="secret")["X-Profile-Id"]
+        self.assertEqual(os.listdir(self.directory), [profile_id])
+        self.assertEqual(profiling.parse_profile_name(profile_id), "GET_api_get_news")
+
+        self.settings.update(PROFILE_TOKEN="", PROFILE_SAMPLE_RATE=1)
+        self.assertTrue(self.run_request().has_header("X-Profile-Id"))
+
+    def test_one_request_is_profiled_at_a_time(self):
+        def get_response(request):
+            # A second request arriving while this one is being profiled
+            self.inner = self.run_request(HTTP_X_PROFILE="secret")
+            return HttpResponse(b"{}")
+
+        outer = self.run_request(get_response, HTTP_X_PROFILE="secret")
+        self.assertTrue(outer.has_header("X-Profile-Id"))
+        self.assertFalse(self.inner.has_header("X-Profile-Id"))
+        self.assertTrue(self.run_request(HTTP_X_PROFILE="secret").has_header("X-Profile-Id"))
+
+    def test_report_ranks_functions_per_endpoint(self):
+        for _ in range(2):
+            self.run_request(HTTP_X_PROFILE="secret")
+        output = io.StringIO()
+        call_command("profile_report", "--dir", self.directory, "--limit", "3", stdout=output)
+        self.assertIn("GET_api_get_news: 2 request(s)", output.getvalue())
+        self.assertEqual(len(output.getvalue().strip().splitlines()), 2 + 3)
+
+        with self.assertRaises(CommandError):
+            call_command("profile_report", "--dir", self.directory, "--endpoint", "get_outbreaks")
+        with self.assertRaises(CommandError):
+            call_command("profile_report", "--dir", os.path.join(self.directory, "missing"))
+
+
+class JSONBodyTests(TestCase):
+    def test_non_object_bodies_are_rejected(self):
+        for body in ["[1, 2]", '"hello"', "42", "null", "{not json"]:
+            with self.subTest(body=body):
+                response = self.client.post("/api/chat/", body, content_type="application/json")
+                self.assertEqual(response.status_code, 400)
@@ -0,0 +1,18 @@
+from django.test import SimpleTestCase
+from card.news import MAX_DIGEST_ITEMS, build_digest, digest_size
+
+
+class DigestTests(SimpleTestCase):
+    def test_unresolved_city_is_not_matched_by_untagged_articles(self):
+        articles = [
+            {"uri": "1", "title": "Dengue cases rise", "location": None, "concepts": [{"type": "loc", "uri": None}]},
+            {"uri": "2", "title": "Dengue cases rise in Pune", "location": {"uri": "pune"}},
+        ]
+        digest = build_digest(["Nowhere", "Pune"], {"Nowhere": None, "Pune": "pune"}, articles)
+        self.assertEqual(digest[0], {"city": "Nowhere", "resolved": False, "news": []})
+        self.assertEqual([entry["uri"] for entry in digest[1]["news"]], ["2"])
+
+    def test_pool_grows_with_cities_and_list_length(self):
+        self.assertEqual(digest_size(1, 20), 500)
+        self.assertEqual(digest_size(10, 50), 1000)
+        self.assertEqual(digest_size(25, 100), MAX_DIGEST_ITEMS)
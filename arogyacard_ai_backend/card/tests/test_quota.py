@@ -0,0 +1,29 @@
+import os
+import tempfile
+from unittest import mock
+from django.test import SimpleTestCase
+from card import quota
+
+
+class QuotaTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(quota, "QUOTA_DB", os.path.join(directory.name, "quota.sqlite3"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_each_google_api_has_its_own_bucket(self):
+        self.assertEqual(len({quota.SERVICE_BUCKETS[s] for s in ("places", "geocoding", "youtube", "cse")}), 4)
+        with mock.patch.dict(os.environ, {"QUOTA_GOOGLE_PLACES_BURST": "1", "QUOTA_GOOGLE_PLACES_PER_MINUTE": "1"}):
+            quota.acquire("places")
+            with self.assertRaises(quota.QuotaExceeded):
+                quota.acquire("places")
+            quota.acquire("geocoding")
+
+    def test_429_before_the_first_call_empties_the_bucket(self):
+        quota.penalize("cse", retry_after=60)
+        with self.assertRaises(quota.QuotaExceeded) as raised:
+            quota.acquire("cse")
+        self.assertGreater(raised.exception.retry_after, 59)
+        quota.acquire("youtube")
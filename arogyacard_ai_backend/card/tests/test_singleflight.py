@@ -0,0 +1,80 @@
+import os
+import tempfile
+import threading
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from card import singleflight, upstream
+from .test_upstream import LOCAL_CACHES
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for patcher in [
+            mock.patch.object(singleflight, "SINGLEFLIGHT_DB", os.path.join(directory.name, "singleflight.sqlite3")),
+            mock.patch.dict(os.environ, {"SINGLEFLIGHT_TEST_TTL": "60", "SINGLEFLIGHT_TEST_STALE_TTL": "3600"}),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        stale_cache = override_settings(CACHES=LOCAL_CACHES)
+        stale_cache.enable()
+        self.addCleanup(stale_cache.disable)
+        self.calls = 0
+
+    def compute(self, value):
+        def compute():
+            self.calls += 1
+            return value
+        return compute
+
+    def test_fresh_results_are_computed_once(self):
+        self.assertEqual(singleflight.run("test", "a", self.compute({"n": 1})), {"n": 1})
+        self.assertEqual(singleflight.run("test", "a", self.compute({"n": 2})), {"n": 1})
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_fallback_results_are_not_cached(self):
+        upstream.remember("event_registry", "pune", ["old article"])
+
+        def fallback():
+            self.calls += 1
+            return upstream.stale("event_registry", "pune")
+
+        self.assertEqual(singleflight.run("test", "b", fallback), ["old article"])
+        self.assertEqual(singleflight.run("test", "b", self.compute(["new article"])), ["new article"])
+        self.assertEqual(singleflight.run("test", "b", self.compute(["newer article"])), ["new article"])
+        self.assertEqual(self.calls, 2)
+
+    def test_fallbacks_that_do_not_go_stale_are_cached(self):
+        upstream.remember("geocoding", "Pune, India", [{"lat": 18.5}])
+
+        def geocode():
+            self.calls += 1
+            return upstream.stale("geocoding", "Pune, India", degraded=False)
+
+        singleflight.run("test", "c", geocode)
+        singleflight.run("test", "c", geocode)
+        self.assertEqual(self.calls, 1)
+
+    def test_background_refreshes_are_bounded(self):
+        release = threading.Event()
+        started = []
+
+        def slow_refresh():
+            started.append(threading.current_thread().name)
+            release.wait(5)
+            return "fresh"
+
+        for key in ("d", "e", "f"):
+            singleflight._store(f"test:{key}", "stale", 0, 3600)
+        with mock.patch.object(singleflight, "_refresh_slots", threading.BoundedSemaphore(1)), \
+                mock.patch.dict(os.environ, {"SINGLEFLIGHT_TEST_TTL": "0"}):
+            for key in ("d", "e", "f", "d"):
+                self.assertEqual(singleflight.run("test", key, slow_refresh), "stale")
+            release.set()
+            for _ in range(100):
+                if not singleflight._flights:
+                    break
+                threading.Event().wait(0.02)
+        self.assertEqual(len(started), 1)
+        self.assertEqual(singleflight._load("test:d")[0], "fresh")
@@ -0,0 +1,66 @@
+from datetime import timedelta
+from importlib import import_module
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from card.diseases import get_index
+from card.models import ChatHistory, DiagnosedDisease, DiseaseDailyCount
+from card.stats import MAX_WINDOW_DAYS, get_disease_counts, record_diagnosis
+
+
+class DiagnosisStatsTests(TestCase):
+    def test_diagnoses_are_stored_by_id(self):
+        chat_history = ChatHistory.objects.create(hid="h1", conversation={})
+        self.assertTrue(record_diagnosis(chat_history, "Dengue"))
+        self.assertFalse(record_diagnosis(chat_history, "dengue fever"))
+        self.assertFalse(record_diagnosis(chat_history, "Not dengue"))
+        self.assertEqual(list(DiagnosedDisease.objects.values_list("disease", flat=True)), ["dengue"])
+        self.assertEqual(DiseaseDailyCount.objects.get().count, 1)
+
+        today = timezone.localdate()
+        self.assertEqual(
+            get_disease_counts(today - timedelta(days=1), today),
+            [{"disease": "dengue", "name": "Dengue", "count": 1}],
+        )
+
+
+class BackfillTests(SimpleTestCase):
+    def test_stored_names_become_ids_and_everything_else_unknown(self):
+        backfill = import_module("card.migrations.0003_diagnosis_rollups")
+        for disease in get_index().diseases.values():
+            self.assertEqual(backfill.disease_id(disease.name), disease.id)
+        self.assertEqual(backfill.disease_id("Suspected dengue fever (NS1 positive)"), "dengue")
+        for text in ["Not dengue", "Dengue ruled out", "negative for malaria", "Unknown", "", "bad stomach ache"]:
+            with self.subTest(text=text):
+                self.assertEqual(backfill.disease_id(text), "unknown")
+
+
+class DiseaseStatsAPITests(TestCase):
+    url = "/api/disease-stats/"
+
+    def test_window_by_days_and_by_dates(self):
+        chat_history = ChatHistory.objects.create(hid="h1", conversation={})
+        record_diagnosis(chat_history, "malaria")
+        today = timezone.localdate()
+
+        response = self.client.get(self.url, {"days": 30, "disease": "Malaria"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["disease"], "malaria")
+        self.assertEqual(response.json()["counts"], [{"disease": "malaria", "name": "Malaria", "count": 1}])
+
+        response = self.client.get(self.url, {"start": today.isoformat(), "end": today.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["counts"]), 1)
+
+    def test_invalid_windows_are_rejected(self):
+        today = timezone.localdate()
+        for params in [
+            {"days": 0},
+            {"days": 10 ** 10},
+            {"days": MAX_WINDOW_DAYS + 1},
+            {"days": "week"},
+            {"start": today.isoformat(), "end": (today - timedelta(days=1)).isoformat()},
+            {"start": "0001-01-01", "end": today.isoformat()},
+            {"start": "9999-12-31"},
+        ]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
@@ -0,0 +1,44 @@
+from django.test import SimpleTestCase
+from card.triage import triage
+
+
+class RedFlagTests(SimpleTestCase):
+    def assertFlags(self, text, *flags):
+        result = triage(text)
+        self.assertEqual(result.red_flags, list(flags), text)
+        self.assertEqual(result.emergency, bool(flags), text)
+
+    def test_negation_ends_at_the_clause(self):
+        self.assertFlags("No fever, crushing chest pain", "cardiac_chest_pain")
+        self.assertFlags("no cough, just can't breathe", "breathing_difficulty")
+        self.assertFlags("not eating, vomiting blood", "severe_bleeding")
+        self.assertFlags("no history, worst headache of my life", "thunderclap_headache")
+        self.assertFlags("not sure why, chest pain spreading to left arm", "cardiac_chest_pain")
+        self.assertFlags("I had a cold but now I can't breathe", "breathing_difficulty")
+
+    def test_negation_words_inside_a_pattern(self):
+        self.assertFlags("my baby is not breathing", "breathing_difficulty")
+        self.assertFlags("not breathing", "breathing_difficulty")
+        self.assertFlags("I'm not able to breathe", "breathing_difficulty")
+        self.assertFlags("he won't wake up", "unconscious")
+
+    def test_overdose(self):
+        self.assertFlags("I took 20 sleeping pills", "poisoning")
+        self.assertFlags("she swallowed a whole bottle of tablets", "poisoning")
+        self.assertFlags("I took 2 tablets of paracetamol for fever")
+
+    def test_denied_symptoms_are_not_flagged(self):
+        self.assertFlags("no chest pain")
+        self.assertFlags("I don't have crushing chest pain")
+        self.assertFlags("never had a seizure")
+
+
+class ClassifyTests(SimpleTestCase):
+    def test_denied_symptoms_are_not_tagged(self):
+        categories = triage("No chest pain, just a headache").categories
+        self.assertNotIn("cardiac", categories)
+        self.assertIn("neurological", categories)
+
+    def test_reported_symptoms_are_tagged(self):
+        self.assertIn("cardiac", triage("I have chest pain when I climb stairs").categories)
+        self.assertIn("fever", triage("high fever and chills for 3 days").categories)
@@ -0,0 +1,152 @@
+import hashlib
+import io
+import tempfile
+from concurrent.futures import Future
+from unittest import mock
+from django.test import TestCase, override_settings
+from card import uploads
+from card.models import ReportUpload, UploadPart
+
+REPORT = b"0123456789"
+SHA256 = hashlib.sha256(REPORT).hexdigest()
+
+
+class InlineExecutor:
+    """Runs submitted work at once, on the calling thread and its database connection."""
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class UploadTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.stored = {}
+        media_root = override_settings(MEDIA_ROOT=directory.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        for patcher in [
+            mock.patch.object(uploads, "CHUNK_SIZE", 4),
+            mock.patch.object(uploads, "_executor", InlineExecutor()),
+            # The pool's connection cleanup would close the test transaction
+            mock.patch.object(uploads, "_store_part", uploads._forward_part),
+            mock.patch.object(uploads, "upload_part", self.upload_part),
+            mock.patch.object(uploads, "compose_parts", lambda parts, blob_name, content_type: (blob_name, [])),
+            mock.patch.object(uploads, "delete_objects", lambda names: None),
+            mock.patch.object(uploads, "signed_url", lambda blob: f"https://storage.example/{blob}"),
+            mock.patch.object(uploads, "summarize_report", lambda path: "summary"),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def upload_part(self, name, data):
+        self.stored[name] = data
+
+    def create(self, sha256=SHA256):
+        response = self.client.post("/api/uploads/", {"filename": "report.pdf", "size": len(REPORT), "sha256": sha256},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        return response.json()["upload_id"]
+
+    def send(self, upload_id, start, end):
+        return self.client.put(f"/api/uploads/{upload_id}/", REPORT[start:end], content_type="application/octet-stream",
+                               HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(REPORT)}")
+
+    def send_all(self, upload_id):
+        for start in range(0, len(REPORT), 4):
+            self.assertEqual(self.send(upload_id, start, min(start + 4, len(REPORT))).status_code, 200)
+
+    def finalize(self, upload_id):
+        return self.client.post(f"/api/uploads/{upload_id}/finalize/")
+
+    def test_chunks_finalize_with_matching_checksum(self):
+        upload_id = self.create()
+        self.send_all(upload_id)
+        self.assertEqual(b"".join(data for _, data in sorted(self.stored.items())), REPORT)
+
+        response = self.finalize(upload_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["sha256"], SHA256)
+        self.assertEqual(response.json()["summary"], "summary")
+        self.assertEqual(ReportUpload.objects.get(pk=upload_id).status, "complete")
+        self.assertEqual(self.finalize(upload_id).json(), response.json())
+
+    def test_out_of_order_chunk_is_refused_and_replay_acknowledged(self):
+        upload_id = self.create()
+        response = self.send(upload_id, 4, 8)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["offset"], 0)
+
+        self.assertEqual(self.send(upload_id, 0, 4).json()["offset"], 4)
+        self.assertEqual(self.send(upload_id, 0, 4).json()["offset"], 4)
+        self.assertEqual(self.finalize(upload_id).status_code, 409)
+
+    def test_checksum_mismatch_fails_the_upload(self):
+        upload_id = self.create(sha256="0" * 64)
+        self.send_all(upload_id)
+        self.assertEqual(self.finalize(upload_id).status_code, 422)
+        self.assertEqual(ReportUpload.objects.get(pk=upload_id).status, "failed")
+
+    def test_losing_concurrent_sender_leaves_the_hash_intact(self):
+        upload = ReportUpload.objects.get(pk=self.create())
+
+        class RacingStream(io.BytesIO):
+            """The other sender delivers the same chunk while this one is mid-read."""
+            raced = False
+
+            def read(stream, size=-1):
+                if not stream.raced:
+                    stream.raced = True
+                    uploads.write_chunk(ReportUpload.objects.get(pk=upload.pk), 0, 4, len(REPORT),
+                                        io.BytesIO(REPORT[:4]))
+                return super().read(size)
+
+        self.assertEqual(uploads.write_chunk(upload, 0, 4, len(REPORT), RacingStream(REPORT[:4])), 4)
+        hashed, hasher = uploads._hashers[upload.id]
+        self.assertEqual((hashed, hasher.hexdigest()), (4, hashlib.sha256(REPORT[:4]).hexdigest()))
+
+        self.send(upload.id, 4, 8)
+        self.send(upload.id, 8, 10)
+        self.assertEqual(self.finalize(upload.id).json()["sha256"], SHA256)
+
+    def test_losing_sender_with_a_different_body_does_not_touch_the_spool(self):
+        upload = ReportUpload.objects.get(pk=self.create())
+
+        class RacingStream(io.BytesIO):
+            raced = False
+
+            def read(stream, size=-1):
+                if not stream.raced:
+                    stream.raced = True
+                    uploads.write_chunk(ReportUpload.objects.get(pk=upload.pk), 0, 4, len(REPORT),
+                                        io.BytesIO(REPORT[:4]))
+                return super().read(size)
+
+        self.assertEqual(uploads.write_chunk(upload, 0, 4, len(REPORT), RacingStream(b"XXXX")), 4)
+        with open(uploads.spool_path(upload), "rb") as spool:
+            self.assertEqual(spool.read(4), REPORT[:4])
+
+        self.send(upload.id, 4, 8)
+        self.send(upload.id, 8, 10)
+        response = self.finalize(upload.id)
+        self.assertEqual(response.json()["sha256"], SHA256)
+        self.assertEqual(self.stored[uploads.part_name(upload, 0)], REPORT[:4])
+
+    def test_failed_part_is_stored_again_at_finalize(self):
+        upload_id = self.create()
+        with mock.patch.object(uploads, "upload_part", side_effect=ConnectionError("storage unavailable")):
+            self.send(upload_id, 0, 4)
+        self.send(upload_id, 4, 8)
+        self.send(upload_id, 8, 10)
+        self.assertFalse(UploadPart.objects.get(upload_id=upload_id, index=0).stored)
+
+        with mock.patch.object(uploads.time, "sleep") as sleep:
+            self.assertEqual(self.finalize(upload_id).status_code, 200)
+        sleep.assert_not_called()
+        self.assertEqual(self.stored[uploads.part_name(ReportUpload.objects.get(pk=upload_id), 0)], REPORT[:4])
@@ -0,0 +1,100 @@
+import os
+from unittest import mock
+import requests
+from django.test import SimpleTestCase, override_settings
+from card import quota, upstream
+
+# Stale results in memory, so tests neither read nor leave files in UPSTREAM_STALE_DIR
+LOCAL_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "upstream_stale": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "test-stale"},
+}
+
+
+def response(status, headers=None):
+    result = requests.Response()
+    result.status_code = status
+    result.headers.update(headers or {})
+    return result
+
+
+class UpstreamTests(SimpleTestCase):
+    def setUp(self):
+        self.session = mock.Mock()
+        stale_cache = override_settings(CACHES=LOCAL_CACHES)
+        stale_cache.enable()
+        self.addCleanup(stale_cache.disable)
+        self.penalize = mock.Mock()
+        for patcher in [
+            mock.patch.dict(upstream._breakers, clear=True),
+            mock.patch.dict(os.environ, {"UPSTREAM_TEST_FAILURE_THRESHOLD": "2", "UPSTREAM_TEST_RETRIES": "1",
+                                         "UPSTREAM_TEST_BACKOFF": "0"}),
+            mock.patch.object(upstream, "_session", lambda: self.session),
+            mock.patch.object(quota, "acquire"),
+            mock.patch.object(quota, "penalize", self.penalize),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_breaker_opens_probes_once_and_closes(self):
+        breaker = upstream.get_breaker("test")
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(upstream.UpstreamUnavailable):
+            upstream.call("test", lambda: "ok")
+
+        breaker.opened_at -= breaker.reset_timeout
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, "half_open")
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+
+        breaker.opened_at -= breaker.reset_timeout
+        self.assertEqual(upstream.call("test", lambda: "ok"), "ok")
+        self.assertEqual((breaker.state, breaker.failures), ("closed", 0))
+
+    def test_transient_errors_are_retried_within_the_deadline(self):
+        self.session.get.side_effect = [requests.exceptions.ConnectionError("reset"), response(200)]
+        self.assertEqual(upstream.get("test", "https://upstream.example/").status_code, 200)
+        self.assertEqual(self.session.get.call_count, 2)
+
+        self.session.get.side_effect = [requests.exceptions.ConnectionError("reset"), response(200)]
+        with mock.patch.dict(os.environ, {"UPSTREAM_TEST_DEADLINE": "0"}):
+            with self.assertRaises(upstream.UpstreamError):
+                upstream.get("test", "https://upstream.example/")
+        self.assertEqual(upstream.get_breaker("test").failures, 1)
+
+    def test_rate_limit_penalizes_the_quota(self):
+        self.session.get.side_effect = [response(429, {"Retry-After": "7"}), response(200)]
+        self.assertEqual(upstream.get("test", "https://upstream.example/").status_code, 200)
+        self.penalize.assert_called_once_with("test", 7.0)
+
+        class RateLimited(OSError):
+            status_code = 429
+
+        with self.assertRaises(RateLimited):
+            upstream.call("test", mock.Mock(side_effect=RateLimited()))
+        self.assertEqual(self.penalize.call_count, 2)
+
+    def test_only_upstream_errors_count_against_the_breaker(self):
+        breaker = upstream.get_breaker("test")
+        for _ in range(3):
+            with self.assertRaises(TypeError):
+                upstream.call("test", lambda: None, "unexpected argument")
+        self.assertEqual((breaker.state, breaker.failures), ("closed", 0))
+
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                upstream.call("test", mock.Mock(side_effect=requests.exceptions.ConnectionError("reset")))
+        self.assertEqual(breaker.state, "open")
+
+    def test_remembered_results_are_served_while_down(self):
+        self.assertIsNone(upstream.stale("test", "pune"))
+        upstream.remember("test", "pune", ["article"])
+        with upstream.tracking_fallbacks() as served:
+            self.assertEqual(upstream.stale("test", "pune"), ["article"])
+            self.assertEqual(upstream.stale("test", "pune", degraded=False), ["article"])
+        self.assertEqual(served, ["test"])
@@ -0,0 +1,146 @@
+"""
+Local triage of chat messages, run before the chat LLM.
+
+Red-flag patterns catch emergencies so they can be answered immediately without
+waiting on (or depending on) the LLM. A small TF-IDF nearest-centroid classifier
+tags the message with symptom categories whose follow-up questions are passed
+to the LLM as hints. Everything is compiled once per process from
+data/triage.json and runs in microseconds.
+"""
+import json
+import math
+import os
+import re
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+TRIAGE_PATH = os.path.join(os.path.dirname(__file__), "data", "triage.json")
+
+# Cosine similarity a category centroid needs to be tagged, and how many tags to keep
+MIN_CATEGORY_SCORE = 0.2
+MAX_CATEGORIES = 3
+
+# A red flag preceded by one of these within a few words of the same clause ("no chest pain") is ignored
+NEGATIONS = {"no", "not", "without", "never", "denies", "deny", "don't", "dont", "didn't", "haven't", "hasn't"}
+NEGATION_WINDOW = 3
+# A negation stops at the end of its clause: "no fever, crushing chest pain", "no cough, just can't breathe"
+CLAUSE_BREAK = re.compile(r"[,;.!?]|\b(?:but|just|now)\b")
+
+STOPWORDS = {
+    "a", "an", "and", "the", "i", "my", "me", "is", "am", "are", "have", "has", "had", "of", "in", "on",
+    "at", "to", "for", "with", "since", "it", "its", "when", "what", "and", "or", "after", "every", "all",
+}
+
+Triage = namedtuple("Triage", ["emergency", "red_flags", "categories", "message"])
+
+
+def normalize_message(text):
+    """Lowercase with straight apostrophes and single spaces, as the patterns expect."""
+    text = str(text or "").lower().replace("’", "'").replace("‘", "'")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _stem(token):
+    for suffix in ("ing", "ed", "es", "s"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3 and not token.endswith("ss"):
+            return token[:-len(suffix)]
+    return token
+
+
+def affirmed_text(text):
+    """`text` without negated phrases: each clause is cut at its first negation word."""
+    clauses = []
+    for clause in CLAUSE_BREAK.split(normalize_message(text)):
+        words = clause.split()
+        cut = next((i for i, word in enumerate(words) if word in NEGATIONS), len(words))
+        clauses.append(" ".join(words[:cut]))
+    return " , ".join(clause for clause in clauses if clause)
+
+
+def _features(text):
+    """Unigram and bigram counts over stemmed, stopword-free tokens."""
+    tokens = [_stem(token) for token in re.findall(r"[a-z0-9']+", normalize_message(text)) if token not in STOPWORDS]
+    return Counter(tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])])
+
+
+def _normalized(vector):
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+
+class Triager:
+    """Compiled red-flag patterns and category centroids."""
+
+    def __init__(self, config):
+        self.emergency_message = config["emergency_message"]
+        self.flags = {flag["id"]: flag for flag in config["red_flags"]}
+        # One alternation with a named group per flag, so a message is scanned once
+        self.pattern = re.compile("|".join(
+            f"(?P<{flag['id']}>{'|'.join(f'(?:{pattern})' for pattern in flag['patterns'])})"
+            for flag in config["red_flags"]
+        ))
+
+        self.categories = {category["id"]: category for category in config["categories"]}
+        documents = {category["id"]: _features(" ".join(category["examples"])) for category in config["categories"]}
+        document_frequency = Counter(term for features in documents.values() for term in features)
+        count = len(documents)
+        self.idf = {term: math.log((1 + count) / (1 + frequency)) + 1 for term, frequency in document_frequency.items()}
+        self.centroids = {
+            category_id: _normalized({term: (1 + math.log(tf)) * self.idf[term] for term, tf in features.items()})
+            for category_id, features in documents.items()
+        }
+
+    def red_flags(self, text):
+        found = []
+        for match in self.pattern.finditer(text):
+            # Only words before the match count, so a pattern like "not breathing" is not its own negation
+            clause = CLAUSE_BREAK.split(text[:match.start()])[-1]
+            preceding = clause.split()[-NEGATION_WINDOW:]
+            if match.lastgroup not in found and not NEGATIONS.intersection(preceding):
+                found.append(match.lastgroup)
+        return found
+
+    def classify(self, text):
+        """Categories of the symptoms the message reports, ignoring denied ones ("no chest pain")."""
+        query = _normalized({
+            term: (1 + math.log(tf)) * self.idf[term]
+            for term, tf in _features(affirmed_text(text)).items() if term in self.idf
+        })
+        scores = {
+            category_id: sum(weight * centroid.get(term, 0.0) for term, weight in query.items())
+            for category_id, centroid in self.centroids.items()
+        }
+        ranked = sorted((score, category_id) for category_id, score in scores.items() if score >= MIN_CATEGORY_SCORE)
+        return [category_id for _, category_id in reversed(ranked[-MAX_CATEGORIES:])]
+
+    def escalation(self, flags):
+        reasons = ", ".join(self.flags[flag]["label"] for flag in flags)
+        lines = [self.emergency_message.format(reasons=reasons)]
+        lines += [self.flags[flag]["advice"] for flag in flags if self.flags[flag].get("advice")]
+        return " ".join(lines)
+
+    def follow_up(self, categories):
+        return [question for category in categories for question in self.categories[category]["follow_up"]]
+
+    def triage(self, text):
+        text = normalize_message(text)
+        flags = self.red_flags(text)
+        categories = self.classify(text)
+        return Triage(bool(flags), flags, categories, self.escalation(flags) if flags else None)
+
+
+@lru_cache(maxsize=1)
+def get_triager():
+    """Load and compile the bundled triage rules once per process."""
+    with open(TRIAGE_PATH, encoding="utf-8") as config:
+        return Triager(json.load(config))
+
+
+def triage(text):
+    """Red flags, symptom categories and, for emergencies, the escalation message for a chat message."""
+    return get_triager().triage(text)
+
+
+def follow_up_questions(categories):
+    """Follow-up question templates for the given category ids."""
+    return get_triager().follow_up(categories)
@@ -0,0 +1,313 @@
+"""
+Resumable chunked uploads of medical reports.
+
+    POST uploads/                  create an upload, returns its id and chunk size
+    PUT  uploads/<id>/             send the chunk at `Content-Range: bytes start-end/size`
+    GET  uploads/<id>/             current offset, to resume after a dropped connection
+    POST uploads/<id>/finalize/    compose the stored chunks and process the report
+
+Chunks must arrive in order, so the SHA-256 of the report is computed
+incrementally as they arrive. Each chunk is streamed to a temporary file, copied
+into a local spool file by the one sender that claims its byte range, and
+forwarded to GCS as its own object by a shared thread pool while later chunks
+are still uploading; finalize composes the parts into the final object, so only
+Gemini processing is left at that point. Memory per request is bounded by the
+read buffer, and disk per upload by the declared size.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import timedelta
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+from .db import retry_on_lock
+from .metrics import increment
+from .models import ReportUpload, UploadPart
+from .report import compose_parts, delete_objects, signed_url, summarize_report, upload_part
+
+CHUNK_SIZE = int(os.getenv("REPORT_UPLOAD_CHUNK_BYTES", 1024 * 1024))
+MAX_UPLOAD_SIZE = int(os.getenv("REPORT_UPLOAD_MAX_BYTES", 100 * 1024 * 1024))
+PARALLEL_PARTS = int(os.getenv("REPORT_UPLOAD_PARALLELISM", "4"))
+UPLOAD_EXPIRY = timedelta(hours=int(os.getenv("REPORT_UPLOAD_EXPIRY_HOURS", "24")))
+# How long finalize waits for parts another worker is still storing before storing them itself
+PART_WAIT_SECONDS = 60
+READ_BUFFER = 64 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=PARALLEL_PARTS, thread_name_prefix="report-parts")
+_pending_parts = {}     # (upload id, index) -> Future, for parts forwarded by this process
+_hashers = {}           # upload id -> (offset hashed so far, sha256 object)
+_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """A request that does not fit the upload's state; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def spool_path(upload):
+    extension = os.path.splitext(upload.filename)[1].lower() or ".pdf"
+    return default_storage.path(os.path.join("uploads", f"{upload.id}{extension}"))
+
+
+def part_name(upload, index):
+    return f"uploads/{upload.id}/part-{index:05d}"
+
+
+def part_count(upload):
+    return max(1, -(-upload.size // upload.chunk_size))
+
+
+def describe(upload):
+    """Client-facing state of an upload."""
+    return {
+        "upload_id": str(upload.id),
+        "filename": upload.filename,
+        "size": upload.size,
+        "chunk_size": upload.chunk_size,
+        "offset": upload.offset,
+        "status": upload.status,
+        "expires_at": (upload.created_at + UPLOAD_EXPIRY).isoformat(),
+    }
+
+
+def parse_content_range(header):
+    """(start, end exclusive, total) from `bytes start-end/total`."""
+    try:
+        unit, _, spec = header.partition(" ")
+        span, _, total = spec.partition("/")
+        first, _, last = span.partition("-")
+        if unit != "bytes":
+            raise ValueError
+        start, end, total = int(first), int(last) + 1, int(total)
+    except ValueError:
+        raise UploadError("Content-Range must look like 'bytes <start>-<end>/<size>'.")
+    if not 0 <= start < end <= total:
+        raise UploadError("Content-Range is out of bounds.")
+    return start, end, total
+
+
+def create_upload(filename, size, content_type="application/pdf", expected_sha256=""):
+    if not filename:
+        raise UploadError("filename is required.")
+    if not isinstance(size, int) or not 0 < size <= MAX_UPLOAD_SIZE:
+        raise UploadError(f"size must be between 1 and {MAX_UPLOAD_SIZE} bytes.")
+    expire_stale_uploads()
+    upload = retry_on_lock(ReportUpload.objects.create)(
+        filename=get_valid_filename(os.path.basename(filename))[:255],
+        content_type=content_type or "application/pdf",
+        size=size,
+        chunk_size=CHUNK_SIZE,
+        expected_sha256=(expected_sha256 or "").lower(),
+    )
+    # A sparse file of the final size, so chunks can be written at their offsets
+    path = spool_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as spool:
+        spool.truncate(size)
+    increment("card_report_uploads_total", event="created")
+    return upload
+
+
+def write_chunk(upload, start, end, total, stream):
+    """
+    Append the chunk [start, end) read from `stream`. A chunk that was already
+    received is acknowledged without being written again, so clients can retry
+    blindly. Returns the new offset.
+    """
+    if upload.status != "pending":
+        raise UploadError(f"Upload is {upload.status}.", status=409, offset=upload.offset)
+    if total != upload.size:
+        raise UploadError(f"Upload size is {upload.size} bytes, not {total}.")
+    if end <= upload.offset:
+        return upload.offset
+    if start != upload.offset:
+        raise UploadError("Chunks must be sent in order; resume at the current offset.", status=409,
+                          offset=upload.offset)
+    if start % upload.chunk_size or (end - start != upload.chunk_size and end != upload.size):
+        raise UploadError(f"Chunks must be {upload.chunk_size} bytes, except the last one.")
+
+    # Work on a copy: a concurrent sender of the same chunk must not feed the shared state twice
+    with _lock:
+        hashed, hasher = _hashers.get(upload.id, (None, None))
+        hasher = hasher.copy() if hashed == start else None
+    if hasher is None:
+        hasher = _rehash(upload, start)
+
+    # Received into a file of its own; only the sender that claims the range writes to the spool
+    with tempfile.TemporaryFile(dir=os.path.dirname(spool_path(upload))) as body:
+        remaining = end - start
+        while remaining:
+            data = stream.read(min(READ_BUFFER, remaining))
+            if not data:
+                raise UploadError("The request body is shorter than its Content-Range.")
+            body.write(data)
+            hasher.update(data)
+            remaining -= len(data)
+        advanced = retry_on_lock(_claim_range)(upload, start, end, body)
+    if not advanced:
+        upload.refresh_from_db(fields=["offset", "status"])
+        return upload.offset
+
+    with _lock:
+        _hashers[upload.id] = (end, hasher)
+    upload.offset = end
+    index = start // upload.chunk_size
+    retry_on_lock(UploadPart.objects.get_or_create)(upload=upload, index=index, defaults={"size": end - start})
+    with _lock:
+        _pending_parts[(upload.id, index)] = _executor.submit(copy_context().run, _store_part, upload, index)
+    increment("card_report_upload_bytes_total", end - start)
+    return end
+
+
+def _claim_range(upload, start, end, body):
+    """
+    Copy `body` into the spool at `start` and advance the offset, if the upload
+    is still at `start`. The row lock (on SQLite, the write lock taken as the
+    transaction begins) holds a concurrent sender of the same range back until
+    the winner has committed; it then sees the new offset and writes nothing.
+    """
+    with transaction.atomic():
+        if not ReportUpload.objects.select_for_update().filter(pk=upload.pk, offset=start, status="pending").exists():
+            return False
+        body.seek(0)
+        with open(spool_path(upload), "r+b") as spool:
+            spool.seek(start)
+            while data := body.read(READ_BUFFER):
+                spool.write(data)
+        ReportUpload.objects.filter(pk=upload.pk).update(offset=end)
+    return True
+
+
+def _rehash(upload, offset):
+    """SHA-256 state after `offset` bytes, rebuilt from the spool file (e.g. after a worker switch)."""
+    hasher = hashlib.sha256()
+    remaining = offset
+    with open(spool_path(upload), "rb") as spool:
+        while remaining:
+            data = spool.read(min(READ_BUFFER, remaining))
+            hasher.update(data)
+            remaining -= len(data)
+    return hasher
+
+
+def _forward_part(upload, index):
+    """Forward one chunk from the spool file to its own storage object."""
+    start = index * upload.chunk_size
+    with open(spool_path(upload), "rb") as spool:
+        spool.seek(start)
+        data = spool.read(min(upload.chunk_size, upload.size - start))
+    upload_part(part_name(upload, index), data)
+    retry_on_lock(UploadPart.objects.filter(upload=upload, index=index).update)(stored=True)
+
+
+def _store_part(upload, index):
+    """_forward_part on the thread pool."""
+    try:
+        _forward_part(upload, index)
+    finally:
+        with _lock:
+            _pending_parts.pop((upload.id, index), None)
+        connections.close_all()
+
+
+def _ensure_parts_stored(upload):
+    """Wait for every part to reach storage, storing any that failed or were left by a dead worker."""
+    deadline = time.monotonic() + PART_WAIT_SECONDS
+    for index in range(part_count(upload)):
+        with _lock:
+            future = _pending_parts.get((upload.id, index))
+        if future is not None:
+            try:
+                future.result()
+                continue
+            except Exception as e:
+                print(f"Part {index} of upload {upload.id} failed, retrying: {e}")
+                _forward_part(upload, index)
+                continue
+        # Possibly still being stored by the worker that received it
+        while not UploadPart.objects.filter(upload=upload, index=index, stored=True).exists():
+            if time.monotonic() >= deadline:
+                _forward_part(upload, index)
+                break
+            time.sleep(0.2)
+
+
+def _sha256(upload):
+    with _lock:
+        hashed, hasher = _hashers.pop(upload.id, (None, None))
+    return (hasher if hashed == upload.size else _rehash(upload, upload.size)).hexdigest()
+
+
+def finalize_upload(upload):
+    """
+    Compose the stored parts into the final object, verify the checksum and
+    summarize the report. Finalizing a completed upload returns the same result.
+    """
+    if upload.status == "complete":
+        return upload.result
+    if upload.offset < upload.size:
+        raise UploadError("Upload is incomplete.", status=409, offset=upload.offset)
+    claimed = retry_on_lock(ReportUpload.objects.filter(pk=upload.pk, status="pending").update)(status="finalizing")
+    if not claimed:
+        upload.refresh_from_db()
+        if upload.status == "complete":
+            return upload.result
+        raise UploadError(f"Upload is {upload.status}.", status=409, offset=upload.offset)
+
+    path = spool_path(upload)
+    try:
+        upload.sha256 = _sha256(upload)
+        if upload.expected_sha256 and upload.sha256 != upload.expected_sha256:
+            _discard(upload, status="failed")
+            raise UploadError("SHA-256 of the received file does not match the declared one.", status=422)
+
+        _ensure_parts_stored(upload)
+        parts = [part_name(upload, index) for index in range(part_count(upload))]
+        upload.blob_name = f"reports/{upload.id}/{upload.filename}"
+        blob, intermediates = compose_parts(parts, upload.blob_name, upload.content_type)
+
+        upload.result = {"summary": summarize_report(path), "file_url": signed_url(blob), "sha256": upload.sha256}
+        upload.status = "complete"
+        retry_on_lock(upload.save)(update_fields=["sha256", "blob_name", "result", "status", "updated_at"])
+        _executor.submit(delete_objects, parts + intermediates)
+    except UploadError:
+        raise
+    except Exception:
+        # Leave the upload finalizable again; the spool file and parts are still there
+        retry_on_lock(ReportUpload.objects.filter(pk=upload.pk).update)(status="pending")
+        raise
+
+    if os.path.exists(path):
+        os.remove(path)
+    increment("card_report_uploads_total", event="completed")
+    return upload.result
+
+
+def _discard(upload, status):
+    retry_on_lock(ReportUpload.objects.filter(pk=upload.pk).update)(status=status)
+    upload.status = status
+    path = spool_path(upload)
+    if os.path.exists(path):
+        os.remove(path)
+    parts = list(UploadPart.objects.filter(upload=upload, stored=True).values_list("index", flat=True))
+    if parts:
+        _executor.submit(delete_objects, [part_name(upload, index) for index in parts])
+
+
+def expire_stale_uploads(limit=20):
+    """Drop a few uploads that were never finalized, with their spool files and parts."""
+    cutoff = timezone.now() - UPLOAD_EXPIRY
+    for upload in ReportUpload.objects.filter(created_at__lt=cutoff, status__in=("pending", "failed"))[:limit]:
+        _discard(upload, status="failed")
+        upload.delete()
+        increment("card_report_uploads_total", event="expired")
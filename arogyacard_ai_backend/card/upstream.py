@@ -0,0 +1,331 @@
+"""
+Shared layer for calls to third-party APIs.
+
+Every upstream gets connect/read deadlines, jittered retries for idempotent
+HTTP calls and a circuit breaker. While a breaker is open, calls fail fast with
+`UpstreamUnavailable` and callers can serve the last good result via `stale()`.
+Calls billed to an API key also take a token from its shared quota bucket
+(see quota.py) before each attempt; a refused token is reported the same way.
+Only transport and SDK errors count against a breaker: a bug in the caller,
+such as a TypeError from bad arguments, is raised without blocking the service.
+
+Last good results are kept in the `upstream_stale` cache, which settings.py
+points at a directory shared by the workers on a host.
+"""
+import hashlib
+import importlib
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+import requests
+from requests.adapters import HTTPAdapter
+from django.core.cache import caches
+from . import quota
+from .metrics import increment, set_gauge, timed
+
+# Per-service defaults; each value can be overridden with UPSTREAM_<SERVICE>_<SETTING>,
+# e.g. UPSTREAM_PLACES_READ_TIMEOUT=5 or UPSTREAM_IDSP_RETRIES=0.
+SERVICE_DEFAULTS = {
+    "groq": {"connect_timeout": 3.05, "read_timeout": 20, "retries": 2},
+    "gemini": {"connect_timeout": 5, "read_timeout": 120, "retries": 0},
+    "gcs": {"connect_timeout": 5, "read_timeout": 60, "retries": 0},
+    "places": {"connect_timeout": 3.05, "read_timeout": 8, "retries": 2},
+    "geocoding": {"connect_timeout": 3.05, "read_timeout": 5, "retries": 1},
+    "youtube": {"connect_timeout": 3.05, "read_timeout": 8, "retries": 2},
+    "cse": {"connect_timeout": 3.05, "read_timeout": 8, "retries": 2},
+    "event_registry": {"connect_timeout": 3.05, "read_timeout": 20, "retries": 1},
+    "idsp": {"connect_timeout": 5, "read_timeout": 30, "retries": 2},
+}
+DEFAULT_SETTINGS = {
+    "connect_timeout": 3.05,
+    "read_timeout": 10,
+    "retries": 1,
+    "backoff": 0.25,            # base delay between retries, doubled each attempt
+    "deadline": 45,             # no retry is started once this many seconds have passed
+    "failure_threshold": 5,     # consecutive failures that open the breaker
+    "reset_timeout": 30,        # seconds the breaker stays open before a probe is let through
+}
+
+# HTTP statuses worth retrying, and that count as upstream failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# How long the last good result of each call is kept for serving while an upstream is down
+STALE_TTL = int(os.getenv("UPSTREAM_STALE_TTL", 24 * 60 * 60))
+STALE_CACHE = "upstream_stale"
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class UpstreamError(Exception):
+    """An upstream call failed after retries."""
+
+    def __init__(self, service, message):
+        super().__init__(f"{service}: {message}")
+        self.service = service
+
+
+class UpstreamUnavailable(UpstreamError):
+    """The service's circuit breaker is open or its quota is spent; the call was not attempted."""
+
+    def __init__(self, service, message, retry_after=None):
+        super().__init__(service, message)
+        self.retry_after = retry_after
+
+
+def service_settings(service):
+    settings = {**DEFAULT_SETTINGS, **SERVICE_DEFAULTS.get(service, {})}
+    for name, default in settings.items():
+        value = os.getenv(f"UPSTREAM_{service.upper()}_{name.upper()}")
+        if value is not None:
+            settings[name] = type(default)(value)
+    return settings
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe."""
+
+    def __init__(self, service, failure_threshold, reset_timeout):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._publish()
+
+    def _publish(self):
+        set_gauge("card_upstream_circuit_state", CIRCUIT_STATES[self.state], service=self.service)
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._publish()
+            if self.state == "half_open":
+                if self._probing:
+                    return False
+                self._probing = True
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != "closed":
+                self.state = "closed"
+                self._publish()
+
+    def release(self):
+        """The allowed call was not made after all; let another probe through."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"Circuit for {self.service} opened after {self.failures} failure(s)")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._publish()
+
+    def retry_after(self):
+        """Seconds until an open breaker lets a probe through."""
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_sessions = threading.local()
+
+
+def get_breaker(service):
+    with _breakers_lock:
+        if service not in _breakers:
+            settings = service_settings(service)
+            _breakers[service] = CircuitBreaker(service, settings["failure_threshold"], settings["reset_timeout"])
+        return _breakers[service]
+
+
+def _upstream_errors():
+    """Exception types raised when an upstream, rather than the caller, failed; for the SDKs installed."""
+    errors = [OSError, requests.exceptions.RequestException]
+    for module, names in (
+        ("httpx", ["HTTPError"]),
+        ("groq", ["APIError"]),
+        ("google.genai.errors", ["APIError"]),
+        ("google.api_core.exceptions", ["GoogleAPIError"]),
+        ("googlemaps.exceptions", ["ApiError", "HTTPError", "Timeout", "TransportError"]),
+    ):
+        try:
+            imported = importlib.import_module(module)
+        except ImportError:
+            continue
+        errors.extend(getattr(imported, name) for name in names if hasattr(imported, name))
+    return tuple(errors)
+
+
+UPSTREAM_ERRORS = _upstream_errors()
+
+
+def _session():
+    """Per-thread session so connections to each upstream are kept alive and reused."""
+    if not hasattr(_sessions, "session"):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _sessions.session = session
+    return _sessions.session
+
+
+def _acquire(service):
+    breaker = get_breaker(service)
+    if not breaker.allow():
+        increment("card_upstream_rejected_total", service=service)
+        raise UpstreamUnavailable(service, "circuit open", retry_after=breaker.retry_after())
+    try:
+        quota.acquire(service)
+    except quota.QuotaExceeded as e:
+        breaker.release()
+        raise UpstreamUnavailable(service, str(e), retry_after=e.retry_after) from e
+    return breaker
+
+
+def _sleep_before_retry(service, settings, attempt, started):
+    """Back off before a retry; False if the deadline would pass or no quota token is left for it."""
+    delay = random.uniform(0, settings["backoff"] * (2 ** attempt))
+    if time.monotonic() - started + delay > settings["deadline"]:
+        return False
+    time.sleep(delay)
+    try:
+        quota.acquire(service)
+    except quota.QuotaExceeded as e:
+        print(f"Not retrying {service}: {e}")
+        return False
+    return True
+
+
+def _retry_after(value):
+    """Seconds from a Retry-After header given in seconds; HTTP dates are ignored."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def get(service, url, operation="get", **kwargs):
+    """
+    Idempotent GET through the service's breaker, deadlines and retry policy.
+    Returns the final response (callers still check its status) or raises UpstreamError
+    when the upstream could not be reached at all.
+    """
+    settings = service_settings(service)
+    breaker = _acquire(service)
+    kwargs.setdefault("timeout", (settings["connect_timeout"], settings["read_timeout"]))
+    started = time.monotonic()
+
+    attempt = 0
+    while True:
+        try:
+            with timed(service, operation):
+                response = _session().get(url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            transient = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+            if transient and attempt < settings["retries"] and _sleep_before_retry(service, settings, attempt, started):
+                attempt += 1
+                continue
+            breaker.record_failure()
+            raise UpstreamError(service, str(e)) from e
+
+        if response.status_code == 429:
+            quota.penalize(service, _retry_after(response.headers.get("Retry-After")))
+        if response.status_code in RETRY_STATUSES:
+            if attempt < settings["retries"] and _sleep_before_retry(service, settings, attempt, started):
+                attempt += 1
+                continue
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+
+def call(service, func, *args, operation="call", **kwargs):
+    """
+    Run an SDK call through the service's breaker and timing. SDK calls are not
+    retried here: the SDKs that are safe to retry do so themselves.
+    """
+    breaker = _acquire(service)
+    try:
+        with timed(service, operation):
+            result = func(*args, **kwargs)
+    except UPSTREAM_ERRORS as e:
+        # SDK errors carry the HTTP status as status_code (Groq) or code (google-genai)
+        if 429 in (getattr(e, "status_code", None), getattr(e, "code", None)):
+            quota.penalize(service)
+        breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    breaker.record_success()
+    return result
+
+
+def timeout(service):
+    """Read deadline in seconds for SDK clients that take a single timeout."""
+    return service_settings(service)["read_timeout"]
+
+
+def _stale_key(service, key):
+    return f"upstream:stale:{service}:{hashlib.sha1(str(key).encode()).hexdigest()}"
+
+
+# Services that stale() served a remembered result for, or that left a result incomplete
+# (mark_degraded), inside the innermost tracking_fallbacks() block
+_fallbacks = ContextVar("stale_fallbacks", default=None)
+
+
+@contextmanager
+def tracking_fallbacks():
+    """Collect the services that fell back to a remembered result inside the block."""
+    served = []
+    token = _fallbacks.set(served)
+    try:
+        yield served
+    finally:
+        _fallbacks.reset(token)
+
+
+def mark_degraded(service):
+    """Tell the enclosing tracking_fallbacks() block that a result is incomplete because `service` failed."""
+    served = _fallbacks.get()
+    if served is not None:
+        served.append(service)
+
+
+def remember(service, key, value):
+    """Keep the last good result of a call so it can be served while the upstream is down."""
+    caches[STALE_CACHE].set(_stale_key(service, key), value, STALE_TTL)
+
+
+def stale(service, key, degraded=True):
+    """
+    Last good result remembered for `key`, or None. Unless `degraded` is false (for
+    data that does not go out of date), the enclosing tracking_fallbacks() block is
+    told, so a result built from it is not cached as fresh.
+    """
+    value = caches[STALE_CACHE].get(_stale_key(service, key))
+    increment("card_upstream_stale_served_total" if value is not None else "card_upstream_stale_missing_total",
+              service=service)
+    if value is not None and degraded:
+        mark_degraded(service)
+    return value
@@ -1,11 +1,17 @@
 from django.urls import path
-from .views import ChatAPIView, MedicalReportAPIView, HospitalSearchAPIView, NewsAPIView, ClusterAPIView, ContentAPIView
+from .views import ChatAPIView, MedicalReportAPIView, HospitalSearchAPIView, NewsAPIView, NewsDigestAPIView, ClusterAPIView, ContentAPIView, DiseaseStatsAPIView, ExportAPIView, ReportUploadInitAPIView, ReportUploadChunkAPIView, ReportUploadFinalizeAPIView
 
 urlpatterns = [
     path("chat/", ChatAPIView.as_view(), name="chat_api"),
     path("upload-report/", MedicalReportAPIView.as_view(), name="upload_report_api"),
+    path("uploads/", ReportUploadInitAPIView.as_view(), name="upload_init_api"),
+    path("uploads/<uuid:upload_id>/", ReportUploadChunkAPIView.as_view(), name="upload_chunk_api"),
+    path("uploads/<uuid:upload_id>/finalize/", ReportUploadFinalizeAPIView.as_view(), name="upload_finalize_api"),
     path('get-hospitals/', HospitalSearchAPIView.as_view(), name='get_hospitals_api'),
     path('get-news/', NewsAPIView.as_view(), name='get_news_api'),
+    path('get-news/digest/', NewsDigestAPIView.as_view(), name='get_news_digest_api'),
     path('get-outbreaks/', ClusterAPIView.as_view(), name='get_outbreaks_api'),
     path('get-content/', ContentAPIView.as_view(), name='get_content_api'),
+    path('disease-stats/', DiseaseStatsAPIView.as_view(), name='disease_stats_api'),
+    path('export/<str:dataset>/', ExportAPIView.as_view(), name='export_api'),
 ]
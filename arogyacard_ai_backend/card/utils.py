@@ -1,6 +1,14 @@
 from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
+from django.db import transaction
 from .models import ChatHistory, DiagnosedDisease
+from .diseases import canonicalize_disease
+from .db import retry_on_lock
+from .metrics import increment
+from .triage import follow_up_questions, triage
+from .firstturn import find_response, remember_response
+from .archive import rehydrate
+from . import upstream
 from dotenv import load_dotenv
 import os
 import requests
@@ -12,13 +20,15 @@ load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GOOGLE_PLACES_API_KEY = os.getenv("GOOGLE_PLACES_API_KEY")
 
+PLACES_TEXT_SEARCH_URL = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+
 # Initialize LLM
 llm = ChatGroq(
     model="llama-3.3-70b-versatile",
     temperature=0,
     max_tokens=500,
-    timeout=10,
-    max_retries=2,
+    timeout=upstream.timeout("groq"),
+    max_retries=upstream.service_settings("groq")["retries"],
 )
 
 # Chat Prompt Template
@@ -31,7 +41,8 @@ prompt = ChatPromptTemplate.from_messages([
      "- If the user mentions fever: 'How many days have you had a fever? Is it accompanied by other symptoms?'\n"
      "- If the user reports chest pain: 'Do you also feel shortness of breath or dizziness? Where exactly is the pain located?'\n"
      "- If the user has a headache: 'Is it a throbbing pain or more like pressure? Does light or sound make it worse?'\n"
-     "- If the user mentions stomach pain: 'Is the pain constant or intermittent? Have you noticed any triggers like certain foods?'\n\n"
+     "- If the user mentions stomach pain: 'Is the pain constant or intermittent? Have you noticed any triggers like certain foods?'\n"
+     "{hints}\n"
      "After gathering sufficient information (3-4 exchanges), provide your final response strictly in the following JSON format only, with no extra text:\n\n"
      "{{\n"
      '  "symptoms": "[List user\'s reported symptoms]",\n'
@@ -45,27 +56,62 @@ prompt = ChatPromptTemplate.from_messages([
 
 
 
-def get_medical_response(hid, user_query):
+def follow_up_hints(categories):
+    """Prompt lines suggesting follow-up questions for the triaged symptom categories."""
+    questions = follow_up_questions(categories)
+    if not questions:
+        return ""
+    return "\nFor this patient's symptoms, consider asking:\n" + "\n".join(f"- {q}" for q in questions) + "\n"
+
+
+def get_medical_response(hid, user_query, assessment=None):
     """
     Handles the medical chatbot response generation, updates chat history,
     extracts diagnosed diseases, and stores them in the database.
+    Messages triaged as emergencies are answered immediately without the LLM, and
+    opening messages close to an earlier one reuse its first follow-up question.
     """
+    assessment = assessment or triage(user_query)
+
     # Retrieve or create ChatHistory for the given HID
-    chat_history, created = ChatHistory.objects.get_or_create(hid=hid)
+    chat_history, created = retry_on_lock(ChatHistory.objects.get_or_create)(hid=hid)
+    # Returning patients get their archived conversation back in the hot table
+    rehydrate(chat_history)
+
+    if assessment.emergency:
+        increment("card_triage_total", outcome="emergency")
+        save_chat_turn(chat_history, user_query, assessment.message)
+        return assessment.message
+    increment("card_triage_total", outcome="tagged" if assessment.categories else "untagged")
+
+    first_turn = not chat_history.conversation
+    if first_turn:
+        reused = find_response(user_query, assessment.categories)
+        if reused:
+            save_chat_turn(chat_history, user_query, reused)
+            return reused
+
     history = "\n".join(
         [f"User: {q}\nBot: {r}" for q, r in chat_history.conversation.items()]
     )
 
     # Invoke the model to generate a response
     chain = prompt | llm
-    response_message = chain.invoke({"history": history, "input": user_query})
+    response_message = upstream.call(
+        "groq", chain.invoke,
+        {"history": history, "input": user_query, "hints": follow_up_hints(assessment.categories)},
+        operation="chat",
+    )
 
     # Extract the response text
     response_text = response_message.content
 
     # Update the conversation history
-    chat_history.conversation[user_query] = response_text
-    chat_history.save()
+    save_chat_turn(chat_history, user_query, response_text)
+
+    # Keep first follow-up questions (not final JSON assessments) for similar openings
+    if first_turn and not response_text.lstrip().startswith("{"):
+        remember_response(user_query, assessment.categories, response_text)
 
     # Extract the diagnosed disease from the chatbot's response
     disease = extract_disease_from_response(response_text)
@@ -82,9 +128,26 @@ def get_medical_response(hid, user_query):
     return response_text
 
 
+@retry_on_lock
+def save_chat_turn(chat_history, user_query, response_text):
+    """
+    Append a question/answer pair to the stored conversation. The row is re-read
+    under a row lock, so turns saved concurrently for the same HID are all kept.
+    """
+    with transaction.atomic():
+        current = ChatHistory.objects.select_for_update().get(pk=chat_history.pk)
+        current.conversation[user_query] = response_text
+        current.save()
+    chat_history.conversation = current.conversation
+    chat_history.updated_at = current.updated_at
+    chat_history.preview = current.preview
+    chat_history.turn_count = current.turn_count
+
+
 def extract_disease_from_response(response_text):
     """
     Uses ChatGroq to extract the diagnosed disease from the chatbot's response.
+    The name is canonicalized against the bundled disease vocabulary.
     If no disease is mentioned, returns 'Unknown'.
     """
     prompt = f"""
@@ -96,12 +159,12 @@ def extract_disease_from_response(response_text):
     {{"disease": "extracted disease"}}
     """
 
-    result = llm.predict(prompt)
+    result = upstream.call("groq", llm.predict, prompt, operation="extract_disease")
     
     # Parse JSON output
     try:
         extracted_data = json.loads(result)
-        return extracted_data.get("disease", "Unknown")
+        return canonicalize_disease(extracted_data.get("disease", "Unknown"))
     except json.JSONDecodeError:
         return "Unknown"
 
@@ -109,8 +172,9 @@ def extract_disease_from_response(response_text):
 def get_nearby_hospitals(disease, location):
     """
     Fetches nearby hospitals specialized in treating the given disease at the specified location.
+    If Places is unavailable, the last results for the same query are served.
     """
-    url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+    url = PLACES_TEXT_SEARCH_URL
     query = f"{disease} specialist hospital near {location}"
     params = {
         "query": query,
@@ -119,7 +183,7 @@ def get_nearby_hospitals(disease, location):
 
     try:
         # Make the API request to fetch hospital data
-        response = requests.get(url, params=params)
+        response = upstream.get("places", url, params=params, operation="text_search")
         response.raise_for_status()
         data = response.json()
 
@@ -133,8 +197,12 @@ def get_nearby_hospitals(disease, location):
                 }
                 for place in data["results"]
             ]
+            upstream.remember("places", query, hospitals)
             return hospitals
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, upstream.UpstreamError) as e:
         print(f"Error fetching hospitals: {e}")
+        hospitals = upstream.stale("places", query)
+        if hospitals is not None:
+            return hospitals
 
     return []
@@ -1,34 +1,79 @@
+import hmac
+import math
 import os
-import json
+from datetime import date
 from django.core.files.storage import default_storage
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
 from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
-from rest_framework.views import APIView
+from rest_framework.views import APIView, exception_handler
 from .utils import get_medical_response  # Chatbot logic
+from .triage import triage
+from .archive import load_conversation
 from .serializers import DocumentUploadSerializer
 from .report import process_medical_report  # Google Gemini API processing
-from .models import ChatHistory, DiagnosedDisease
-from .news import get_news
-from .clusters import get_outbreak_data
-from .content import fetch_google_articles, fetch_youtube_videos
+from .models import ChatHistory, DiagnosedDisease, ReportUpload
+from .uploads import UploadError, create_upload, describe, finalize_upload, parse_content_range, write_chunk
+from .news import MAX_DIGEST_CITIES, get_news, get_news_digest
+from .clusters import get_outbreak_data, is_final_week, is_outbreak_error, stored_outbreak_data
+from .content import get_disease_content
+from .diseases import canonicalize_disease, disease_key, UNKNOWN_DISEASE
+from .stats import MAX_WINDOW_DAYS, record_diagnosis, get_disease_counts, default_window
+from .metrics import render_prometheus
+from .upstream import UpstreamUnavailable
+from .idempotency import idempotent
+from .httpcache import conditional_response, not_modified
+from .export import ExportError, high_water_mark, iter_ndjson, iter_records, resolve_fields
+
+# Bearer token for Prometheus scrapers of /metrics; without one only local scrapers and staff may read it
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+
+def upstream_exception_handler(exc, context):
+    """DRF exception handler: a skipped upstream call (breaker open, quota spent) is a 503, not a 500."""
+    if isinstance(exc, UpstreamUnavailable):
+        response = Response(
+            {"error": f"{exc.service} is temporarily unavailable, please retry shortly."},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+        if exc.retry_after is not None:
+            response["Retry-After"] = str(max(1, math.ceil(exc.retry_after)))
+        return response
+    return exception_handler(exc, context)
+
 
 class ChatAPIView(APIView):
+    @idempotent
     def post(self, request, *args, **kwargs):
-        data = json.loads(request.body)
+        data = request.data
         hid = data.get("hid")
         query = data.get("query")
 
         if not hid or not query:
             return Response({"error": "Missing hid or query"}, status=status.HTTP_400_BAD_REQUEST)
 
-        response = get_medical_response(hid, query)
+        # Local triage first: emergencies are answered without waiting on the LLM
+        assessment = triage(query)
+        response = get_medical_response(hid, query, assessment)
 
-        return Response({"hid": hid, "query": query, "response": response}, status=status.HTTP_200_OK)
+        return Response({
+            "hid": hid,
+            "query": query,
+            "response": response,
+            "triage": {
+                "emergency": assessment.emergency,
+                "red_flags": assessment.red_flags,
+                "categories": assessment.categories,
+            },
+        }, status=status.HTTP_200_OK)
 
 class MedicalReportAPIView(APIView):
     parser_classes = (MultiPartParser, FormParser)
 
+    @idempotent
     def post(self, request, *args, **kwargs):
         serializer = DocumentUploadSerializer(data=request.data)
         if serializer.is_valid():
@@ -50,12 +95,68 @@ class MedicalReportAPIView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def upload_error_response(error):
+    body = {"error": str(error)}
+    if error.offset is not None:
+        body["offset"] = error.offset
+    return Response(body, status=error.status)
+
+
+class ReportUploadInitAPIView(APIView):
+    def post(self, request, *args, **kwargs):
+        """Start a resumable report upload; send `filename`, `size` and optionally `sha256`."""
+        data = request.data
+        try:
+            upload = create_upload(
+                data.get("filename"), data.get("size"), data.get("content_type"), data.get("sha256"),
+            )
+        except UploadError as e:
+            return upload_error_response(e)
+        return Response(describe(upload), status=status.HTTP_201_CREATED)
+
+
+class ReportUploadChunkAPIView(APIView):
+    def get(self, request, upload_id, *args, **kwargs):
+        """Current offset of an upload, to resume from after an interruption."""
+        upload = ReportUpload.objects.filter(pk=upload_id).first()
+        if upload is None:
+            return Response({"error": "Unknown upload."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(describe(upload), status=status.HTTP_200_OK)
+
+    def put(self, request, upload_id, *args, **kwargs):
+        """Receive one chunk; the raw body is streamed to disk, never parsed."""
+        upload = ReportUpload.objects.filter(pk=upload_id).first()
+        if upload is None:
+            return Response({"error": "Unknown upload."}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            start, end, total = parse_content_range(request.headers.get("Content-Range", ""))
+            if int(request.headers.get("Content-Length") or 0) != end - start:
+                raise UploadError("Content-Length must match the Content-Range.")
+            offset = write_chunk(upload, start, end, total, request.stream)
+        except UploadError as e:
+            return upload_error_response(e)
+        return Response({"upload_id": str(upload.id), "offset": offset, "size": upload.size}, status=status.HTTP_200_OK)
+
+
+class ReportUploadFinalizeAPIView(APIView):
+    def post(self, request, upload_id, *args, **kwargs):
+        """Assemble a fully received upload and return the report summary and file URL."""
+        upload = ReportUpload.objects.filter(pk=upload_id).first()
+        if upload is None:
+            return Response({"error": "Unknown upload."}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            result = finalize_upload(upload)
+        except UploadError as e:
+            return upload_error_response(e)
+        return Response(result, status=status.HTTP_200_OK)
+
+
 from .utils import extract_disease_from_response, get_nearby_hospitals
 
 class HospitalSearchAPIView(APIView):
     def post(self, request, *args, **kwargs):
         """Extracts disease from chatbot response and fetches nearby hospitals based on hid."""
-        data = json.loads(request.body)
+        data = request.data
         hid = data.get("hid", "")
         location = data.get("location", "")
 
@@ -65,7 +166,7 @@ class HospitalSearchAPIView(APIView):
         # Retrieve conversation history from the database
         try:
             chat_history = ChatHistory.objects.get(hid=hid)
-            response_text = "\n".join(chat_history.conversation.values())  # Combine all responses
+            response_text = "\n".join(load_conversation(chat_history).values())  # Combine all responses
         except ChatHistory.DoesNotExist:
             return Response({"error": "Chat history not found for the given HID."}, status=status.HTTP_404_NOT_FOUND)
 
@@ -74,8 +175,8 @@ class HospitalSearchAPIView(APIView):
         
         if disease and disease.lower() != "unknown":
             try:
-                DiagnosedDisease.objects.create(hid=hid, disease=disease)
-                print(f"Disease '{disease}' successfully stored for HID '{hid}'!")
+                if record_diagnosis(chat_history, disease):
+                    print(f"Disease '{disease}' successfully stored for HID '{hid}'!")
             except Exception as e:
                 print(f"Error while storing disease '{disease}' for HID '{hid}': {e}")
 
@@ -91,7 +192,7 @@ class HospitalSearchAPIView(APIView):
 
 class NewsAPIView(APIView):
     def post(self, request, *args, **kwargs):
-        data = json.loads(request.body)
+        data = request.data
         city = data.get("city")
         country = data.get("country")
 
@@ -101,14 +202,55 @@ class NewsAPIView(APIView):
         news = get_news(city, country)
 
         return Response({"city": city, "country": country, "news": news}, status=status.HTTP_200_OK)
-    
+
+    def get(self, request, *args, **kwargs):
+        """Cacheable variant: ?city=...&country=..., with an ETag and a Cache-Control policy."""
+        city = request.query_params.get("city")
+        country = request.query_params.get("country")
+
+        if not city:
+            return Response({"error": "City is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        news = get_news(city, country)
+
+        return conditional_response(request, {"city": city, "country": country, "news": news}, "news")
+
+
+class NewsDigestAPIView(APIView):
+    def post(self, request, *args, **kwargs):
+        """News for several cities from one upstream query, ranked per city."""
+        data = request.data
+        cities = data.get("cities")
+        country = data.get("country")
+
+        if not isinstance(cities, list) or not cities or not all(isinstance(city, str) and city.strip() for city in cities):
+            return Response({"error": "cities must be a non-empty list of city names."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(cities) > MAX_DIGEST_CITIES:
+            return Response({"error": f"At most {MAX_DIGEST_CITIES} cities per digest."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            per_city = int(data.get("per_city", 20))
+        except (TypeError, ValueError):
+            return Response({"error": "per_city must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        digest = get_news_digest(cities, country, per_city=max(1, min(per_city, 100)))
+
+        return Response({"country": country, "cities": digest}, status=status.HTTP_200_OK)
+
 
 class ClusterAPIView(APIView):
+    @idempotent
     def post(self, request, *args, **kwargs):
+        return self.outbreaks(request, request.data)
+
+    def get(self, request, *args, **kwargs):
+        """Cacheable variant: ?year=...&week=..., with an ETag and a Cache-Control policy."""
+        return self.outbreaks(request, request.query_params, conditional=True)
+
+    def outbreaks(self, request, params, conditional=False):
         try:
             # Get year and week from request
-            year = request.data.get('year')
-            week = request.data.get('week')
+            year = params.get('year')
+            week = params.get('week')
             
             # Validate input parameters
             if not year or not week:
@@ -127,19 +269,31 @@ class ClusterAPIView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
+            # A client revalidating a fresh stored result is answered without touching the computation
+            stored = stored_outbreak_data(year, week) if conditional else None
+            if stored is not None and stored[1]:
+                response = not_modified(request, stored[0], "outbreaks", final=is_final_week(year, week))
+                if response is not None:
+                    return response
+
             # Call the function from clusters.py to get the outbreak data
             result = get_outbreak_data(year, week)
             
-            # Check if result is a string (error message)
-            if isinstance(result, str) and "error" in result.lower():
+            # Errors come back as a message string or {"error": ...}
+            if is_outbreak_error(result):
                 return Response(
-                    {"error": result}, 
+                    {"error": result.get("error") if isinstance(result, dict) else result}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
             
             # Return the result
+            if conditional:
+                # Immutable only if this is the stored result: stale fallbacks and partial builds are never stored
+                stored = stored_outbreak_data(year, week)
+                final = is_final_week(year, week) and stored is not None and stored[0] == result
+                return conditional_response(request, result, "outbreaks", final=final)
             return Response(
-                {result}, 
+                result, 
                 status=status.HTTP_200_OK
             )
             
@@ -153,7 +307,7 @@ class ClusterAPIView(APIView):
 
 class ContentAPIView(APIView):
     def post(self, request, *args, **kwargs):
-        data = json.loads(request.body)
+        data = request.data
         hid = data.get("hid")
 
         if not hid:
@@ -162,7 +316,7 @@ class ContentAPIView(APIView):
         # Retrieve conversation history from the database
         try:
             chat_history = ChatHistory.objects.get(hid=hid)
-            response_text = "\n".join(chat_history.conversation.values())  # Combine all responses
+            response_text = "\n".join(load_conversation(chat_history).values())  # Combine all responses
         except ChatHistory.DoesNotExist:
             return Response({"error": "Chat history not found for the given HID."}, status=status.HTTP_404_NOT_FOUND)
 
@@ -170,11 +324,109 @@ class ContentAPIView(APIView):
         disease = extract_disease_from_response(response_text)
 
         # Fetch YouTube videos and Google articles based on the diagnosed disease
-        videos = fetch_youtube_videos(disease)
-        articles = fetch_google_articles(disease)
+        content = get_disease_content(disease)
 
         return Response({
             "disease": disease,
-            "videos": videos,
-            "articles": articles
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+            "videos": content["videos"],
+            "articles": content["articles"]
+        }, status=status.HTTP_200_OK)
+
+    def get(self, request, *args, **kwargs):
+        """Cacheable variant by disease name: ?disease=..., with an ETag and a Cache-Control policy."""
+        disease = canonicalize_disease(request.query_params.get("disease"))
+        if disease == "Unknown":
+            return Response({"error": "disease is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        content = get_disease_content(disease)
+
+        return conditional_response(request, {
+            "disease": disease,
+            "videos": content["videos"],
+            "articles": content["articles"]
+        }, "content")
+
+
+class DiseaseStatsAPIView(APIView):
+    def get(self, request, *args, **kwargs):
+        """Diagnosis counts per disease over a time window, served from the daily rollup."""
+        params = request.query_params
+        disease = params.get("disease")
+        by_day = params.get("by_day", "").lower() in ("1", "true", "yes")
+
+        try:
+            if params.get("start") or params.get("end"):
+                start = date.fromisoformat(params.get("start", ""))
+                end = date.fromisoformat(params.get("end", "")) if params.get("end") else default_window()[1]
+            else:
+                days = int(params.get("days", 7))
+                if not 1 <= days <= MAX_WINDOW_DAYS:
+                    raise ValueError
+                start, end = default_window(days)
+            if start > end or (end - start).days >= MAX_WINDOW_DAYS:
+                raise ValueError
+        except ValueError:
+            return Response(
+                {"error": f"Use 'days' as an integer from 1 to {MAX_WINDOW_DAYS} or 'start'/'end' as YYYY-MM-DD "
+                          f"dates, start not after end and at most {MAX_WINDOW_DAYS} days apart."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if disease:
+            disease = disease_key(disease) or UNKNOWN_DISEASE
+
+        counts = get_disease_counts(start, end, disease=disease, by_day=by_day)
+
+        return Response({
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "disease": disease,
+            "counts": counts
+        }, status=status.HTTP_200_OK)
+
+
+class ExportAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, dataset, *args, **kwargs):
+        """
+        Stream a dataset as NDJSON (gzipped when the client accepts it). Pass the
+        X-Export-High-Water-Mark header of one export as `since` to the next.
+        """
+        fields = request.query_params.get("fields")
+        try:
+            fields = resolve_fields(dataset, [field.strip() for field in fields.split(",")] if fields else None)
+        except ExportError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        since = request.query_params.get("since")
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                return Response({"error": "since must be an ISO-8601 timestamp."}, status=status.HTTP_400_BAD_REQUEST)
+
+        until = high_water_mark()
+        response = StreamingHttpResponse(
+            iter_ndjson(iter_records(dataset, fields, since=since or None, until=until)),
+            content_type="application/x-ndjson",
+        )
+        response["Content-Disposition"] = f'attachment; filename="{dataset}.ndjson"'
+        response["X-Export-High-Water-Mark"] = until.isoformat()
+        return response
+
+
+def metrics_allowed(request):
+    """Staff users, scrapers sending `Authorization: Bearer <METRICS_TOKEN>`, or local scrapers if no token is set."""
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    if METRICS_TOKEN:
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        return hmac.compare_digest(token.encode(), METRICS_TOKEN.encode())
+    return request.META.get("REMOTE_ADDR") in ("127.0.0.1", "::1")
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint for latency histograms, error counts and cache hit ratios."""
+    if not metrics_allowed(request):
+        return HttpResponse("Forbidden\n", status=403, content_type="text/plain; charset=utf-8")
+    return HttpResponse(render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,19 @@
+"""
+Server hooks, read by gunicorn when it is started from this directory:
+
+    gunicorn arogyacard.wsgi --workers 4
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from card import metrics  # noqa: E402  (reads METRICS_MULTIPROC_DIR, possibly from .env)
+
+
+def on_starting(server):
+    # Snapshots left by the previous run would add its counters and gauges to this one's
+    metrics.clear_metrics_dir()
+
+
+def child_exit(server, worker):
+    metrics.retire_worker(worker.pid)